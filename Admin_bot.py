@@ -1,25 +1,106 @@
 # Admin_bot.py
 # База данных + админ-панель для бота-магазина.
 
+import json
 import os
-import sqlite3
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from telebot import types
+import archive
+import catalog_io
+import image_norm
+import media_fetch
+import storage
+from fsm_store import FSMStore
+from geo_index import GridIndex
+from image_health import ImageHealth
+from ingest import OffsetStore
+from outbox import run_in_chat
+import tenants
+
+DB_PATH = os.getenv("DB_PATH", "store.db")   # БД магазина по умолчанию (без TENANTS_FILE)
+# DB_DSN=postgresql://… — та же БД в PostgreSQL (storage.py); читается в tenants.DEFAULT
+
+# Состояние ниже — своё у каждого магазина (tenants.local); фоновые потоки хранилищ
+# открывают БД своего магазина (tenants.bound).
+
+# FSM состояния: {user_id: {action, ...temp fields...}} — хранятся в БД со сроком жизни.
+# Изменённое на месте состояние нужно присвоить обратно: admin_fsm[uid] = st
+admin_fsm = tenants.local(lambda: FSMStore(tenants.bound(connect)))
+
+# Проверка картинок товаров/постов (фоновый обход запускает main.py)
+image_health = tenants.local(lambda: ImageHealth(tenants.bound(connect)))
+
+# Последний обработанный update_id для ingest.poll (переживает перезапуск)
+update_offsets = OffsetStore(lambda: connect())
 
-DB_PATH = os.getenv("DB_PATH", "store.db")
+# ============================ БАЗА ДАННЫХ ============================
 
-# FSM состояния: {user_id: {action, ...temp fields...}}
-admin_fsm = {}
+def db_dsn(shop: tenants.Tenant | None = None) -> str:
+    """DSN БД магазина: PostgreSQL из dsn или путь к файлу SQLite."""
+    shop = shop or tenants.current()
+    return shop.dsn or shop.db_path or DB_PATH
 
-# ============================ БАЗА ДАННЫХ ============================
+def connect():
+    """
+    Соединение с БД текущего магазина (tenants.current()): sqlite3.Connection или
+    соединение из пула PostgreSQL с тем же интерфейсом (storage.py). Закрывает вызывающий —
+    это фабрика для хранилищ (FSMStore, ImageHealth, OffsetStore, archive).
+    """
+    return storage.get(db_dsn()).connect()
 
-def db() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+@contextmanager
+def db():
+    """
+    with db() as con: — соединение текущего магазина, закрывается (в PostgreSQL — возвращается
+    в пул) при любом исходе, в том числе при ошибке SQL. Транзакция внутри — как раньше: with con:.
+    """
+    con = connect()
+    try:
+        yield con
+    finally:
+        con.close()
 
 def init_db():
-    con = db()
+    with db() as con:
+        _create_schema(con)
+        need_backfill = con.execute("SELECT 1 FROM orders WHERE items_snapshot IS NULL LIMIT 1").fetchone()
+    if need_backfill:
+        # заказы из версий без снимков дозаполняются в фоне (миллион заказов — секунды),
+        # до тех пор их позиции читаются из order_items
+        start_snapshot_backfill()
+
+_backfill_running = set()
+_backfill_lock = threading.Lock()
+
+def start_snapshot_backfill():
+    """Фоновое заполнение items_snapshot в БД текущего магазина (не больше одного потока на БД)."""
+    key = db_dsn()
+    with _backfill_lock:
+        if key in _backfill_running:
+            return None
+        _backfill_running.add(key)
+
+    def run():
+        t0 = time.perf_counter()
+        try:
+            with db() as con:
+                n = backfill_order_snapshots(con, batch=BACKFILL_BATCH, pause_s=BACKFILL_PAUSE_MS / 1000)
+            print(f"[init_db] order snapshots backfilled: {n} in {time.perf_counter() - t0:.1f}s")
+        except Exception as e:
+            print(f"[init_db] snapshot backfill error: {e}")
+        finally:
+            with _backfill_lock:
+                _backfill_running.discard(key)
+    th = threading.Thread(target=tenants.bound(run), name="snapshot-backfill", daemon=True)
+    th.start()
+    return th
+
+def _create_schema(con):
     cur = con.cursor()
 
     cur.execute("""
@@ -50,9 +131,13 @@ def init_db():
             title TEXT NOT NULL,
             text TEXT NOT NULL,
             publish_at TEXT,
-            created_at TEXT NOT NULL
+            created_at TEXT NOT NULL,
+            feed_at TEXT             -- COALESCE(publish_at, created_at): ключ ленты
         )
     """)
+    _ensure_column(cur, "posts", "feed_at", "TEXT")
+    cur.execute("UPDATE posts SET feed_at = COALESCE(publish_at, created_at) WHERE feed_at IS NULL")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_posts_feed ON posts(feed_at, id)")
 
     cur.execute("""
         CREATE TABLE IF NOT EXISTS settings (
@@ -67,6 +152,8 @@ def init_db():
             address TEXT NOT NULL
         )
     """)
+    _ensure_column(cur, "pickup_points", "lat", "REAL")
+    _ensure_column(cur, "pickup_points", "lon", "REAL")
 
     cur.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -76,6 +163,8 @@ def init_db():
             address TEXT
         )
     """)
+    _ensure_column(cur, "users", "lat", "REAL")
+    _ensure_column(cur, "users", "lon", "REAL")
 
     cur.execute("""
         CREATE TABLE IF NOT EXISTS orders (
@@ -85,9 +174,15 @@ def init_db():
             total REAL NOT NULL DEFAULT 0,
             status TEXT NOT NULL DEFAULT 'Принят',
             created_at TEXT NOT NULL,
+            items_snapshot TEXT,
+            update_id INTEGER,               -- апдейт Telegram, создавший заказ (идемпотентность)
             FOREIGN KEY(user_id) REFERENCES users(user_id)
         )
     """)
+    _ensure_column(cur, "orders", "items_snapshot", "TEXT")
+    _ensure_column(cur, "orders", "update_id", "INTEGER")
+    # повторная доставка того же апдейта после сбоя не создаёт второй заказ
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_update ON orders(update_id) WHERE update_id IS NOT NULL")
 
     cur.execute("""
         CREATE TABLE IF NOT EXISTS order_items (
@@ -107,44 +202,135 @@ def init_db():
             chat_id INTEGER NOT NULL,
             text TEXT NOT NULL,
             send_at TEXT NOT NULL,
-            sent INTEGER NOT NULL DEFAULT 0
+            sent INTEGER NOT NULL DEFAULT 0,
+            topic TEXT                       -- ключ схлопывания: новое по (chat_id, topic) заменяет старое
+        )
+    """)
+    _ensure_column(cur, "notifications", "topic", "TEXT")
+    # Неотправленное уведомление по (chat_id, topic) — одно: на индекс опирается upsert в notify_many.
+    # Дубли из старых версий (UPDATE, затем INSERT без блокировки) — оставляем последнее.
+    cur.execute("""
+        DELETE FROM notifications WHERE sent=0 AND topic IS NOT NULL AND id NOT IN (
+            SELECT MAX(id) FROM notifications WHERE sent=0 AND topic IS NOT NULL GROUP BY chat_id, topic)
+    """)
+    cur.execute("DROP INDEX IF EXISTS idx_notifications_pending")
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_notifications_topic ON notifications(chat_id, topic)
+        WHERE sent=0 AND topic IS NOT NULL
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_notifications_due ON notifications(send_at) WHERE sent=0")
+
+    # Корзины, вытесненные из памяти по простою (cart_store.CartStore)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS saved_carts (
+            user_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            qty INTEGER NOT NULL,
+            saved_at TEXT NOT NULL,
+            PRIMARY KEY(user_id, product_id)
+        )
+    """)
+
+    # Пошаговые состояния (fsm_store.FSMStore)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            user_id INTEGER PRIMARY KEY,
+            state TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_expires ON fsm_states(expires_at)")
+
+    # Последний полностью обработанный апдейт (ingest.OffsetStore)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS update_offsets (
+            name TEXT PRIMARY KEY,
+            update_id INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS image_health (
+            url TEXT PRIMARY KEY,
+            status TEXT NOT NULL,            -- ok | slow | bad
+            http_status INTEGER,
+            latency_ms REAL,
+            content_type TEXT,
+            size INTEGER,
+            resolved_url TEXT,               -- og:image для HTML-страниц
+            error TEXT,
+            checked_at REAL NOT NULL,
+            fail_count INTEGER NOT NULL DEFAULT 0,
+            next_check REAL NOT NULL
         )
     """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_image_health_next ON image_health(next_check)")
+
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at)")
+
+    # Архив заказов (archive.py): какие месяцы вынесены и у кого там заказы —
+    # чтобы чтение подключало только нужные файлы
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS order_archives (
+            month TEXT PRIMARY KEY,          -- YYYY-MM, файл archive/<store>-orders-YYYY-MM.db
+            orders INTEGER NOT NULL,
+            min_id INTEGER NOT NULL,
+            max_id INTEGER NOT NULL,
+            min_created TEXT NOT NULL,
+            max_created TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS archived_user_months (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            PRIMARY KEY(user_id, month)
+        ) WITHOUT ROWID
+    """)
+    # Пустой в штатном режиме: быстрый поиск заказов без снимка для дозаполнения
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_no_snapshot ON orders(id) WHERE items_snapshot IS NULL")
 
     # Значения по умолчанию
     cur.execute("INSERT OR IGNORE INTO settings(key,value) VALUES ('min_delivery_sum','0')")
 
     con.commit()
-    cur.close(); con.close()
+    cur.close()
+
+def _ensure_column(cur, table: str, column: str, decl: str):
+    """Миграция: добавить колонку в существующую таблицу, если её ещё нет."""
+    if column not in storage.columns(cur, table):
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
 
 # ============================ CRUD: категории/товары/публикации ============================
 
 def add_category(name: str) -> int:
-    con = db(); cur = con.cursor()
-    cur.execute("INSERT INTO categories(name) VALUES (?)", (name.strip(),))
-    con.commit(); cid = cur.lastrowid
-    cur.close(); con.close()
+    with db() as con:
+        cid = con.execute("INSERT INTO categories(name) VALUES (?) RETURNING id", (name.strip(),)).fetchone()[0]
+        con.commit()
+    invalidate_catalog()
     return cid
 
 def list_categories():
-    con = db()
-    rows = con.execute("SELECT id, name FROM categories ORDER BY name COLLATE NOCASE").fetchall()
-    con.close()
+    with db() as con:
+        rows = con.execute("SELECT id, name FROM categories ORDER BY name COLLATE NOCASE").fetchall()
     return [dict(r) for r in rows]
 
 def delete_category(cat_id: int):
-    con = db()
-    con.execute("DELETE FROM categories WHERE id=?", (cat_id,))
-    con.commit(); con.close()
+    with db() as con:
+        con.execute("DELETE FROM categories WHERE id=?", (cat_id,))
+        con.commit()
+    invalidate_catalog()
 
 def add_product(name: str, price: float, min_qty: int, image: str, description: str, category_id: int) -> int:
-    con = db(); cur = con.cursor()
-    cur.execute("""
-        INSERT INTO products(name, price, min_qty, image, description, category_id)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (name.strip(), float(price), int(min_qty), image.strip(), description.strip(), int(category_id)))
-    con.commit(); pid = cur.lastrowid
-    cur.close(); con.close()
+    with db() as con:
+        pid = con.execute("""
+            INSERT INTO products(name, price, min_qty, image, description, category_id)
+            VALUES (?, ?, ?, ?, ?, ?) RETURNING id
+        """, (name.strip(), float(price), int(min_qty), image.strip(), description.strip(), int(category_id))).fetchone()[0]
+        con.commit()
+    invalidate_catalog()
     return pid
 
 def update_product(pid: int, **fields):
@@ -156,137 +342,313 @@ def update_product(pid: int, **fields):
             set_parts.append(f"{k}=?"); vals.append(v)
     if not set_parts: return
     vals.append(pid)
-    con = db(); con.execute(f"UPDATE products SET {', '.join(set_parts)} WHERE id=?", vals)
-    con.commit(); con.close()
+    with db() as con:
+        con.execute(f"UPDATE products SET {', '.join(set_parts)} WHERE id=?", vals)
+        con.commit()
+    invalidate_catalog()
 
 def delete_product(pid: int):
-    con = db(); con.execute("DELETE FROM products WHERE id=?", (pid,))
-    con.commit(); con.close()
+    with db() as con:
+        con.execute("DELETE FROM products WHERE id=?", (pid,))
+        con.commit()
+    invalidate_catalog()
 
 def list_products(cat_id: int):
-    con = db()
-    rows = con.execute("""
-        SELECT id, name, price, min_qty, image, description, category_id
-        FROM products
-        WHERE category_id=?
-        ORDER BY name COLLATE NOCASE
-    """, (cat_id,)).fetchall()
-    con.close()
+    with db() as con:
+        rows = con.execute("""
+            SELECT id, name, price, min_qty, image, description, category_id
+            FROM products
+            WHERE category_id=?
+            ORDER BY name COLLATE NOCASE
+        """, (cat_id,)).fetchall()
     return [dict(r) for r in rows]
 
 def get_product(pid: int):
-    con = db()
-    r = con.execute("""
-        SELECT id, name, price, min_qty, image, description, category_id
-        FROM products WHERE id=?
-    """, (pid,)).fetchone()
-    con.close()
+    with db() as con:
+        r = con.execute("""
+            SELECT id, name, price, min_qty, image, description, category_id
+            FROM products WHERE id=?
+        """, (pid,)).fetchone()
     return dict(r) if r else None
 
 def add_post(ptype: str, image: str, title: str, text: str, publish_at: str|None):
     now_iso = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    con = db(); cur = con.cursor()
-    cur.execute("""
-        INSERT INTO posts(type, image, title, text, publish_at, created_at)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (ptype.strip(), image.strip(), title.strip(), text.strip(), publish_at, now_iso))
-    con.commit(); pid = cur.lastrowid
-    cur.close(); con.close()
+    with db() as con:
+        pid = con.execute("""
+            INSERT INTO posts(type, image, title, text, publish_at, created_at, feed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING id
+        """, (ptype.strip(), image.strip(), title.strip(), text.strip(), publish_at, now_iso, publish_at or now_iso)).fetchone()[0]
+        con.commit()
+    invalidate_feed()
     return pid
 
-def list_posts():
-    con = db()
-    rows = con.execute("""
+def list_posts(limit: int | None = None):
+    """Все публикации, включая запланированные (для админки)."""
+    sql = """
         SELECT id, type, image, title, text, publish_at, created_at
         FROM posts
-        ORDER BY COALESCE(publish_at, created_at) DESC, id DESC
-    """).fetchall()
-    con.close()
+        ORDER BY feed_at DESC, id DESC
+    """
+    params = ()
+    if limit:
+        sql += " LIMIT ?"; params = (int(limit),)
+    with db() as con:
+        rows = con.execute(sql, params).fetchall()
     return [dict(r) for r in rows]
 
 def get_post(post_id: int):
-    con = db()
-    r = con.execute("""
-        SELECT id, type, image, title, text, publish_at, created_at
-        FROM posts WHERE id=?
-    """, (post_id,)).fetchone()
-    con.close()
+    with db() as con:
+        r = con.execute("""
+            SELECT id, type, image, title, text, publish_at, created_at, feed_at
+            FROM posts WHERE id=?
+        """, (post_id,)).fetchone()
     return dict(r) if r else None
 
 def delete_post(post_id: int):
-    con = db(); con.execute("DELETE FROM posts WHERE id=?", (post_id,))
-    con.commit(); con.close()
+    with db() as con:
+        con.execute("DELETE FROM posts WHERE id=?", (post_id,))
+        con.commit()
+    invalidate_feed()
+
+# ============================ Лента публикаций ============================
+# Опубликованные (feed_at <= сейчас) от новых к старым, постранично по ключу (feed_at, id):
+# каждая страница — один проход по индексу idx_posts_feed, сколько бы постов ни накопилось.
+# Первая страница кэшируется до add_post/delete_post или до наступления ближайшего
+# запланированного поста. Как и у каталога, страница, прочитанная до invalidate_feed(),
+# в кэш не ставится (поколение feed_gen).
+
+FEED_PAGE = int(os.getenv("FEED_PAGE", "10"))
+
+# снимки по магазинам: "feed_first" — (posts, has_more, valid_until | None), "catalog" — см. ниже;
+# "feed_gen" / "catalog_gen" — поколения, растут при каждой инвалидации
+_snapshots = tenants.local(lambda: {"feed_first": None, "catalog": None, "feed_gen": 0, "catalog_gen": 0})
+_feed_lock = threading.Lock()
+
+def _now_iso() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def list_feed(before_id: int | None = None, limit: int = FEED_PAGE, now_iso: str | None = None):
+    """Страница ленты: (posts, has_more). before_id — последний пост предыдущей страницы."""
+    with db() as con:
+        # Граница страницы — пара (feed_at, id): одно сравнение кортежей SQLite берёт
+        # как диапазон индекса и идёт по нему от границы вниз ровно на limit+1 строк.
+        if before_id is None:
+            bound = (now_iso or _now_iso(), 2 ** 62)
+        else:
+            r = con.execute("SELECT feed_at, id FROM posts WHERE id=?", (before_id,)).fetchone()
+            if r is None:
+                return [], False
+            bound = (min(r["feed_at"], now_iso or _now_iso()), r["id"])
+        rows = con.execute("""
+            SELECT id, type, image, title, text, publish_at, created_at, feed_at
+            FROM posts
+            WHERE (feed_at, id) < (?, ?)
+            ORDER BY feed_at DESC, id DESC
+            LIMIT ?
+        """, (bound[0], bound[1], limit + 1)).fetchall()
+    posts = [dict(r) for r in rows[:limit]]
+    return posts, len(rows) > limit
+
+def next_scheduled_post_at(now_iso: str | None = None):
+    with db() as con:
+        r = con.execute("SELECT MIN(feed_at) FROM posts WHERE feed_at > ?", (now_iso or _now_iso(),)).fetchone()
+    return r[0] if r else None
+
+def invalidate_feed():
+    with _feed_lock:
+        _snapshots["feed_first"] = None
+        _snapshots["feed_gen"] += 1
+
+def feed_first_page():
+    now_iso = _now_iso()
+    with _feed_lock:
+        cached, gen = _snapshots["feed_first"], _snapshots["feed_gen"]
+    if cached is not None and (cached[2] is None or now_iso < cached[2]):
+        return cached[0], cached[1]
+    posts, has_more = list_feed(now_iso=now_iso)
+    entry = (posts, has_more, next_scheduled_post_at(now_iso))
+    with _feed_lock:
+        if _snapshots["feed_gen"] == gen:
+            _snapshots["feed_first"] = entry
+    return posts, has_more
+
+def is_post_published(post: dict) -> bool:
+    return bool(post) and (post.get("feed_at") or "") <= _now_iso()
 
 # ============================ Настройки / Пункты раздачи ============================
 
 def set_min_delivery_sum(value: float):
-    con = db()
-    con.execute("""
-        INSERT INTO settings(key,value) VALUES('min_delivery_sum', ?)
-        ON CONFLICT(key) DO UPDATE SET value=excluded.value
-    """, (str(float(value)),))
-    con.commit(); con.close()
+    with db() as con:
+        con.execute("""
+            INSERT INTO settings(key,value) VALUES('min_delivery_sum', ?)
+            ON CONFLICT(key) DO UPDATE SET value=excluded.value
+        """, (str(float(value)),))
+        con.commit()
+    invalidate_catalog()
 
 def get_min_delivery_sum() -> float:
-    con = db()
-    r = con.execute("SELECT value FROM settings WHERE key='min_delivery_sum'").fetchone()
-    con.close()
+    with db() as con:
+        r = con.execute("SELECT value FROM settings WHERE key='min_delivery_sum'").fetchone()
     try:
         return float(r["value"]) if r and r["value"] is not None else 0.0
     except Exception:
         return 0.0
 
-def add_pickup_point(address: str) -> int:
-    con = db(); cur = con.cursor()
-    cur.execute("INSERT INTO pickup_points(address) VALUES (?)", (address.strip(),))
-    con.commit(); pid = cur.lastrowid
-    cur.close(); con.close()
+def add_pickup_point(address: str, lat: float | None = None, lon: float | None = None) -> int:
+    with db() as con:
+        pid = con.execute("INSERT INTO pickup_points(address, lat, lon) VALUES (?, ?, ?) RETURNING id",
+                          (address.strip(), lat, lon)).fetchone()[0]
+        con.commit()
+    invalidate_catalog()
     return pid
 
 def delete_pickup_point(pid: int):
-    con = db(); con.execute("DELETE FROM pickup_points WHERE id=?", (pid,))
-    con.commit(); con.close()
+    with db() as con:
+        con.execute("DELETE FROM pickup_points WHERE id=?", (pid,))
+        con.commit()
+    invalidate_catalog()
 
 def list_pickup_points():
-    con = db()
-    rows = con.execute("SELECT id, address FROM pickup_points ORDER BY id DESC").fetchall()
-    con.close()
+    with db() as con:
+        rows = con.execute("SELECT id, address, lat, lon FROM pickup_points ORDER BY id DESC").fetchall()
     return [dict(r) for r in rows]
 
+_COORDS_RE = re.compile(r"[|;]\s*([-+]?\d{1,2}(?:\.\d+)?)\s*,\s*([-+]?\d{1,3}(?:\.\d+)?)\s*$")
+
+def parse_pickup_input(text: str):
+    """'Адрес | 44.8125, 20.4612' -> (адрес, lat, lon); без координат -> (адрес, None, None)."""
+    text = (text or "").strip()
+    m = _COORDS_RE.search(text)
+    if m:
+        lat, lon = float(m.group(1)), float(m.group(2))
+        if -90 <= lat <= 90 and -180 <= lon <= 180:
+            return text[:m.start()].strip(), lat, lon
+    return text, None, None
+
 # ============================ Профиль пользователя ============================
 
 def upsert_username(user_id: int, username: str|None):
-    con = db()
-    con.execute("""
-        INSERT INTO users(user_id, username) VALUES (?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET username=excluded.username
-    """, (user_id, username))
-    con.commit(); con.close()
+    with db() as con:
+        con.execute("""
+            INSERT INTO users(user_id, username) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET username=excluded.username
+        """, (user_id, username))
+        con.commit()
 
 def get_profile(user_id: int):
-    con = db()
-    r = con.execute("SELECT user_id, username, phone, address FROM users WHERE user_id=?", (user_id,)).fetchone()
-    con.close()
-    if r:
-        return dict(r)
-    con = db()
-    con.execute("INSERT OR IGNORE INTO users(user_id) VALUES (?)", (user_id,))
-    con.commit(); con.close()
+    with db() as con:
+        r = con.execute("SELECT user_id, username, phone, address FROM users WHERE user_id=?", (user_id,)).fetchone()
+        if r:
+            return dict(r)
+        con.execute("INSERT OR IGNORE INTO users(user_id) VALUES (?)", (user_id,))
+        con.commit()
     return {"user_id": user_id, "username": None, "phone": None, "address": None}
 
 def set_profile_phone(user_id: int, phone: str):
-    con = db(); con.execute("UPDATE users SET phone=? WHERE user_id=?", (phone.strip(), user_id))
-    con.commit(); con.close()
+    with db() as con:
+        con.execute("UPDATE users SET phone=? WHERE user_id=?", (phone.strip(), user_id))
+        con.commit()
 
 def set_profile_address(user_id: int, address: str):
-    con = db(); con.execute("UPDATE users SET address=? WHERE user_id=?", (address.strip(), user_id))
-    con.commit(); con.close()
+    with db() as con:
+        con.execute("UPDATE users SET address=? WHERE user_id=?", (address.strip(), user_id))
+        con.commit()
+
+def set_profile_location(user_id: int, lat: float, lon: float):
+    with db() as con:
+        con.execute("INSERT OR IGNORE INTO users(user_id) VALUES (?)", (user_id,))
+        con.execute("UPDATE users SET lat=?, lon=? WHERE user_id=?", (lat, lon, user_id))
+        con.commit()
+
+def get_profile_location(user_id: int):
+    """(lat, lon) из профиля или None."""
+    with db() as con:
+        r = con.execute("SELECT lat, lon FROM users WHERE user_id=?", (user_id,)).fetchone()
+    return (r["lat"], r["lon"]) if r and r["lat"] is not None and r["lon"] is not None else None
+
+# ============================ Сохранённые корзины ============================
+
+def save_cart(user_id: int, items):
+    """items: [(product_id, qty), ...] — заменяет ранее сохранённую корзину."""
+    now_iso = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with db() as con, con:
+        con.execute("DELETE FROM saved_carts WHERE user_id=?", (user_id,))
+        con.executemany("""
+            INSERT INTO saved_carts(user_id, product_id, qty, saved_at) VALUES (?, ?, ?, ?)
+        """, [(user_id, pid, qty, now_iso) for pid, qty in items])
+
+def pop_saved_cart(user_id: int):
+    """Забирает сохранённую корзину (с удалением из БД): [(product_id, qty), ...]."""
+    with db() as con, con:
+        rows = con.execute("SELECT product_id, qty FROM saved_carts WHERE user_id=?", (user_id,)).fetchall()
+        if rows:
+            con.execute("DELETE FROM saved_carts WHERE user_id=?", (user_id,))
+    return [(r["product_id"], r["qty"]) for r in rows]
 
 # ============================ Заказы ============================
 
 ORDER_STATUSES = ["Принят", "Сборка", "Доставка"]
 
-def record_order(user_id: int, cart: dict, get_product_func, chat_id: int|None=None) -> int:
+# Снимок позиций хранится в orders.items_snapshot компактным JSON: [[product_id, name, qty, price], ...].
+# История, «Повторить» и карточки заказа в админке читают одну строку заказа и не зависят от
+# последующих правок/удаления товаров. order_items остаётся источником для отчётов.
+
+def _pack_items(items) -> str:
+    return json.dumps([[pid, name, qty, price] for (pid, name, qty, price) in items],
+                      ensure_ascii=False, separators=(",", ":"))
+
+def _unpack_items(raw: str | None) -> list | None:
+    if not raw:
+        return None
+    try:
+        return [{"product_id": pid, "name": name, "qty": qty, "price": price}
+                for pid, name, qty, price in json.loads(raw)]
+    except (ValueError, TypeError):
+        return None
+
+def _order_row(r) -> dict:
+    o = dict(r)
+    items = _unpack_items(o.pop("items_snapshot", None))
+    o["items"] = items if items is not None else get_order_items(o["id"])
+    return o
+
+BACKFILL_BATCH = int(os.getenv("BACKFILL_BATCH", "2000"))       # заказов на транзакцию в фоне
+BACKFILL_PAUSE_MS = int(os.getenv("BACKFILL_PAUSE_MS", "20"))   # пауза между пачками — для записей бота
+
+def backfill_order_snapshots(con, batch: int = 20000, pause_s: float = 0.0) -> int:
+    """Заполнить items_snapshot у старых заказов (пачками по id). Возвращает число заказов."""
+    total = 0
+    while True:
+        ids = [r[0] for r in con.execute(
+            "SELECT id FROM orders WHERE items_snapshot IS NULL ORDER BY id LIMIT ?", (batch,))]
+        if not ids:
+            return total
+        with con:
+            con.execute("""
+                UPDATE orders SET items_snapshot = COALESCE((
+                    SELECT json_group_array(json_array(
+                               oi.product_id, COALESCE(p.name, 'Товар #' || oi.product_id), oi.qty, oi.price))
+                    FROM order_items oi
+                    LEFT JOIN products p ON p.id = oi.product_id
+                    WHERE oi.order_id = orders.id
+                ), '[]')
+                WHERE id BETWEEN ? AND ? AND items_snapshot IS NULL
+            """, (ids[0], ids[-1]))
+        total += len(ids)
+        if pause_s:
+            time.sleep(pause_s)
+
+def record_order(user_id: int, cart: dict, get_product_func, chat_id: int|None=None,
+                 update_id: int|None=None) -> int:
+    """
+    Создать заказ из корзины. update_id — апдейт, оформивший заказ: если заказ по нему
+    уже есть (апдейт пришёл повторно после перезапуска), возвращается его id.
+    """
+    if update_id is not None:
+        existing = order_for_update(update_id)
+        if existing:
+            print(f"[orders] update {update_id} already recorded as order #{existing}")
+            return existing
     if not cart: return 0
     total = 0.0; items = []
     for pid, qty in cart.items():
@@ -294,121 +656,376 @@ def record_order(user_id: int, cart: dict, get_product_func, chat_id: int|None=N
         if not p: continue
         price = float(p["price"])
         total += price * qty
-        items.append((pid, qty, price))
+        items.append((pid, p["name"], qty, price))
     if not items: return 0
 
-    con = db(); cur = con.cursor()
     now_iso = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cur.execute("""
-        INSERT INTO orders(user_id, chat_id, total, status, created_at)
-        VALUES (?, ?, ?, 'Принят', ?)
-    """, (user_id, chat_id, total, now_iso))
-    order_id = cur.lastrowid
-
-    cur.executemany("""
-        INSERT INTO order_items(order_id, product_id, qty, price)
-        VALUES (?, ?, ?, ?)
-    """, [(order_id, pid, qty, price) for (pid, qty, price) in items])
-
-    con.commit(); cur.close(); con.close()
-    return order_id
+    with db() as con:
+        try:
+            order_id = con.execute("""
+                INSERT INTO orders(user_id, chat_id, total, status, created_at, items_snapshot, update_id)
+                VALUES (?, ?, ?, 'Принят', ?, ?, ?) RETURNING id
+            """, (user_id, chat_id, total, now_iso, _pack_items(items), update_id)).fetchone()[0]
+        except storage.IntegrityError:
+            # тот же апдейт параллельно уже записал заказ
+            con.rollback()
+            order_id = None
+        else:
+            con.executemany("""
+                INSERT INTO order_items(order_id, product_id, qty, price)
+                VALUES (?, ?, ?, ?)
+            """, [(order_id, pid, qty, price) for (pid, _, qty, price) in items])
+            con.commit()
+    return order_id if order_id is not None else order_for_update(update_id)
+
+def order_for_update(update_id: int) -> int | None:
+    with db() as con:
+        r = con.execute("SELECT id FROM orders WHERE update_id=?", (update_id,)).fetchone()
+    return r[0] if r else None
 
 def list_orders_by_status(status: str):
-    con = db()
-    rows = con.execute("""
-        SELECT o.id, o.user_id, o.chat_id, o.total, o.status, o.created_at,
-               u.username
-        FROM orders o
-        LEFT JOIN users u ON u.user_id = o.user_id
-        WHERE o.status=?
-        ORDER BY o.created_at DESC, o.id DESC
-    """, (status,)).fetchall()
-    con.close()
-    return [dict(r) for r in rows]
+    with db() as con:
+        rows = con.execute("""
+            SELECT o.id, o.user_id, o.chat_id, o.total, o.status, o.created_at, o.items_snapshot,
+                   u.username
+            FROM orders o
+            LEFT JOIN users u ON u.user_id = o.user_id
+            WHERE o.status=?
+            ORDER BY o.created_at DESC, o.id DESC
+        """, (status,)).fetchall()
+    return [_order_row(r) for r in rows]
 
 def list_orders_by_user(user_id: int, limit: int = 10):
     """
     Возвращает последние заказы пользователя:
-    [{id, user_id, chat_id, total, status, created_at, username}]
+    [{id, user_id, chat_id, total, status, created_at, username, items}]
+    Если в рабочей БД их меньше limit — дочитывает из архивов (archive.py), от новых к старым.
     """
-    con = db()
-    rows = con.execute("""
-        SELECT o.id, o.user_id, o.chat_id, o.total, o.status, o.created_at,
-               u.username
-        FROM orders o
-        LEFT JOIN users u ON u.user_id = o.user_id
-        WHERE o.user_id = ?
-        ORDER BY o.created_at DESC, o.id DESC
-        LIMIT ?
-    """, (user_id, int(limit))).fetchall()
-    con.close()
-    return [dict(r) for r in rows]
+    with db() as con:
+        rows = con.execute("""
+            SELECT o.id, o.user_id, o.chat_id, o.total, o.status, o.created_at, o.items_snapshot,
+                   u.username
+            FROM orders o
+            LEFT JOIN users u ON u.user_id = o.user_id
+            WHERE o.user_id = ?
+            ORDER BY o.created_at DESC, o.id DESC
+            LIMIT ?
+        """, (user_id, int(limit))).fetchall()
+        if len(rows) < limit:
+            for months in archive.groups(archive.months_for_user(con, user_id)):
+                with archive.attached(con, months) as schemas:
+                    if not schemas:
+                        continue
+                    union = " UNION ALL ".join(f"""
+                        SELECT o.id, o.user_id, o.chat_id, o.total, o.status, o.created_at, o.items_snapshot,
+                               u.username
+                        FROM {s}.orders o
+                        LEFT JOIN main.users u ON u.user_id = o.user_id
+                        WHERE o.user_id = ?""" for s in schemas)
+                    rows += con.execute(f"{union} ORDER BY created_at DESC, id DESC LIMIT ?",
+                                        [user_id] * len(schemas) + [int(limit) - len(rows)]).fetchall()
+                if len(rows) >= limit:
+                    break
+    return [_order_row(r) for r in rows]
+
+def _from_archive(con, order_id: int, sql: str, one: bool):
+    """Запрос sql ({s} — схема архива) по архивам, где может лежать заказ order_id."""
+    for months in archive.groups(archive.months_for_order(con, order_id)):
+        with archive.attached(con, months) as schemas:
+            for s in schemas:
+                cur = con.execute(sql.format(s=s), (order_id,))
+                res = cur.fetchone() if one else cur.fetchall()
+                if res:
+                    return res
+    return None if one else []
+
+_ITEMS_SQL = """
+    SELECT oi.product_id, oi.qty, oi.price, COALESCE(p.name, 'Товар #' || oi.product_id) AS name
+    FROM {s}.order_items oi
+    LEFT JOIN main.products p ON p.id = oi.product_id
+    WHERE oi.order_id=?
+"""
+
+_ORDER_SQL = """
+    SELECT o.id, o.user_id, o.chat_id, o.total, o.status, o.created_at, o.items_snapshot,
+           u.username
+    FROM {s}.orders o
+    LEFT JOIN main.users u ON u.user_id=o.user_id
+    WHERE o.id=?
+"""
 
 def get_order_items(order_id: int):
-    con = db()
-    rows = con.execute("""
-        SELECT oi.product_id, oi.qty, oi.price, p.name
-        FROM order_items oi
-        LEFT JOIN products p ON p.id = oi.product_id
-        WHERE oi.order_id=?
-    """, (order_id,)).fetchall()
-    con.close()
+    with db() as con:
+        rows = con.execute(_ITEMS_SQL.format(s="main"), (order_id,)).fetchall() \
+            or _from_archive(con, order_id, _ITEMS_SQL, one=False)
     return [dict(r) for r in rows]
 
 def get_order(order_id: int):
-    con = db()
-    r = con.execute("""
-        SELECT o.id, o.user_id, o.chat_id, o.total, o.status, o.created_at,
-               u.username
-        FROM orders o
-        LEFT JOIN users u ON u.user_id=o.user_id
-        WHERE o.id=?
-    """, (order_id,)).fetchone()
-    con.close()
-    return dict(r) if r else None
+    """
+    Заказ вместе с позициями из снимка: {..., items: [{product_id, name, qty, price}], archived}.
+    Заказа нет в рабочей БД — ищется в архиве (archive.py); архивный заказ только для чтения.
+    """
+    with db() as con:
+        r = con.execute(_ORDER_SQL.format(s="main"), (order_id,)).fetchone()
+        archived = r is None
+        if archived:
+            r = _from_archive(con, order_id, _ORDER_SQL, one=True)
+    if not r:
+        return None
+    o = _order_row(r)
+    o["archived"] = archived
+    return o
+
+def update_order_status(order_id: int, new_status: str) -> bool:
+    """False — заказа нет в рабочей БД (удалён или перенесён в архив): статус не меняется."""
+    with db() as con:
+        n = con.execute("UPDATE orders SET status=? WHERE id=?", (new_status, order_id)).rowcount
+        con.commit()
+    return n > 0
+
+# ---------- Массовая смена статуса ----------
+# Выборка задаётся либо списком id, либо «все в статусе до момента before» (created_at <= before).
+# Условие status=from_status входит в UPDATE: заказы, которые кто-то уже перевёл, не трогаются.
+
+BULK_PAGE = int(os.getenv("BULK_PAGE", "20"))
+
+def _bulk_where(from_status: str, ids=None, before: str | None = None):
+    where, params = ["status=?"], [from_status]
+    if ids is not None:
+        where.append("id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps([int(i) for i in ids]))
+    if before:
+        where.append("created_at <= ?")
+        params.append(before)
+    return " AND ".join(where), params
+
+def list_orders_page(status: str, offset: int = 0, limit: int = BULK_PAGE):
+    """Лёгкий список для выбора: без позиций заказа."""
+    with db() as con:
+        rows = con.execute("""
+            SELECT o.id, o.user_id, o.total, o.created_at, u.username
+            FROM orders o
+            LEFT JOIN users u ON u.user_id = o.user_id
+            WHERE o.status=?
+            ORDER BY o.created_at, o.id
+            LIMIT ? OFFSET ?
+        """, (status, limit, offset)).fetchall()
+    return [dict(r) for r in rows]
+
+def count_orders(status: str, ids=None, before: str | None = None) -> int:
+    where, params = _bulk_where(status, ids, before)
+    with db() as con:
+        n = con.execute(f"SELECT COUNT(*) FROM orders WHERE {where}", params).fetchone()[0]
+    return n
 
-def update_order_status(order_id: int, new_status: str):
-    con = db()
-    con.execute("UPDATE orders SET status=? WHERE id=?", (new_status, order_id))
-    con.commit(); con.close()
+def bulk_update_order_status(from_status: str, to_status: str, ids=None, before: str | None = None) -> list:
+    """
+    Перевести выбранные заказы из from_status в to_status одним UPDATE.
+    Возвращает [{"id", "chat_id"}] реально переведённых заказов (RETURNING того же UPDATE).
+    """
+    if ids is not None and not ids:
+        return []
+    where, params = _bulk_where(from_status, ids, before)
+    with db() as con, con:
+        moved = [dict(r) for r in con.execute(
+            f"UPDATE orders SET status=? WHERE {where} RETURNING id, chat_id", [to_status] + params).fetchall()]
+    return sorted(moved, key=lambda r: r["id"])
 
 # ============================ Уведомления (планировщик) ============================
+# Время send_at — UTC (планировщик сравнивает с datetime.utcnow()).
+# notify(): уведомление с темой (topic) ждёт NOTIFY_WINDOW_S; новое по тому же
+# (chat_id, topic) до отправки заменяет текст, а срок не сдвигает — задержка не больше окна.
+# Планировщик склеивает все созревшие уведомления одного чата в одно сообщение.
+
+NOTIFY_WINDOW_S = int(os.getenv("NOTIFY_WINDOW_S", "30"))
+NOTIFY_MAX_LEN = 4000                     # лимит Telegram — 4096 символов
+
+notification_stats = {"queued": 0, "superseded": 0, "sent_rows": 0, "sent_messages": 0}
+
+def schedule_notification(chat_id: int, text: str, send_at: datetime, topic: str | None = None):
+    with db() as con:
+        con.execute("""
+            INSERT INTO notifications(chat_id, text, send_at, sent, topic)
+            VALUES (?, ?, ?, 0, ?)
+        """, (chat_id, text, send_at.strftime("%Y-%m-%d %H:%M:%S"), topic))
+        con.commit()
 
-def schedule_notification(chat_id: int, text: str, send_at: datetime):
-    con = db(); cur = con.cursor()
-    cur.execute("""
-        INSERT INTO notifications(chat_id, text, send_at, sent)
-        VALUES (?, ?, ?, 0)
-    """, (chat_id, text, send_at.strftime("%Y-%m-%d %H:%M:%S")))
-    con.commit(); cur.close(); con.close()
+def notify(chat_id: int, text: str, topic: str | None = None, window_s: int | None = None):
+    """Уведомление в чат через окно схлопывания (см. выше)."""
+    notify_many([(chat_id, text, topic)], window_s)
+
+def notify_many(items, window_s: int | None = None):
+    """Пачка уведомлений [(chat_id, text, topic)] одной транзакцией."""
+    window_s = NOTIFY_WINDOW_S if window_s is None else window_s
+    send_at = (datetime.utcnow() + timedelta(seconds=window_s)).strftime("%Y-%m-%d %H:%M:%S")
+    queued = superseded = 0
+    with db() as con:
+        with con:
+            for chat_id, text, topic in items:
+                replaced = 0
+                if topic is not None:
+                    replaced = con.execute(
+                        "UPDATE notifications SET text=? WHERE chat_id=? AND topic=? AND sent=0",
+                        (text, chat_id, topic)).rowcount
+                if replaced:
+                    superseded += 1
+                    continue
+                # строку могла вставить параллельная транзакция — тогда тоже заменяем текст
+                con.execute("""
+                    INSERT INTO notifications(chat_id, text, send_at, sent, topic)
+                    VALUES (?, ?, ?, 0, ?)
+                    ON CONFLICT(chat_id, topic) WHERE sent=0 AND topic IS NOT NULL
+                    DO UPDATE SET text=excluded.text
+                """, (chat_id, text, send_at, topic))
+                queued += 1
+    notification_stats["queued"] += queued
+    notification_stats["superseded"] += superseded
 
 def fetch_due_notifications(now_dt: datetime):
+    """
+    Забрать созревшие уведомления: помечаются отправленными и возвращаются одним
+    UPDATE … RETURNING, так что два планировщика не получат одну строку дважды.
+    """
     now_iso = now_dt.strftime("%Y-%m-%d %H:%M:%S")
-    con = db(); cur = con.cursor()
-    rows = cur.execute("""
-        SELECT id, chat_id, text FROM notifications
-        WHERE sent=0 AND send_at <= ?
-        ORDER BY send_at ASC
-    """, (now_iso,)).fetchall()
-    ids = [r["id"] for r in rows]
-    if ids:
-        cur.execute(f"UPDATE notifications SET sent=1 WHERE id IN ({','.join('?' for _ in ids)})", ids)
-        con.commit()
-    cur.close(); con.close()
-    return [dict(r) for r in rows]
+    with db() as con, con:
+        rows = con.execute("""
+            UPDATE notifications SET sent=1
+            WHERE sent=0 AND send_at <= ?
+            RETURNING id, chat_id, text, send_at
+        """, (now_iso,)).fetchall()
+    rows = sorted(rows, key=lambda r: (r["send_at"], r["id"]))
+    return [{"id": r["id"], "chat_id": r["chat_id"], "text": r["text"]} for r in rows]
+
+def merge_notifications(rows: list) -> list:
+    """
+    Созревшие уведомления → сообщения: по одному на чат (порядок — по времени),
+    повторы одного текста выкидываются, слишком длинное делится по NOTIFY_MAX_LEN.
+    Возвращает [{"chat_id", "text", "count"}].
+    """
+    by_chat = {}
+    for r in rows:
+        texts = by_chat.setdefault(r["chat_id"], [])
+        if r["text"] not in texts:
+            texts.append(r["text"])
+    out = []
+    for chat_id, texts in by_chat.items():
+        chunk, size = [], 0
+        for t in texts:
+            if chunk and size + len(t) + 2 > NOTIFY_MAX_LEN:
+                out.append({"chat_id": chat_id, "text": "\n\n".join(chunk), "count": len(chunk)})
+                chunk, size = [], 0
+            chunk.append(t); size += len(t) + 2
+        if chunk:
+            out.append({"chat_id": chat_id, "text": "\n\n".join(chunk), "count": len(chunk)})
+    return out
+
+def send_due_notifications(bot, now_dt: datetime | None = None) -> int:
+    """Отправить созревшие уведомления (склеенные по чатам). Возвращает число сообщений."""
+    rows = fetch_due_notifications(now_dt or datetime.utcnow())
+    msgs = merge_notifications(rows)
+    for m in msgs:
+        try:
+            bot.send_message(m["chat_id"], m["text"], parse_mode="HTML")
+        except Exception as e:
+            print(f"[notif send error] {e}")
+    notification_stats["sent_rows"] += len(rows)
+    notification_stats["sent_messages"] += len(msgs)
+    return len(msgs)
+
+# ============================ Кэш каталога ============================
+# Категории, товары, пункты раздачи и настройки для клиентской части держим в памяти:
+# корзина и карточки читают товары десятки раз на апдейт. Любая запись через функции
+# выше вызывает invalidate_catalog(), следующее чтение перезагружает снимок целиком.
+# Снимок, прочитанный до инвалидации, может быть устаревшим: он ставится в кэш, только
+# если поколение (catalog_gen) за время чтения не изменилось, иначе отдаётся лишь вызвавшему.
+
+_catalog_lock = threading.Lock()   # снимок — _snapshots["catalog"] (свой у магазина)
+
+PICKUP_NEAREST_K = int(os.getenv("PICKUP_NEAREST_K", "5"))   # кнопок при выборе пункта
+PICKUP_CART_K = int(os.getenv("PICKUP_CART_K", "3"))         # пунктов в тексте корзины
+
+def load_catalog() -> dict:
+    with _catalog_lock:
+        gen = _snapshots["catalog_gen"]
+    with db() as con:
+        cats = [dict(r) for r in con.execute("SELECT id, name FROM categories ORDER BY name COLLATE NOCASE")]
+        prods = [dict(r) for r in con.execute("""
+            SELECT id, name, price, min_qty, image, description, category_id
+            FROM products ORDER BY name COLLATE NOCASE
+        """)]
+        points = [dict(r) for r in con.execute("SELECT id, address, lat, lon FROM pickup_points ORDER BY id DESC")]
+        settings = {r["key"]: r["value"] for r in con.execute("SELECT key, value FROM settings")}
+    by_cat = {}
+    for p in prods:
+        by_cat.setdefault(p["category_id"], []).append(p)
+    try:
+        min_sum = float(settings.get("min_delivery_sum") or 0)
+    except ValueError:
+        min_sum = 0.0
+    snap = {
+        "categories": cats,
+        "products": {p["id"]: p for p in prods},
+        "by_cat": by_cat,
+        "pickup_points": points,
+        "pickup_by_id": {p["id"]: p for p in points},
+        "pickup_index": GridIndex(points),
+        "pickup_address": "; ".join(p["address"] for p in points),
+        "min_delivery_sum": min_sum,
+        "settings": settings,
+    }
+    with _catalog_lock:
+        if _snapshots["catalog_gen"] == gen:
+            _snapshots["catalog"] = snap
+    return snap
+
+def catalog() -> dict:
+    snap = _snapshots["catalog"]
+    return snap if snap is not None else load_catalog()
+
+def invalidate_catalog():
+    with _catalog_lock:
+        _snapshots["catalog"] = None
+        _snapshots["catalog_gen"] += 1
 
 # ============================ Клиентские ридеры (для handlers_user.py) ============================
+# Возвращают объекты из кэша каталога — только для чтения.
 
-def client_list_categories():          return list_categories()
-def client_list_products(cat_id: int): return list_products(cat_id)
-def client_get_product(pid: int):      return get_product(pid)
-def client_list_posts():               return list_posts()
-def client_get_post(post_id: int):     return get_post(post_id)
-def client_get_min_delivery_sum():     return get_min_delivery_sum()
+def client_list_categories():          return catalog()["categories"]
+def client_list_products(cat_id: int): return catalog()["by_cat"].get(cat_id, [])
+def client_get_product(pid: int):      return catalog()["products"].get(pid)
+def client_list_posts():               return feed_first_page()[0]
+def client_get_post(post_id: int):
+    p = get_post(post_id)
+    return p if is_post_published(p) else None
 
-def client_get_pickup_address() -> str:
-    points = list_pickup_points()
-    return "; ".join([p["address"] for p in points]) if points else ""
+def client_feed_page(before_id: int | None = None):
+    """(posts, has_more): первая страница — из кэша, следующие — keyset-запросом."""
+    return feed_first_page() if before_id is None else list_feed(before_id)
+def client_get_min_delivery_sum():     return catalog()["min_delivery_sum"]
+
+def client_list_pickup_points():      return catalog()["pickup_points"]
+def client_pickup_points_located():   return len(catalog()["pickup_index"]) > 0
+
+def client_get_pickup_point(point_id: int):
+    return catalog()["pickup_by_id"].get(point_id)
+
+def client_nearest_pickup_points(lat: float, lon: float, k: int = PICKUP_NEAREST_K):
+    """[(distance_km, point)] — k ближайших пунктов с координатами."""
+    return catalog()["pickup_index"].nearest(lat, lon, k)
+
+def client_get_pickup_address(location=None) -> str:
+    """
+    Строка с пунктами раздачи для текста корзины: при известной геопозиции — ближайшие
+    с расстоянием, иначе все, если их немного, иначе только их число.
+    """
+    cat = catalog()
+    if location and len(cat["pickup_index"]):
+        near = cat["pickup_index"].nearest(location[0], location[1], PICKUP_CART_K)
+        return "; ".join(f"{p['address']} (~{d:.1f} км)" for d, p in near)
+    points = cat["pickup_points"]
+    if len(points) <= PICKUP_CART_K:
+        return cat["pickup_address"]
+    return f"{len(points)} пунктов — ближайшие покажем по геопозиции при оформлении"
 
 def client_list_orders_by_user(user_id: int, limit: int = 10):
     return list_orders_by_user(user_id, limit)
@@ -432,24 +1049,29 @@ def stats_get_products(start_dt, end_dt, limit=None):
         p.name                   AS name,
         SUM(oi.qty)              AS total_qty,
         SUM(oi.qty * oi.price)   AS total_sum
-    FROM order_items oi
-    JOIN orders o   ON o.id = oi.order_id
-    JOIN products p ON p.id = oi.product_id
+    FROM {s}.order_items oi
+    JOIN {s}.orders o    ON o.id = oi.order_id
+    JOIN main.products p ON p.id = oi.product_id
     WHERE o.created_at >= ? AND o.created_at <= ?
-    GROUP BY oi.product_id
-    ORDER BY total_qty DESC, total_sum DESC
+    GROUP BY oi.product_id, p.name
     """
-    params = [start_iso, end_iso]
+    with db() as con:
+        rows = con.execute(sql.format(s="main"), (start_iso, end_iso)).fetchall()
+        # период уходит за горячее окно — суммы по архивным месяцам добавляются к рабочей БД
+        for months in archive.groups(archive.months_between(con, start_iso, end_iso)):
+            with archive.attached(con, months) as schemas:
+                for s in schemas:
+                    rows += con.execute(sql.format(s=s), (start_iso, end_iso)).fetchall()
+    totals = {}
+    for r in rows:
+        t = totals.setdefault(r["product_id"], {"product_id": r["product_id"], "name": r["name"],
+                                                "total_qty": 0, "total_sum": 0.0})
+        t["total_qty"] += int(r["total_qty"] or 0)
+        t["total_sum"] += float(r["total_sum"] or 0.0)
+    res = sorted(totals.values(), key=lambda t: (-t["total_qty"], -t["total_sum"]))
     if limit and isinstance(limit, int) and limit > 0:
-        sql += " LIMIT ?"; params.append(limit)
-
-    con = db(); rows = con.execute(sql, params).fetchall(); con.close()
-    return [{
-        "product_id": r["product_id"],
-        "name": r["name"],
-        "total_qty": int(r["total_qty"] or 0),
-        "total_sum": float(r["total_sum"] or 0.0),
-    } for r in rows]
+        res = res[:limit]
+    return res
 
 def build_stats_text(start_dt, end_dt):
     rows = stats_get_products(start_dt, end_dt)
@@ -464,6 +1086,36 @@ def build_stats_text(start_dt, end_dt):
         lines.append(f"{i}. {r['name']} — {r['total_qty']} шт. · {r['total_sum']:.2f} RSD")
     return "\n".join(lines)
 
+def build_image_health_text() -> str:
+    rep = image_health.report()
+    c = rep["counts"]
+    lines = [
+        "<b>🖼 Проверка картинок</b>",
+        f"В порядке: {c.get('ok', 0)} · медленные: {c.get('slow', 0)} · недоступные: {c.get('bad', 0)}",
+    ]
+    last = rep["last_crawl"]
+    if last.get("at"):
+        lines.append(f"Последний обход: {last['at']}, проверено {last.get('checked', 0)} за {last.get('seconds', 0)} с")
+    mf = media_fetch.stats()
+    down = {h: b for h, b in mf["breakers"].items() if b["state"] != "closed"}
+    lines.append(f"Автоматы хостов: срабатываний {mf['trips']}, сейчас отключено {len(down)}")
+    for host, b in sorted(down.items()):
+        lines.append(f"• ⛔ {host}: {b['state']}, повтор через {b['retry_in_s']} с — {b['last_error'] or '?'}")
+    norm = image_norm.stats()
+    if norm["converted"]:
+        lines.append(f"Пережато перед загрузкой: {norm['converted']} "
+                     f"({norm['bytes_in'] / (1 << 20):.1f} → {norm['bytes_out'] / (1 << 20):.1f} МБ), "
+                     f"из кэша {norm['cache_hits']}")
+    if rep["worst"]:
+        lines.append("")
+        for w in rep["worst"]:
+            refs = []
+            if w["products"]: refs.append(f"товары {w['products']}")
+            if w["posts"]: refs.append(f"посты {w['posts']}")
+            why = w["error"] or f"{w['latency_ms'] or 0:.0f} мс"
+            lines.append(f"• [{w['status']}] {', '.join(refs) or '—'}: {why}\n  <code>{w['url'][:120]}</code>")
+    return "\n".join(lines)
+
 # ============================ Разметка меню ============================
 
 def admin_menu_markup() -> types.InlineKeyboardMarkup:
@@ -489,6 +1141,10 @@ def catalog_menu_markup():
     kb.add(types.InlineKeyboardButton("➕ Добавить товар", callback_data="admin:prod:add"))
     kb.add(types.InlineKeyboardButton("✏️ Редактировать товар", callback_data="admin:prod:edit"))
     kb.add(types.InlineKeyboardButton("🗑 Удалить товар", callback_data="admin:prod:del"))
+    kb.add(types.InlineKeyboardButton("📥 Импорт CSV/XLSX", callback_data="admin:catalog:import"),
+           types.InlineKeyboardButton("📤 Экспорт CSV", callback_data="admin:catalog:export"))
+    if catalog_io.openpyxl is not None:
+        kb.add(types.InlineKeyboardButton("📤 Экспорт XLSX", callback_data="admin:catalog:export:xlsx"))
     kb.add(types.InlineKeyboardButton("⬅️ Назад", callback_data="admin:back"))
     return kb
 
@@ -506,10 +1162,46 @@ def orders_menu_markup():
     kb.add(types.InlineKeyboardButton("⬅️ Назад", callback_data="admin:back"))
     return kb
 
+def bulk_status_view(st: dict):
+    """Текст и клавиатура массовой смены статуса по состоянию FSM adm_bulk."""
+    status, sel, before = st["status"], st.get("sel") or [], st.get("before")
+    kb = types.InlineKeyboardMarkup(row_width=2)
+    if before:
+        n = count_orders(status, before=before)
+        text = f"<b>Массовая смена статуса</b>\nВсе заказы «{status}», созданные до {before[:16]}: <b>{n}</b>"
+    else:
+        total = count_orders(status)
+        page = max(0, min(st.get("page", 0), (total - 1) // BULK_PAGE if total else 0))
+        st["page"] = page
+        orders = list_orders_page(status, page * BULK_PAGE, BULK_PAGE)
+        n = len(sel)
+        text = (f"<b>Массовая смена статуса</b>\nЗаказы «{status}»: {total}, выбрано: <b>{n}</b>\n"
+                f"Стр. {page + 1}/{max(1, (total + BULK_PAGE - 1) // BULK_PAGE)}")
+        chosen = set(sel)
+        for o in orders:
+            mark = "✅" if o["id"] in chosen else "▫️"
+            uname = f"@{o['username']}" if o.get("username") else str(o["user_id"])
+            kb.add(types.InlineKeyboardButton(f"{mark} #{o['id']} {o['created_at'][5:16]} {uname}",
+                                              callback_data=f"admin:bulk:t:{o['id']}"))
+        nav = []
+        if page > 0:
+            nav.append(types.InlineKeyboardButton("⬅️", callback_data=f"admin:bulk:page:{page - 1}"))
+        nav.append(types.InlineKeyboardButton("Отметить страницу", callback_data="admin:bulk:pageall"))
+        if (page + 1) * BULK_PAGE < total:
+            nav.append(types.InlineKeyboardButton("➡️", callback_data=f"admin:bulk:page:{page + 1}"))
+        kb.row(*nav)
+    kb.add(types.InlineKeyboardButton("🕒 Все до времени…", callback_data="admin:bulk:before"))
+    if n:
+        kb.row(*[types.InlineKeyboardButton(f"→ {s}", callback_data=f"admin:bulk:apply:{s}")
+                 for s in ORDER_STATUSES if s != status])
+    kb.add(types.InlineKeyboardButton("✖️ Отмена", callback_data="admin:bulk:cancel"))
+    return text, kb
+
 def settings_menu_markup():
     kb = types.InlineKeyboardMarkup(row_width=2)
     kb.add(types.InlineKeyboardButton("💰 Min сумма заказа", callback_data="admin:set:minsum"))
     kb.add(types.InlineKeyboardButton("📍 Пункты раздачи", callback_data="admin:set:pickup"))
+    kb.add(types.InlineKeyboardButton("🖼 Проверка картинок", callback_data="admin:images"))
     kb.add(types.InlineKeyboardButton("⬅️ Назад", callback_data="admin:back"))
     return kb
 
@@ -518,7 +1210,8 @@ def pickup_menu_markup():
     pts = list_pickup_points()
     if pts:
         for p in pts:
-            kb.add(types.InlineKeyboardButton(f"🗑 {p['address']}", callback_data=f"admin:set:pickup:del:{p['id']}"))
+            mark = "📍 " if p.get("lat") is not None else ""
+            kb.add(types.InlineKeyboardButton(f"🗑 {mark}{p['address']}", callback_data=f"admin:set:pickup:del:{p['id']}"))
     kb.add(types.InlineKeyboardButton("➕ Добавить адрес", callback_data="admin:set:pickup:add"))
     kb.add(types.InlineKeyboardButton("⬅️ Назад", callback_data="admin:settings"))
     return kb
@@ -541,6 +1234,15 @@ def _month_bounds(dt: datetime):
 
 # ============================ Делегатор callback ============================
 
+def send_catalog_export(bot, chat_id: int, fmt: str = "csv"):
+    export = catalog_io.export_xlsx if fmt == "xlsx" else catalog_io.export_csv
+    with db() as con:
+        with tempfile.SpooledTemporaryFile(max_size=8 << 20) as f:
+            n = export(con, f)
+            f.seek(0)
+            bot.send_document(chat_id, f, visible_file_name=f"catalog-{datetime.now():%Y%m%d}.{fmt}",
+                              caption=f"Каталог: {n} товаров")
+
 def handle_callback(bot, call, get_product_func):
     data = call.data or ""
     if not data.startswith("admin:"):
@@ -566,6 +1268,23 @@ def handle_callback(bot, call, get_product_func):
         bot.send_message(cid, "<b>📦 Каталог</b>", reply_markup=catalog_menu_markup())
         return True
 
+    if data == "admin:catalog:import":
+        admin_fsm[uid] = {"action": "adm_catalog_import"}
+        bot.answer_callback_query(call.id)
+        bot.send_message(cid,
+            "Пришлите файл .csv или .xlsx с колонками:\n"
+            "<code>id;name;category;price;min_qty;image;description</code>\n"
+            "Строки с id (или совпадающим названием) обновляют товар, остальные добавляются. "
+            "Пустой id — новый товар. Шаблон — «📤 Экспорт CSV».")
+        return True
+
+    if data in ("admin:catalog:export", "admin:catalog:export:xlsx"):
+        bot.answer_callback_query(call.id)
+        fmt = "xlsx" if data.endswith(":xlsx") else "csv"
+        # файл живёт до конца отправки — поэтому выгрузка и отправка одной задачей в очереди чата
+        run_in_chat(bot, cid, send_catalog_export, cid, fmt)
+        return True
+
     if data == "admin:cat:add":
         admin_fsm[uid] = {"action": "adm_cat_add"}
         bot.answer_callback_query(call.id)
@@ -738,7 +1457,7 @@ def handle_callback(bot, call, get_product_func):
         return True
 
     if data == "admin:post:del":
-        posts = list_posts()
+        posts = list_posts(limit=50)
         kb = types.InlineKeyboardMarkup(row_width=1)
         if not posts:
             kb.add(types.InlineKeyboardButton("Нет публикаций", callback_data="noop"))
@@ -774,12 +1493,13 @@ def handle_callback(bot, call, get_product_func):
         lines = [f"<b>Заказы: {status}</b>", ""]
         kb = types.InlineKeyboardMarkup(row_width=1)
         for o in orders[:50]:
-            items = get_order_items(o["id"])
+            items = o["items"]
             items_str = ", ".join([f"{it['name']}×{it['qty']}" for it in items]) if items else "—"
             when = o["created_at"]
             uname = f"@{o['username']}" if o.get("username") else str(o["user_id"])
             lines.append(f"{when} | {status} | #{o['id']} | {uname} | {items_str}")
             kb.add(types.InlineKeyboardButton(f"Править #{o['id']}", callback_data=f"admin:order:view:{o['id']}"))
+        kb.add(types.InlineKeyboardButton("☑️ Массовая смена статуса", callback_data=f"admin:bulk:start:{status}"))
         bot.answer_callback_query(call.id)
         bot.send_message(cid, "\n".join(lines), reply_markup=kb)
         return True
@@ -791,7 +1511,7 @@ def handle_callback(bot, call, get_product_func):
             bot.answer_callback_query(call.id)
             bot.send_message(cid, "Заказ не найден.")
             return True
-        items = get_order_items(oid)
+        items = o["items"]
         items_str = "\n".join([f"• {it['name']} — {it['qty']} × {it['price']:.2f}" for it in items]) or "—"
         text = (
             f"<b>Заказ #{o['id']}</b>\n"
@@ -802,8 +1522,11 @@ def handle_callback(bot, call, get_product_func):
             f"<b>Товары:</b>\n{items_str}"
         )
         kb = types.InlineKeyboardMarkup(row_width=3)
-        for s in ORDER_STATUSES:
-            kb.add(types.InlineKeyboardButton(s, callback_data=f"admin:order:status:{oid}:{s}"))
+        if o["archived"]:
+            text += "\n\n🗄 Заказ в архиве — только просмотр."
+        else:
+            for s in ORDER_STATUSES:
+                kb.add(types.InlineKeyboardButton(s, callback_data=f"admin:order:status:{oid}:{s}"))
         kb.add(types.InlineKeyboardButton("⬅️ Назад к списку", callback_data=f"admin:orders"))
         bot.answer_callback_query(call.id)
         bot.send_message(cid, text, reply_markup=kb)
@@ -817,14 +1540,80 @@ def handle_callback(bot, call, get_product_func):
             bot.answer_callback_query(call.id)
             bot.send_message(cid, "Заказ не найден.")
             return True
-        update_order_status(oid, new_status)
+        if o["archived"] or not update_order_status(oid, new_status):
+            bot.answer_callback_query(call.id)
+            bot.send_message(cid, f"Заказ #{oid} в архиве — статус не меняется.")
+            return True
         bot.answer_callback_query(call.id)
         bot.send_message(cid, f"Статус заказа #{oid} изменён на «{new_status}».")
         if o.get("chat_id"):
-            try:
-                bot.send_message(o["chat_id"], f"Ваш заказ #{oid}: статус обновлён на «{new_status}».")
-            except Exception as e:
-                print(f"[notify user] send error: {e}")
+            # несколько смен статуса подряд дойдут до клиента одним сообщением с последним статусом
+            notify(o["chat_id"], f"Ваш заказ #{oid}: статус обновлён на «{new_status}».", topic=f"order:{oid}")
+        return True
+
+    # --- Массовая смена статуса: выбор заказов в FSM adm_bulk, применение одним UPDATE ---
+    if data.startswith("admin:bulk:start:"):
+        st = {"action": "adm_bulk", "status": data.split(":")[-1], "sel": [], "before": None, "page": 0}
+        text, kb = bulk_status_view(st)
+        admin_fsm[uid] = st
+        bot.answer_callback_query(call.id)
+        bot.send_message(cid, text, reply_markup=kb)
+        return True
+
+    if data.startswith("admin:bulk:"):
+        st = admin_fsm.get(uid)
+        if not st or st.get("action") not in ("adm_bulk", "adm_bulk_before"):
+            bot.answer_callback_query(call.id, "Выбор устарел, откройте список заново.")
+            return True
+        st["action"] = "adm_bulk"
+        cmd = data.split(":")[2]
+        if cmd == "cancel":
+            admin_fsm.pop(uid, None)
+            bot.answer_callback_query(call.id)
+            bot.edit_message_text("Массовая смена статуса отменена.", cid, call.message.message_id)
+            return True
+        if cmd == "before":
+            st["action"] = "adm_bulk_before"
+            admin_fsm[uid] = st
+            bot.answer_callback_query(call.id)
+            bot.send_message(cid, f"Перевести все заказы «{st['status']}», созданные до времени: "
+                                  f"'YYYY-MM-DD HH:MM' или 'HH:MM' (сегодня).")
+            return True
+        if cmd == "apply":
+            to_status = data.split(":")[-1]
+            if to_status not in ORDER_STATUSES:
+                bot.answer_callback_query(call.id)
+                return True
+            moved = bulk_update_order_status(st["status"], to_status,
+                                             ids=None if st.get("before") else st.get("sel") or [],
+                                             before=st.get("before"))
+            notify_many([(o["chat_id"], f"Ваш заказ #{o['id']}: статус обновлён на «{to_status}».", f"order:{o['id']}")
+                         for o in moved if o["chat_id"]])
+            admin_fsm.pop(uid, None)
+            bot.answer_callback_query(call.id)
+            bot.edit_message_text(f"✅ Переведено заказов «{st['status']}» → «{to_status}»: {len(moved)}",
+                                  cid, call.message.message_id, reply_markup=orders_menu_markup())
+            return True
+        if cmd == "t":
+            oid = int(data.split(":")[-1])
+            sel = st.setdefault("sel", [])
+            if oid in sel:
+                sel.remove(oid)
+            else:
+                sel.append(oid)
+        elif cmd == "page":
+            st["page"] = int(data.split(":")[-1])
+        elif cmd == "pageall":
+            ids = [o["id"] for o in list_orders_page(st["status"], st.get("page", 0) * BULK_PAGE, BULK_PAGE)]
+            sel = st.setdefault("sel", [])
+            if all(i in sel for i in ids):
+                st["sel"] = [i for i in sel if i not in ids]
+            else:
+                sel.extend(i for i in ids if i not in sel)
+        text, kb = bulk_status_view(st)
+        admin_fsm[uid] = st
+        bot.answer_callback_query(call.id)
+        bot.edit_message_text(text, cid, call.message.message_id, reply_markup=kb)
         return True
 
     # --- Настройки ---
@@ -839,6 +1628,19 @@ def handle_callback(bot, call, get_product_func):
         bot.send_message(cid, "Введите минимальную сумму заказа (число):")
         return True
 
+    if data == "admin:images":
+        kb = types.InlineKeyboardMarkup()
+        kb.add(types.InlineKeyboardButton("🔄 Проверить сейчас", callback_data="admin:images:crawl"))
+        kb.add(types.InlineKeyboardButton("⬅️ Назад", callback_data="admin:settings"))
+        bot.answer_callback_query(call.id)
+        bot.send_message(cid, build_image_health_text(), reply_markup=kb, disable_web_page_preview=True)
+        return True
+
+    if data == "admin:images:crawl":
+        started = image_health.crawl_async()
+        bot.answer_callback_query(call.id, "Проверка запущена" if started else "Проверка уже идёт")
+        return True
+
     if data == "admin:set:pickup":
         bot.answer_callback_query(call.id)
         bot.send_message(cid, "<b>📍 Пункты раздачи</b>", reply_markup=pickup_menu_markup())
@@ -847,7 +1649,8 @@ def handle_callback(bot, call, get_product_func):
     if data == "admin:set:pickup:add":
         admin_fsm[uid] = {"action":"adm_pickup_add"}
         bot.answer_callback_query(call.id)
-        bot.send_message(cid, "Введите адрес пункта раздачи одной строкой:")
+        bot.send_message(cid, "Введите адрес пункта раздачи одной строкой.\n"
+                              "Координаты для поиска ближайших — через «|»: <code>Адрес | 44.8125, 20.4612</code>")
         return True
 
     if data.startswith("admin:set:pickup:del:"):
@@ -910,6 +1713,7 @@ def handle_text(bot, message, get_product_func):
             return True
         st["name"] = name
         st["action"] = "adm_prod_add_price"
+        admin_fsm[uid] = st
         bot.send_message(message.chat.id, "Цена (число):")
         return True
 
@@ -921,6 +1725,7 @@ def handle_text(bot, message, get_product_func):
             return True
         st["price"] = price
         st["action"] = "adm_prod_add_minqty"
+        admin_fsm[uid] = st
         bot.send_message(message.chat.id, "Минимальное количество (целое число):")
         return True
 
@@ -933,6 +1738,7 @@ def handle_text(bot, message, get_product_func):
             return True
         st["min_qty"] = min_qty
         st["action"] = "adm_prod_add_image"
+        admin_fsm[uid] = st
         bot.send_message(message.chat.id, "URL изображения (или - чтобы пропустить):")
         return True
 
@@ -940,6 +1746,7 @@ def handle_text(bot, message, get_product_func):
         img = (message.text or "").strip()
         st["image"] = "" if img == "-" else img
         st["action"] = "adm_prod_add_desc"
+        admin_fsm[uid] = st
         bot.send_message(message.chat.id, "Описание товара (можно кратко):")
         return True
 
@@ -973,6 +1780,7 @@ def handle_text(bot, message, get_product_func):
     if st.get("action") == "adm_post_add_image":
         st["image"] = "" if (message.text or "").strip() == "-" else (message.text or "").strip()
         st["action"] = "adm_post_add_title"
+        admin_fsm[uid] = st
         bot.send_message(message.chat.id, "Заголовок публикации:")
         return True
 
@@ -982,12 +1790,14 @@ def handle_text(bot, message, get_product_func):
             bot.send_message(message.chat.id, "Пустой заголовок. Введите ещё раз:")
             return True
         st["action"] = "adm_post_add_text"
+        admin_fsm[uid] = st
         bot.send_message(message.chat.id, "Текст публикации:")
         return True
 
     if st.get("action") == "adm_post_add_text":
         st["text"] = (message.text or "").strip()
         st["action"] = "adm_post_add_when"
+        admin_fsm[uid] = st
         bot.send_message(message.chat.id, "Когда публиковать? Укажите 'YYYY-MM-DD HH:MM' или '-' (сейчас):")
         return True
 
@@ -1020,13 +1830,79 @@ def handle_text(bot, message, get_product_func):
         return True
 
     if st.get("action") == "adm_pickup_add":
-        addr = (message.text or "").strip()
+        addr, lat, lon = parse_pickup_input(message.text)
         if not addr:
             bot.send_message(message.chat.id, "Адрес пуст. Введите снова:")
             return True
-        add_pickup_point(addr)
+        add_pickup_point(addr, lat, lon)
         admin_fsm.pop(uid, None)
         bot.send_message(message.chat.id, "✅ Адрес добавлен.", reply_markup=pickup_menu_markup())
         return True
 
+    # --- Заказы: массовая смена «все до времени» ---
+    if st.get("action") == "adm_bulk_before":
+        txt = (message.text or "").strip()
+        try:
+            if len(txt) <= 5:
+                t = datetime.strptime(txt, "%H:%M").time()
+                dt = datetime.combine(datetime.now().date(), t)
+            else:
+                dt = datetime.strptime(txt, "%Y-%m-%d %H:%M")
+        except Exception:
+            bot.send_message(message.chat.id, "Неверный формат. Укажите 'YYYY-MM-DD HH:MM' или 'HH:MM':")
+            return True
+        st["action"] = "adm_bulk"
+        st["before"] = dt.strftime("%Y-%m-%d %H:%M:%S")   # created_at — локальное время
+        text, kb = bulk_status_view(st)
+        admin_fsm[uid] = st
+        bot.send_message(message.chat.id, text, reply_markup=kb)
+        return True
+
     return False
+
+def handle_document(bot, message) -> bool:
+    """Файл от админа: импорт каталога, если ждём его (adm_catalog_import)."""
+    uid = message.from_user.id
+    st = admin_fsm.get(uid)
+    if not st or st.get("action") != "adm_catalog_import":
+        return False
+    doc = message.document
+    try:
+        data = bot.download_file(bot.get_file(doc.file_id).file_path)
+    except Exception as e:
+        bot.send_message(message.chat.id, f"Не удалось скачать файл: {e}")
+        return True
+    try:
+        with db() as con:
+            rep = catalog_io.import_catalog(con, doc.file_name or "", data)
+    except catalog_io.ImportFormatError as e:
+        bot.send_message(message.chat.id, f"⚠️ {e}\nПришлите исправленный файл.")
+        return True
+    except Exception as e:             # битый файл, ошибка БД до начала импорта
+        print(f"[catalog import] {type(e).__name__}: {e}")
+        bot.send_message(message.chat.id, f"⚠️ Импорт не выполнен: {type(e).__name__}: {e}",
+                         reply_markup=catalog_menu_markup())
+        return True
+    finally:
+        # часть пачек могла записаться и при ошибке — кэш сбрасываем в любом случае
+        invalidate_catalog()
+    if not rep["aborted"]:
+        admin_fsm.pop(uid, None)       # после прерванного импорта можно прислать файл ещё раз
+    errs = rep["errors"]
+    head = (f"⚠️ Импорт прерван через {rep['seconds']:.1f} с: {rep['aborted']}\n"
+            "Записанное до ошибки сохранено:" if rep["aborted"] else
+            f"✅ Импорт завершён за {rep['seconds']:.1f} с.")
+    lines = [
+        head,
+        f"Строк: {rep['rows']}, добавлено: {rep['inserted']}, обновлено: {rep['updated']}, "
+        f"новых категорий: {rep['categories_created']}, ошибок: {len(errs)}",
+    ]
+    if errs:
+        lines += [""] + [f"• строка {n}: {msg}" for n, msg in errs[:20]]
+        if len(errs) > 20:
+            lines.append(f"… и ещё {len(errs) - 20} — полный список в файле.")
+    bot.send_message(message.chat.id, "\n".join(lines), reply_markup=catalog_menu_markup())
+    if len(errs) > 20:
+        bot.send_document(message.chat.id, catalog_io.errors_csv(errs),
+                          visible_file_name="import-errors.csv")
+    return True
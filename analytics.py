@@ -0,0 +1,136 @@
+# analytics.py
+# Векторная аналитика по колоночной выгрузке (columnar_export.py). Живую БД не открывает.
+#
+#   python analytics.py /data/columnar day --from 2025-01-01 --to 2025-03-31
+#   python analytics.py /data/columnar product --top 20
+#   python analytics.py /data/columnar category
+#
+# Нужен numpy (есть в requirements.txt); для выгрузки в parquet — ещё pyarrow.
+
+import argparse
+import json
+import os
+
+try:
+    import numpy as np
+except ImportError:      # без numpy модуль бесполезен целиком — понятная ошибка вместо трейсбека
+    raise SystemExit("Для аналитики нужен numpy (pip install numpy).")
+
+def load(export_dir: str) -> dict:
+    """
+    Колонки выгрузки: {"orders": {col: ndarray}, "order_items": {...}, "products": {...},
+    "names": {"products": {...}, "categories": {...}}}. Для npy — memmap только на чтение,
+    строго по числу строк из meta.json (недописанный хвост не виден).
+    """
+    with open(os.path.join(export_dir, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    data = {}
+    for table, cols in meta["columns"].items():
+        d = os.path.join(export_dir, table)
+        if meta.get("format") == "parquet":
+            import pyarrow.parquet as pq
+            t = pq.read_table(d)
+            data[table] = {c: t.column(c).to_numpy() for c in cols}
+        else:
+            rows = meta["rows"].get(table)
+            data[table] = {}
+            for c in cols:
+                arr = np.load(os.path.join(d, f"{c}.npy"), mmap_mode="r")
+                data[table][c] = arr[:rows] if rows is not None else arr
+    with open(os.path.join(export_dir, "names.json"), encoding="utf-8") as f:
+        data["names"] = json.load(f)
+    return data
+
+def _day(s: str | None):
+    return None if s is None else np.datetime64(s, "D").astype(np.int64)
+
+def _period_mask(days: np.ndarray, start: str | None, end: str | None):
+    mask = np.ones(len(days), dtype=bool)
+    if start is not None:
+        mask &= days >= _day(start)
+    if end is not None:
+        mask &= days <= _day(end)
+    return mask
+
+def _items(data: dict, start=None, end=None):
+    it = data["order_items"]
+    mask = _period_mask(it["day"], start, end)
+    revenue = it["qty"][mask] * it["price"][mask]
+    return it, mask, revenue
+
+# ============================ Отчёты ============================
+
+def revenue_per_day(data: dict, start: str | None = None, end: str | None = None):
+    """(даты datetime64[D], выручка, число заказов) — только дни с продажами."""
+    o = data["orders"]
+    mask = _period_mask(o["day"], start, end)
+    days = o["day"][mask]
+    if not len(days):
+        return np.array([], dtype="datetime64[D]"), np.array([]), np.array([], dtype=np.int64)
+    base = days.min()
+    rev = np.bincount(days - base, weights=o["total"][mask])
+    cnt = np.bincount(days - base)
+    nz = np.nonzero(cnt)[0]
+    return (nz + base).astype("datetime64[D]"), rev[nz], cnt[nz]
+
+def revenue_per_product(data: dict, start: str | None = None, end: str | None = None, top: int | None = None):
+    """(product_id, выручка, штук) по убыванию выручки."""
+    it, mask, revenue = _items(data, start, end)
+    pids = it["product_id"][mask]
+    if not len(pids):
+        return np.array([], dtype=np.int64), np.array([]), np.array([], dtype=np.int64)
+    rev = np.bincount(pids, weights=revenue)
+    qty = np.bincount(pids, weights=it["qty"][mask]).astype(np.int64)
+    nz = np.nonzero(qty)[0]
+    order = nz[np.argsort(-rev[nz], kind="stable")]
+    if top:
+        order = order[:top]
+    return order, rev[order], qty[order]
+
+def revenue_per_category(data: dict, start: str | None = None, end: str | None = None):
+    """(category_id, выручка) по убыванию; -1 — товары без категории или удалённые."""
+    it, mask, revenue = _items(data, start, end)
+    pids = it["product_id"][mask]
+    if not len(pids):
+        return np.array([], dtype=np.int64), np.array([])
+    prod = data["products"]
+    size = int(max(pids.max(), prod["id"].max(initial=0))) + 1
+    cat_of = np.full(size, -1, dtype=np.int64)
+    cat_of[prod["id"]] = prod["category_id"]
+    cats = cat_of[pids]
+    shift = 1  # -1 -> индекс 0 для bincount
+    rev = np.bincount(cats + shift, weights=revenue)
+    nz = np.nonzero(rev)[0]
+    order = nz[np.argsort(-rev[nz], kind="stable")]
+    return order - shift, rev[order]
+
+# ============================ CLI ============================
+
+def main():
+    ap = argparse.ArgumentParser(description="Аналитика по колоночной выгрузке заказов")
+    ap.add_argument("export_dir")
+    ap.add_argument("report", choices=("day", "product", "category"))
+    ap.add_argument("--from", dest="start", help="YYYY-MM-DD")
+    ap.add_argument("--to", dest="end", help="YYYY-MM-DD (включительно)")
+    ap.add_argument("--top", type=int, default=20)
+    args = ap.parse_args()
+
+    data = load(args.export_dir)
+    names = data["names"]
+    if args.report == "day":
+        days, rev, cnt = revenue_per_day(data, args.start, args.end)
+        for d, r, c in zip(days, rev, cnt):
+            print(f"{d}  {c:>8} заказов  {r:>14,.2f}")
+        print(f"Итого: {cnt.sum()} заказов, {rev.sum():,.2f}")
+    elif args.report == "product":
+        pids, rev, qty = revenue_per_product(data, args.start, args.end, args.top)
+        for pid, r, q in zip(pids, rev, qty):
+            print(f"{pid:>8}  {names['products'].get(str(pid), '—')[:40]:<40}{q:>10} шт.{r:>16,.2f}")
+    else:
+        cats, rev = revenue_per_category(data, args.start, args.end)
+        for cid, r in zip(cats, rev):
+            name = names["categories"].get(str(cid), "без категории") if cid >= 0 else "без категории"
+            print(f"{cid:>6}  {name[:40]:<40}{r:>16,.2f}")
+
+if __name__ == "__main__":
+    main()
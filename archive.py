@@ -0,0 +1,277 @@
+# archive.py
+# Горячие и холодные заказы: старые заказы переезжают из store.db в помесячные файлы
+# archive/<store>-orders-YYYY-MM.db, чтобы рабочая БД (индексы, бэкапы, VACUUM) не росла вечно.
+#  * перенос — заказы с created_at старше ARCHIVE_AFTER_DAYS вместе с позициями, пачками
+#    по ARCHIVE_BATCH; каждая пачка — одна транзакция на обе БД (ATTACH): вставка в архив,
+#    учёт в order_archives / archived_user_months, удаление из рабочей БД;
+#  * отправленные уведомления старше ARCHIVE_NOTIFY_DAYS удаляются пачками;
+#  * чтение (Admin_bot: история пользователя, заказ, позиции, статистика) подключает архивы
+#    через ATTACH только когда запрос выходит за горячее окно — какие месяцы нужны, видно
+#    по маленьким таблицам order_archives и archived_user_months в рабочей БД.
+#
+# Расписание: main.py вызывает start_scheduler() (ARCHIVE_INTERVAL_MIN > 0).
+# Вручную:
+#   python archive.py run --db store.db [--days 180]
+#   python archive.py list --db store.db
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import tenants
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_NOTIFY_DAYS = int(os.getenv("ARCHIVE_NOTIFY_DAYS", "14"))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "2000"))
+ARCHIVE_INTERVAL_MIN = int(os.getenv("ARCHIVE_INTERVAL_MIN", "1440"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "")           # по умолчанию — archive/ рядом с БД
+ARCHIVE_ATTACH_MAX = 8                               # SQLite по умолчанию допускает 10 ATTACH
+
+ORDER_COLS = "id, user_id, chat_id, total, status, created_at, items_snapshot, update_id"
+ITEM_COLS = "id, order_id, product_id, qty, price"
+_IDS = "(SELECT value FROM json_each(?))"
+
+_last = {}
+
+def last_run() -> dict:
+    return dict(_last)
+
+# ============================ Файлы архивов ============================
+
+def main_path(con: sqlite3.Connection) -> str:
+    for r in con.execute("PRAGMA database_list"):
+        if r[1] == "main":
+            return r[2]
+    return ""
+
+def archive_dir(db_path: str) -> str:
+    return ARCHIVE_DIR or os.path.join(os.path.dirname(os.path.abspath(db_path)), "archive")
+
+def archive_file(db_path: str, month: str) -> str:
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    return os.path.join(archive_dir(db_path), f"{stem}-orders-{month}.db")
+
+def _ensure_archive(con: sqlite3.Connection, schema: str):
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {schema}.orders (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER,
+            total REAL NOT NULL DEFAULT 0,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            items_snapshot TEXT,
+            update_id INTEGER
+        )
+    """)
+    con.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_arc_orders_user ON orders(user_id, created_at)")
+    con.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_arc_orders_created ON orders(created_at)")
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {schema}.order_items (
+            id INTEGER PRIMARY KEY,
+            order_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            qty INTEGER NOT NULL DEFAULT 1,
+            price REAL NOT NULL DEFAULT 0
+        )
+    """)
+    con.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_arc_items_order ON order_items(order_id)")
+
+# ============================ Чтение ============================
+
+def months_for_user(con: sqlite3.Connection, user_id: int) -> list:
+    """Месяцы архивов с заказами пользователя, от новых к старым."""
+    return [r[0] for r in con.execute(
+        "SELECT month FROM archived_user_months WHERE user_id=? ORDER BY month DESC", (user_id,))]
+
+def months_for_order(con: sqlite3.Connection, order_id: int) -> list:
+    return [r[0] for r in con.execute(
+        "SELECT month FROM order_archives WHERE ? BETWEEN min_id AND max_id ORDER BY month DESC", (order_id,))]
+
+def months_between(con: sqlite3.Connection, start_iso: str, end_iso: str) -> list:
+    """Месяцы архивов, в которых есть заказы с created_at в [start_iso, end_iso]."""
+    return [r[0] for r in con.execute(
+        "SELECT month FROM order_archives WHERE max_created >= ? AND min_created <= ? ORDER BY month DESC",
+        (start_iso, end_iso))]
+
+def groups(months: list) -> list:
+    """Месяцы группами, которые можно подключить к одному соединению."""
+    return [months[i:i + ARCHIVE_ATTACH_MAX] for i in range(0, len(months), ARCHIVE_ATTACH_MAX)]
+
+@contextmanager
+def attached(con: sqlite3.Connection, months: list):
+    """
+    Подключить архивы months (не больше ARCHIVE_ATTACH_MAX) к con; отдаёт имена схем
+    в том же порядке (отсутствующие файлы пропускаются). После блока архивы отключаются.
+    """
+    db_path = main_path(con)
+    names = []
+    try:
+        for m in months:
+            path = archive_file(db_path, m)
+            if not os.path.exists(path):
+                print(f"[archive] missing {path}")
+                continue
+            name = f"arc{len(names)}"
+            con.execute(f"ATTACH DATABASE ? AS {name}", (path,))
+            names.append(name)
+        yield names
+    finally:
+        for name in names:
+            con.execute(f"DETACH DATABASE {name}")
+
+# ============================ Перенос ============================
+
+def _move(con: sqlite3.Connection, db_path: str, month: str, ids: list):
+    """Одна пачка заказов одного месяца: архив и рабочая БД меняются в одной транзакции."""
+    con.execute("ATTACH DATABASE ? AS arc", (archive_file(db_path, month),))
+    try:
+        _ensure_archive(con, "arc")
+        p = json.dumps(ids)
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            con.execute(f"INSERT OR REPLACE INTO arc.orders({ORDER_COLS}) "
+                        f"SELECT {ORDER_COLS} FROM main.orders WHERE id IN {_IDS}", (p,))
+            con.execute(f"INSERT OR REPLACE INTO arc.order_items({ITEM_COLS}) "
+                        f"SELECT {ITEM_COLS} FROM main.order_items WHERE order_id IN {_IDS}", (p,))
+            con.execute(f"INSERT OR IGNORE INTO archived_user_months(user_id, month) "
+                        f"SELECT DISTINCT user_id, ? FROM main.orders WHERE id IN {_IDS}", (month, p))
+            con.execute(f"""
+                INSERT INTO order_archives(month, orders, min_id, max_id, min_created, max_created, updated_at)
+                SELECT ?, COUNT(*), MIN(id), MAX(id), MIN(created_at), MAX(created_at), ?
+                FROM main.orders WHERE id IN {_IDS}
+                ON CONFLICT(month) DO UPDATE SET
+                    orders = orders + excluded.orders,
+                    min_id = MIN(min_id, excluded.min_id),
+                    max_id = MAX(max_id, excluded.max_id),
+                    min_created = MIN(min_created, excluded.min_created),
+                    max_created = MAX(max_created, excluded.max_created),
+                    updated_at = excluded.updated_at
+            """, (month, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), p))
+            con.execute(f"DELETE FROM main.order_items WHERE order_id IN {_IDS}", (p,))
+            con.execute(f"DELETE FROM main.orders WHERE id IN {_IDS}", (p,))
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+    finally:
+        con.execute("DETACH DATABASE arc")
+
+def archive_orders(con: sqlite3.Connection, before_iso: str, batch: int = ARCHIVE_BATCH) -> dict:
+    """Перенести заказы с created_at < before_iso. Возвращает {месяц: перенесено}."""
+    db_path = main_path(con)
+    os.makedirs(archive_dir(db_path), exist_ok=True)
+    moved = {}
+    while True:
+        rows = con.execute("""
+            SELECT id, substr(created_at, 1, 7) FROM orders
+            WHERE created_at < ? ORDER BY created_at, id LIMIT ?
+        """, (before_iso, max(1, batch))).fetchall()
+        if not rows:
+            return moved
+        by_month = {}
+        for oid, month in rows:
+            by_month.setdefault(month, []).append(oid)
+        for month, ids in by_month.items():
+            _move(con, db_path, month, ids)
+            moved[month] = moved.get(month, 0) + len(ids)
+
+def purge_notifications(con: sqlite3.Connection, before_iso: str, batch: int = ARCHIVE_BATCH) -> int:
+    """Удалить отправленные уведомления с send_at < before_iso (UTC) пачками."""
+    total = 0
+    while True:
+        with con:
+            n = con.execute("""
+                DELETE FROM notifications WHERE id IN (
+                    SELECT id FROM notifications WHERE sent=1 AND send_at < ? LIMIT ?
+                )
+            """, (before_iso, max(1, batch))).rowcount
+        total += n
+        if n < batch:
+            return total
+
+def run(con: sqlite3.Connection, now: datetime | None = None, after_days: int = ARCHIVE_AFTER_DAYS,
+        notify_days: int = ARCHIVE_NOTIFY_DAYS, batch: int = ARCHIVE_BATCH) -> dict:
+    """Проход архивации: заказы старше after_days и уведомления старше notify_days."""
+    now = now or datetime.now()
+    t0 = time.perf_counter()
+    before = (now - timedelta(days=after_days)).strftime("%Y-%m-%d %H:%M:%S")
+    moved = archive_orders(con, before, batch)
+    # send_at уведомлений хранится в UTC
+    utc_before = (datetime.utcnow() - timedelta(days=notify_days)).strftime("%Y-%m-%d %H:%M:%S")
+    purged = purge_notifications(con, utc_before, batch)
+    res = {"db": main_path(con), "before": before, "orders": sum(moved.values()), "months": moved,
+           "notifications": purged, "seconds": round(time.perf_counter() - t0, 3),
+           "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    _last.clear(); _last.update(res)
+    if res["orders"] or purged:
+        print(f"[archive] {os.path.basename(res['db'])}: orders {res['orders']} → {len(moved)} month(s), "
+              f"notifications purged {purged}, {res['seconds']}s")
+    return res
+
+# ============================ Расписание ============================
+
+def _loop(interval_min: int, connect, shops: list):
+    while True:
+        time.sleep(interval_min * 60)
+        for shop in shops:
+            try:
+                with tenants.use(shop):
+                    con = connect()
+                    try:
+                        run(con)
+                    finally:
+                        con.close()
+            except Exception as e:
+                print(f"[archive] {shop.name} error: {e}")
+
+def start_scheduler(connect, shops: list, interval_min: int = ARCHIVE_INTERVAL_MIN):
+    """connect() — соединение с БД текущего магазина (Admin_bot.connect)."""
+    if interval_min <= 0 or ARCHIVE_AFTER_DAYS <= 0:
+        return None
+    th = threading.Thread(target=_loop, args=(interval_min, connect, shops), name="archive", daemon=True)
+    th.start()
+    print(f"[archive] every {interval_min} min: orders older than {ARCHIVE_AFTER_DAYS} days, "
+          f"sent notifications older than {ARCHIVE_NOTIFY_DAYS} days")
+    return th
+
+def main():
+    ap = argparse.ArgumentParser(description="Архивация старых заказов store.db в помесячные файлы")
+    ap.add_argument("--db", default=os.getenv("DB_PATH", "store.db"))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run")
+    r.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS)
+    r.add_argument("--notify-days", type=int, default=ARCHIVE_NOTIFY_DAYS)
+    sub.add_parser("list")
+    args = ap.parse_args()
+
+    if args.cmd == "run":
+        import Admin_bot                  # схема рабочей БД (order_archives и т.п.)
+        Admin_bot.DB_PATH = args.db
+        Admin_bot.init_db()
+        con = sqlite3.connect(args.db)
+        try:
+            res = run(con, after_days=args.days, notify_days=args.notify_days)
+        finally:
+            con.close()
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+    elif args.cmd == "list":
+        con = sqlite3.connect(args.db)
+        try:
+            rows = con.execute("""
+                SELECT month, orders, min_created, max_created FROM order_archives ORDER BY month
+            """).fetchall()
+        finally:
+            con.close()
+        for month, n, lo, hi in rows:
+            path = archive_file(args.db, month)
+            size = os.path.getsize(path) / (1 << 20) if os.path.exists(path) else 0.0
+            print(f"{month}  {n:8d} orders  {lo[:10]} … {hi[:10]}  {size:7.1f} MiB  {os.path.basename(path)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+# backup.py
+# Горячий бэкап store.db через online backup API SQLite — без остановки бота.
+# Копирование идёт шагами по BACKUP_PAGES страниц: блокировка чтения держится только
+# на время шага, между шагами — пауза BACKUP_SLEEP_MS, и записи обработчиков проходят.
+# Запись в БД между шагами заставляет SQLite начать копирование заново (в progress это
+# видно по тому, что remaining не уменьшился). Поэтому из БД в режиме WAL копируется один
+# снимок: соединение-источник держит открытую транзакцию чтения, шаги идут по её версии
+# и не перезапускаются, а писатели в WAL читателя не ждут. БД в режиме rollback journal
+# копируется шагами как есть; после BACKUP_MAX_RESTARTS перезапусков она переводится в WAL
+# (это разовое и постоянное изменение файла) и копирование продолжается снимком. Одним
+# шагом (pages=-1) живая БД не копируется: в rollback journal он держит блокировку
+# чтения всё копирование, и писатели стоят пропорционально размеру БД.
+# Снимок пишется без fsync на каждую страницу (synchronous=OFF) — он сбрасывается на диск
+# после каждого шага: один fsync всего файла в конце занимает диск, и коммиты бота ждут его.
+# Готовый снимок проверяется PRAGMA integrity_check, атомарно переименовывается
+# и ротируется (хранятся последние BACKUP_KEEP).
+# Помесячные архивы заказов (archive.py) после снимка зеркалируются в <BACKUP_DIR>/archive:
+# копируются только новые и изменившиеся с прошлого раза файлы (меняется обычно один —
+# текущий месяц архивации). Зеркало не ротируется: старые месяцы есть только в архивах.
+# restore возвращает из зеркала архивы, которых нет на месте.
+#
+# Расписание: main.py вызывает start_scheduler() (BACKUP_INTERVAL_MIN > 0).
+# Вручную:
+#   python backup.py now
+#   python backup.py list
+#   python backup.py verify data/backups/store-20250101-030000.db
+#   python backup.py restore data/backups/store-20250101-030000.db   # бот должен быть остановлен
+
+import argparse
+import glob
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import archive
+
+DB_PATH = os.getenv("DB_PATH", "store.db")
+BACKUP_DIR = os.getenv("BACKUP_DIR") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "backups")
+BACKUP_INTERVAL_MIN = int(os.getenv("BACKUP_INTERVAL_MIN", "360"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "14"))
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", "128"))
+BACKUP_SLEEP_MS = int(os.getenv("BACKUP_SLEEP_MS", "10"))
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "3"))
+
+_last = {}
+
+def last_backup() -> dict:
+    return dict(_last)
+
+def integrity_check(path: str) -> str:
+    con = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+    try:
+        rows = con.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        con.close()
+    return "; ".join(r[0] for r in rows)
+
+class _TooManyRestarts(Exception):
+    pass
+
+def _pin_snapshot(src: sqlite3.Connection):
+    """Открыть на src транзакцию чтения: шаги backup() копируют одну версию БД."""
+    src.execute("BEGIN")
+    src.execute("SELECT count(*) FROM sqlite_master").fetchone()
+
+def _to_wal(src: sqlite3.Connection, timeout: float = 30.0) -> str:
+    """Перевести БД в WAL. Нужна монопольная блокировка, и на ней SQLite может вернуть
+    «database is locked» сразу, не дожидаясь busy timeout, — поэтому короткие повторы."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return src.execute("PRAGMA journal_mode=WAL").fetchone()[0].lower()
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) or time.monotonic() > deadline:
+                raise
+            time.sleep(0.005)
+
+def _copy(src_path: str, dst_path: str, pages: int, sleep_ms: int,
+          max_restarts: int = BACKUP_MAX_RESTARTS) -> dict:
+    """
+    Постраничное копирование src → dst (pages=-1 — за один шаг, только для БД без записей:
+    restore, pre-restore); возвращает длительность, самый долгий шаг и число перезапусков.
+    Из WAL — снимком без перезапусков; rollback journal после max_restarts переводится в WAL.
+    """
+    src = sqlite3.connect(src_path, timeout=30, isolation_level=None)
+    dst = sqlite3.connect(dst_path)
+    dst.execute("PRAGMA synchronous=OFF")
+    dst.execute("PRAGMA user_version").fetchone()       # файл создан — для fsync по шагам
+    fd = os.open(dst_path, os.O_RDWR)
+    steps = [0]
+    restarts = [0]
+    max_step = [0.0]
+    t_step = [time.perf_counter()]
+    last_remaining = [None]
+    paged = pages >= 0
+    wal = src.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal"
+    converted = False
+
+    def progress(status, remaining, total):
+        steps[0] += 1
+        max_step[0] = max(max_step[0], time.perf_counter() - t_step[0])
+        os.fsync(fd)
+        # после перезапуска копирование идёт с начала: remaining не уменьшается
+        if last_remaining[0] is not None and remaining >= last_remaining[0]:
+            restarts[0] += 1
+            if restarts[0] > max_restarts and not wal:
+                raise _TooManyRestarts()    # исключение из progress прерывает backup()
+        last_remaining[0] = remaining
+        # пауза между шагами — здесь: параметр sleep у backup() срабатывает только на SQLITE_BUSY
+        if remaining and sleep_ms and paged:
+            time.sleep(sleep_ms / 1000)
+        t_step[0] = time.perf_counter()
+
+    t0 = time.perf_counter()
+    try:
+        step = max(1, pages) if paged else -1
+        try:
+            if wal and paged:
+                _pin_snapshot(src)
+            src.backup(dst, pages=step, progress=progress, sleep=sleep_ms / 1000)
+        except _TooManyRestarts:
+            mode = _to_wal(src)
+            if mode != "wal":
+                raise RuntimeError(f"{os.path.basename(src_path)}: copy keeps restarting "
+                                   f"under writes and journal_mode=WAL is not available ({mode})")
+            wal = converted = True
+            print(f"[backup] {os.path.basename(src_path)}: {restarts[0]} restarts under writes, "
+                  f"switched to WAL, copying a snapshot")
+            last_remaining[0] = None
+            t_step[0] = time.perf_counter()
+            _pin_snapshot(src)
+            src.backup(dst, pages=step, progress=progress, sleep=sleep_ms / 1000)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+        dst.close(); src.close()
+    res = {"seconds": round(time.perf_counter() - t0, 3), "steps": steps[0],
+           "max_step_ms": round(max_step[0] * 1000, 2), "restarts": restarts[0]}
+    if converted:
+        res["converted_to_wal"] = True
+    return res
+
+def list_backups(backup_dir: str = BACKUP_DIR) -> list:
+    return sorted(glob.glob(os.path.join(backup_dir, "store-*.db")))
+
+def rotate(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> list:
+    snaps = list_backups(backup_dir)
+    removed = snaps[:-keep] if keep > 0 else []
+    for p in removed:
+        try:
+            os.remove(p)
+        except OSError as e:
+            print(f"[backup] rotate error {p}: {e}")
+    return removed
+
+def backup_now(db_path: str = DB_PATH, backup_dir: str = BACKUP_DIR,
+               pages: int = BACKUP_PAGES, sleep_ms: int = BACKUP_SLEEP_MS, keep: int = BACKUP_KEEP) -> dict:
+    """Снять снимок, проверить, переименовать в store-YYYYmmdd-HHMMSS.db и ротировать."""
+    os.makedirs(backup_dir, exist_ok=True)
+    name = f"store-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db"
+    final = os.path.join(backup_dir, name)
+    tmp = final + ".part"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    res = _copy(db_path, tmp, pages, sleep_ms)
+    check = integrity_check(tmp)
+    if check != "ok":
+        os.remove(tmp)
+        raise RuntimeError(f"integrity_check failed for snapshot: {check}")
+    os.replace(tmp, final)
+    res.update({"path": final, "bytes": os.path.getsize(final), "removed": len(rotate(backup_dir, keep)),
+                "archives": backup_archives(db_path, backup_dir, pages, sleep_ms),
+                "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+    _last.clear(); _last.update(res)
+    print(f"[backup] {name}: {res['bytes'] / (1 << 20):.1f} MiB in {res['seconds']}s, "
+          f"{res['steps']} steps, max step {res['max_step_ms']} ms, restarts {res['restarts']}, "
+          f"rotated {res['removed']}, "
+          f"archives copied {res['archives']}")
+    return res
+
+def backup_archives(db_path: str = DB_PATH, backup_dir: str = BACKUP_DIR,
+                    pages: int = BACKUP_PAGES, sleep_ms: int = BACKUP_SLEEP_MS) -> int:
+    """Скопировать в backup_dir/archive новые и изменившиеся архивы db_path. Возвращает число файлов."""
+    src_dir = archive.archive_dir(db_path)
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    dst_dir = os.path.join(backup_dir, "archive")
+    copied = 0
+    for src in sorted(glob.glob(os.path.join(src_dir, f"{stem}-orders-*.db"))):
+        dst = os.path.join(dst_dir, os.path.basename(src))
+        mtime = os.stat(src).st_mtime_ns
+        if os.path.exists(dst) and os.stat(dst).st_mtime_ns >= mtime:
+            continue
+        os.makedirs(dst_dir, exist_ok=True)
+        _copy(src, dst + ".part", pages, sleep_ms)
+        check = integrity_check(dst + ".part")
+        if check != "ok":
+            os.remove(dst + ".part")
+            raise RuntimeError(f"integrity_check failed for {os.path.basename(src)}: {check}")
+        os.replace(dst + ".part", dst)
+        # время исходника до копирования: изменённый во время копирования файл скопируется снова
+        os.utime(dst, ns=(mtime, mtime))
+        copied += 1
+    return copied
+
+def restore(snapshot: str, db_path: str = DB_PATH, backup_dir: str = BACKUP_DIR) -> dict:
+    """
+    Восстановить БД из снимка. Текущая БД сначала сохраняется отдельным снимком
+    (pre-restore-*.db), затем содержимое снимка копируется в неё тем же backup API.
+    """
+    check = integrity_check(snapshot)
+    if check != "ok":
+        raise SystemExit(f"Снимок повреждён: {check}")
+    if os.path.exists(db_path):
+        os.makedirs(backup_dir, exist_ok=True)
+        keep = os.path.join(backup_dir, f"pre-restore-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db")
+        _copy(db_path, keep, pages=-1, sleep_ms=0)
+        print(f"[backup] current DB saved to {keep}")
+    res = _copy(snapshot, db_path, pages=-1, sleep_ms=0)
+    print(f"[backup] restored {db_path} from {snapshot} in {res['seconds']}s")
+    # архивы: на месте оставляем существующие, недостающие — из зеркала
+    arc_dir = archive.archive_dir(db_path)
+    for src in sorted(glob.glob(os.path.join(backup_dir, "archive", "*-orders-*.db"))):
+        dst = os.path.join(arc_dir, os.path.basename(src))
+        if not os.path.exists(dst):
+            os.makedirs(arc_dir, exist_ok=True)
+            _copy(src, dst, pages=-1, sleep_ms=0)
+            print(f"[backup] restored archive {os.path.basename(dst)}")
+    return res
+
+# ============================ Расписание ============================
+
+def _loop(interval_min: int, targets: list):
+    while True:
+        time.sleep(interval_min * 60)
+        for db_path, backup_dir in targets:
+            try:
+                backup_now(db_path, backup_dir)
+            except Exception as e:
+                print(f"[backup] error ({db_path}): {e}")
+
+def start_scheduler(interval_min: int = BACKUP_INTERVAL_MIN, shops=None):
+    """shops — магазины (tenants.Tenant) со своими БД: снимки каждого — в BACKUP_DIR/<имя>."""
+    if interval_min <= 0:
+        return None
+    if shops and any(s.db_path for s in shops):
+        targets = [(s.db_path or DB_PATH, os.path.join(BACKUP_DIR, s.name)) for s in shops]
+    else:
+        targets = [(DB_PATH, BACKUP_DIR)]
+    th = threading.Thread(target=_loop, args=(interval_min, targets), name="backup", daemon=True)
+    th.start()
+    print(f"[backup] every {interval_min} min: {len(targets)} DB to {BACKUP_DIR}, keep {BACKUP_KEEP}")
+    return th
+
+def main():
+    ap = argparse.ArgumentParser(description="Горячий бэкап и восстановление store.db")
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--dir", default=BACKUP_DIR, help="каталог снимков")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("now")
+    sub.add_parser("list")
+    v = sub.add_parser("verify"); v.add_argument("snapshot")
+    r = sub.add_parser("restore"); r.add_argument("snapshot")
+    args = ap.parse_args()
+
+    if args.cmd == "now":
+        backup_now(args.db, args.dir)
+    elif args.cmd == "list":
+        for p in list_backups(args.dir):
+            print(f"{os.path.basename(p)}  {os.path.getsize(p) / (1 << 20):8.1f} MiB")
+    elif args.cmd == "verify":
+        print(integrity_check(args.snapshot))
+    elif args.cmd == "restore":
+        restore(args.snapshot, args.db, args.dir)
+
+if __name__ == "__main__":
+    main()
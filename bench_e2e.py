@@ -0,0 +1,270 @@
+# bench_e2e.py
+# Сквозной бенчмарк пропускной способности: гоняем handlers_user.bot против
+# локальной заглушки Bot API (fake_botapi.py) на копии засеянной store.db.
+#
+#   python bench_e2e.py --db store.db --users 50 --rounds 10 --concurrency 8
+#
+# Для каждого сценария (каталог, карточка товара, корзина, оформление, профиль)
+# печатает updates/sec и перцентили задержки обработки одного апдейта.
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from itertools import count
+
+from fake_botapi import FakeBotAPI
+
+SCENARIOS = ["catalog", "category", "product", "add", "inc", "dec", "cart", "checkout", "profile"]
+
+# ============================ Статистика ============================
+
+def percentile(sorted_vals: list, q: float) -> float:
+    """Перцентиль по методу ближайшего ранга (sorted_vals уже отсортирован)."""
+    if not sorted_vals:
+        return 0.0
+    k = max(0, min(len(sorted_vals) - 1, int(round(q / 100.0 * len(sorted_vals) + 0.5)) - 1))
+    return sorted_vals[k]
+
+def summarize(latencies: list, wall: float) -> dict:
+    vals = sorted(latencies)
+    n = len(vals)
+    return {
+        "updates": n,
+        "wall_s": round(wall, 3),
+        "upd_per_s": round(n / wall, 1) if wall > 0 else 0.0,
+        "mean_ms": round(sum(vals) / n * 1000, 2) if n else 0.0,
+        "p50_ms": round(percentile(vals, 50) * 1000, 2),
+        "p95_ms": round(percentile(vals, 95) * 1000, 2),
+        "p99_ms": round(percentile(vals, 99) * 1000, 2),
+        "max_ms": round(vals[-1] * 1000, 2) if n else 0.0,
+    }
+
+def print_table(rows: dict):
+    head = f"{'scenario':<12}{'updates':>9}{'upd/s':>10}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+    print(head)
+    print("-" * len(head))
+    for name, r in rows.items():
+        print(f"{name:<12}{r['updates']:>9}{r['upd_per_s']:>10}{r['mean_ms']:>9}"
+              f"{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['max_ms']:>9}")
+
+# ============================ Подготовка окружения ============================
+
+def prepare_bot(db_src: str, fake: FakeBotAPI):
+    """
+    Копирует БД во временный каталог, направляет telebot на заглушку и
+    импортирует handlers_user (модуль создаёт бота и инициализирует БД при импорте).
+    """
+    tmpdir = tempfile.mkdtemp(prefix="bench_")
+    db_path = os.path.join(tmpdir, "store.db")
+    shutil.copyfile(db_src, db_path)
+    os.environ["DB_PATH"] = db_path
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCH")
+    fake.install()
+
+    import handlers_user
+    return handlers_user, tmpdir
+
+def drain(hu):
+    """Дождаться отложенных перерисовок корзины, полос обработки и очереди исходящих."""
+    renderer = getattr(hu, "cart_renderer", None)
+    if renderer is not None:
+        renderer.wait_idle()
+    dispatcher = getattr(hu, "dispatcher", None)
+    if dispatcher is not None:
+        dispatcher.wait_idle()
+    outbox = getattr(hu, "outbox", None)
+    if outbox is not None:
+        outbox.wait_idle()
+
+# ============================ Синтетические апдейты ============================
+
+_update_ids = count(1)
+_message_ids = count(1)
+
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"User{uid}", "username": f"user{uid}"}
+
+def make_message(uid: int, text: str) -> dict:
+    msg = {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": uid, "type": "private"},
+        "from": _user(uid),
+        "text": text,
+    }
+    if text.startswith("/"):
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": next(_update_ids), "message": msg}
+
+def make_location(uid: int, lat: float, lon: float) -> dict:
+    upd = make_message(uid, "")
+    del upd["message"]["text"]
+    upd["message"]["location"] = {"latitude": lat, "longitude": lon}
+    return upd
+
+def make_callback(uid: int, data: str, message_id: int | None = None, text: str = "…") -> dict:
+    uid_n = next(_update_ids)
+    return {
+        "update_id": uid_n,
+        "callback_query": {
+            "id": str(uid_n),
+            "from": _user(uid),
+            "chat_instance": str(uid),
+            "data": data,
+            "message": {
+                "message_id": message_id or next(_message_ids),
+                "date": int(time.time()),
+                "chat": {"id": uid, "type": "private"},
+                "text": text,
+            },
+        },
+    }
+
+class Session:
+    """Синтетический пользователь: знает каталог и строит апдейты для сценариев."""
+
+    def __init__(self, hu, uid: int, rnd: random.Random, catalog: dict):
+        self.hu, self.uid, self.rnd, self.catalog = hu, uid, rnd, catalog
+        self.cart_msg = next(_message_ids)
+
+    def _pid(self) -> int:
+        return self.rnd.choice(self.catalog["products"])
+
+    def steps(self, scenario: str) -> list:
+        hu, uid = self.hu, self.uid
+        if scenario == "catalog":
+            return [make_message(uid, hu.BTN_CATALOG)]
+        if scenario == "category":
+            return [make_callback(uid, f"cat:{self.rnd.choice(self.catalog['categories'])}")]
+        if scenario == "product":
+            return [make_callback(uid, f"prod:{self._pid()}")]
+        if scenario == "add":
+            return [make_callback(uid, f"add:{self._pid()}")]
+        if scenario in ("inc", "dec"):
+            cart = hu.get_cart(uid)
+            pid = next(iter(cart), None) or self._pid()
+            return [make_callback(uid, f"{scenario}:{pid}", self.cart_msg)]
+        if scenario == "cart":
+            return [make_message(uid, hu.BTN_CART)]
+        if scenario == "profile":
+            return [make_message(uid, hu.BTN_PROFILE)]
+        raise ValueError(scenario)
+
+    def checkout(self, run):
+        """Оформление: add → checkout:start → телефон → адрес или (геопозиция →) пункт раздачи."""
+        hu, uid = self.hu, self.uid
+        run(make_callback(uid, f"add:{self._pid()}"))
+        run(make_callback(uid, "checkout:start", self.cart_msg))
+        run(make_message(uid, f"+38160{uid % 10_000_000:07d}"))
+        st = hu.Admin_bot.admin_fsm.get(uid) or {}
+        if st.get("action") == "checkout_pickup_loc":
+            run(make_location(uid, self.rnd.uniform(42.0, 46.6), self.rnd.uniform(18.5, 25.0)))
+            st = hu.Admin_bot.admin_fsm.get(uid) or {}
+        if st.get("action") == "checkout_addr_home":
+            run(make_message(uid, f"Bench street {uid}"))
+        elif st.get("action") == "checkout_pickup" and self.catalog["pickup"]:
+            run(make_callback(uid, f"choose_pickup:{self.rnd.choice(self.catalog['pickup'])}"))
+
+# ============================ Прогон ============================
+
+def run_phase(hu, sessions: list, scenario: str, rounds: int, concurrency: int):
+    from telebot import types
+    bot = hu.get_bot()
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def run(upd: dict):
+        u = types.Update.de_json(upd)
+        t0 = time.perf_counter()
+        try:
+            # апдейт уходит в полосу пользователя; ждём завершения обработки
+            for f in bot.process_new_updates([u]) or ():
+                f.result()
+        except Exception as e:
+            with lock:
+                errors[0] += 1
+            print(f"[bench] {scenario} error: {e}")
+        dt = time.perf_counter() - t0
+        with lock:
+            latencies.append(dt)
+
+    def worker(chunk):
+        for _ in range(rounds):
+            for s in chunk:
+                if scenario == "checkout":
+                    s.checkout(run)
+                else:
+                    for upd in s.steps(scenario):
+                        run(upd)
+
+    chunks = [sessions[i::concurrency] for i in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(c,)) for c in chunks if c]
+    t0 = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall = time.perf_counter() - t0
+    # отложенные перерисовки корзины должны уйти до снятия счётчиков API
+    drain(hu)
+    res = summarize(latencies, wall)
+    res["errors"] = errors[0]
+    return res
+
+def load_catalog(Admin_bot) -> dict:
+    cats = [c["id"] for c in Admin_bot.list_categories()]
+    prods = []
+    for cid in cats:
+        prods += [p["id"] for p in Admin_bot.list_products(cid)]
+    pickup = [p["id"] for p in Admin_bot.list_pickup_points()]
+    if not cats or not prods:
+        raise SystemExit("В БД нет категорий/товаров — засейте её (seed_data.py) перед бенчмарком.")
+    return {"categories": cats, "products": prods, "pickup": pickup}
+
+def main():
+    ap = argparse.ArgumentParser(description="E2E benchmark против локальной заглушки Bot API")
+    ap.add_argument("--db", default="store.db", help="исходная БД (копируется, не изменяется)")
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--rounds", type=int, default=5, help="повторов сценария на пользователя")
+    ap.add_argument("--concurrency", type=int, default=8, help="параллельных клиентских потоков")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("--api-delay-ms", type=float, default=0.0, help="задержка ответа заглушки")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--json", help="сохранить результаты в JSON-файл")
+    args = ap.parse_args()
+
+    fake = FakeBotAPI(delay_ms=args.api_delay_ms).start()
+    hu, tmpdir = prepare_bot(args.db, fake)
+    try:
+        catalog = load_catalog(hu.Admin_bot)
+        rnd = random.Random(args.seed)
+        base_uid = 900_000_000
+        sessions = [Session(hu, base_uid + i, random.Random(rnd.random()), catalog) for i in range(args.users)]
+
+        results = {}
+        for sc in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+            fake.reset_counters()
+            res = run_phase(hu, sessions, sc, args.rounds, max(1, args.concurrency))
+            res["api_calls"] = fake.snapshot()["calls"]
+            results[sc] = res
+
+        print(f"DB: {args.db}  users={args.users} rounds={args.rounds} concurrency={args.concurrency}")
+        print_table(results)
+        if getattr(hu, "dispatcher", None) is not None:
+            print(f"lanes: {hu.dispatcher.stats()}")
+        if getattr(hu, "outbox", None) is not None:
+            print(f"outbox: {hu.outbox.stats()}")
+        if hasattr(hu.carts, "stats"):
+            print(f"carts: {hu.carts.stats()}")
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+    finally:
+        fake.stop()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+# cart_store.py
+# Компактное хранилище корзин в памяти процесса.
+#  * Cart — корзина как один array('q') пар (product_id, qty) + время последнего доступа;
+#    ведёт себя как dict {product_id: qty}, поэтому остальной код не меняется.
+#  * CartStore — корзины по user_id с вытеснением простаивающих (TTL) через timing wheel.
+#    Непустая корзина при вытеснении может сохраняться в БД (spill) и подниматься
+#    обратно при следующем обращении пользователя.
+
+import os
+import sys
+import threading
+import time
+from array import array
+from collections.abc import MutableMapping
+
+CART_TTL_MIN = int(os.getenv("CART_TTL_MIN", "1440"))          # простой до вытеснения, минут
+CART_WHEEL_TICK_SEC = int(os.getenv("CART_WHEEL_TICK_SEC", "60"))
+CART_SPILL = os.getenv("CART_SPILL", "1") == "1"                # сохранять вытесняемые корзины в БД
+
+class Cart(MutableMapping):
+    """Корзина {product_id: qty} в одном массиве [pid0, qty0, pid1, qty1, ...]."""
+
+    __slots__ = ("_data", "touched")
+
+    def __init__(self, items=()):
+        self._data = array("q")
+        self.touched = time.monotonic()
+        for pid, qty in dict(items).items():
+            self[pid] = qty
+
+    def _find(self, pid) -> int:
+        d = self._data
+        for i in range(0, len(d), 2):
+            if d[i] == pid:
+                return i
+        return -1
+
+    def __getitem__(self, pid):
+        i = self._find(pid)
+        if i < 0:
+            raise KeyError(pid)
+        return self._data[i + 1]
+
+    def __setitem__(self, pid, qty):
+        i = self._find(pid)
+        if i < 0:
+            self._data.extend((int(pid), int(qty)))
+        else:
+            self._data[i + 1] = int(qty)
+
+    def __delitem__(self, pid):
+        i = self._find(pid)
+        if i < 0:
+            raise KeyError(pid)
+        del self._data[i:i + 2]
+
+    def __contains__(self, pid):
+        return self._find(pid) >= 0
+
+    def __iter__(self):
+        return iter(self._data[0::2].tolist())
+
+    def __len__(self):
+        return len(self._data) // 2
+
+    def items(self):
+        d = self._data
+        return list(zip(d[0::2].tolist(), d[1::2].tolist()))
+
+    def clear(self):
+        del self._data[:]
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self) + sys.getsizeof(self._data)
+
+    def __repr__(self):
+        return f"Cart({dict(self.items())!r})"
+
+class CartStore:
+    """
+    Корзины по user_id.
+      get(uid)   — корзина пользователя (создаёт/поднимает из БД, обновляет touched);
+      reset(uid) — очистить (после оформления заказа или «Очистить корзину»).
+    spill_save(uid, items) / spill_load(uid) -> items — сохранение вытесняемой корзины
+    и её подъём (с удалением сохранённой копии); без них корзины просто отбрасываются.
+    """
+
+    def __init__(self, ttl_sec: float = CART_TTL_MIN * 60, tick_sec: float = CART_WHEEL_TICK_SEC,
+                 spill_save=None, spill_load=None, start: bool = True):
+        self.ttl = float(ttl_sec)
+        self.tick = max(1.0, float(tick_sec))
+        self.spill_save = spill_save
+        self.spill_load = spill_load
+        self._carts: dict = {}
+        self._lock = threading.Lock()
+        # timing wheel: слот = набор uid, чей срок проверки наступает на этом тике
+        self._nslots = int(self.ttl // self.tick) + 2
+        self._wheel = [set() for _ in range(self._nslots)]
+        self._cursor = 0
+        self._scheduled = set()
+        self._spilling = {}           # uid -> Event: вытеснена, сохранение в БД ещё идёт
+        self.evicted = 0
+        self.spilled = 0
+        self.restored = 0
+        if start:
+            threading.Thread(target=self._run, name="cart-wheel", daemon=True).start()
+
+    # ---------- доступ ----------
+    def get(self, user_id: int) -> Cart:
+        while True:
+            with self._lock:
+                cart = self._carts.get(user_id)
+                if cart is not None:
+                    cart.touched = time.monotonic()
+                    return cart
+                pending = self._spilling.get(user_id)
+            if pending is None:
+                break
+            # корзина только что вытеснена: подъём из БД — после того, как она туда запишется
+            pending.wait()
+        # промах: поднимаем сохранённую корзину вне блокировки (чтение БД)
+        restored = Cart(self._restore(user_id))
+        with self._lock:
+            cart = self._carts.get(user_id)
+            if cart is None:
+                cart = self._carts[user_id] = restored
+                self._schedule(user_id, self.ttl)
+                if len(restored):
+                    self.restored += 1
+            cart.touched = time.monotonic()
+            return cart
+
+    def reset(self, user_id: int):
+        with self._lock:
+            cart = self._carts.get(user_id)
+            if cart is not None:
+                cart.clear()
+                cart.touched = time.monotonic()
+
+    def __contains__(self, user_id):
+        with self._lock:
+            return user_id in self._carts
+
+    def __len__(self):
+        with self._lock:
+            return len(self._carts)
+
+    def _restore(self, user_id: int):
+        if self.spill_load is None:
+            return ()
+        try:
+            items = self.spill_load(user_id)
+        except Exception as e:
+            print(f"[carts] restore error for {user_id}: {e}")
+            return ()
+        return items or ()
+
+    # ---------- timing wheel ----------
+    def _schedule(self, user_id: int, delay: float):
+        """Поставить uid на проверку через delay секунд (вызывается под self._lock)."""
+        if user_id in self._scheduled:
+            return
+        ticks = min(self._nslots - 1, max(1, int(-(-delay // self.tick))))
+        self._wheel[(self._cursor + ticks) % self._nslots].add(user_id)
+        self._scheduled.add(user_id)
+
+    def advance(self, now: float | None = None) -> int:
+        """Один тик колеса: вытеснить просроченные корзины текущего слота. Возвращает число вытеснённых."""
+        now = time.monotonic() if now is None else now
+        to_spill = []
+        evicted = 0
+        with self._lock:
+            self._cursor = (self._cursor + 1) % self._nslots
+            due = self._wheel[self._cursor]
+            self._wheel[self._cursor] = set()
+            for uid in due:
+                self._scheduled.discard(uid)
+                cart = self._carts.get(uid)
+                if cart is None:
+                    continue
+                idle = now - cart.touched
+                if idle < self.ttl:
+                    self._schedule(uid, self.ttl - idle)
+                    continue
+                del self._carts[uid]
+                evicted += 1
+                if len(cart) and self.spill_save is not None:
+                    to_spill.append((uid, cart))
+                    self._spilling[uid] = threading.Event()
+            self.evicted += evicted
+        # запись в БД — вне блокировки; get() этого uid ждёт её окончания
+        for uid, cart in to_spill:
+            try:
+                self.spill_save(uid, cart.items())
+                with self._lock:
+                    self.spilled += 1
+            except Exception as e:
+                print(f"[carts] spill error for {uid}: {e}")
+                with self._lock:
+                    # не записалась — корзина возвращается в память, а не теряется
+                    if uid not in self._carts:
+                        self._carts[uid] = cart
+                        self._schedule(uid, self.ttl)
+            finally:
+                with self._lock:
+                    self._spilling.pop(uid).set()
+        return evicted
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            try:
+                n = self.advance()
+            except Exception as e:
+                print(f"[carts] wheel error: {e}")
+                continue
+            if n:
+                st = self.stats()
+                print(f"[carts] evicted {n}, resident={st['carts']} "
+                      f"~{st['approx_bytes'] // 1024} KiB, spilled total={st['spilled']}")
+
+    # ---------- метрики ----------
+    def stats(self) -> dict:
+        with self._lock:
+            carts = list(self._carts.values())
+            nbytes = sys.getsizeof(self._carts) + sum(c.nbytes() for c in carts)
+            return {
+                "carts": len(carts),
+                "items": sum(len(c) for c in carts),
+                "approx_bytes": nbytes,
+                "evicted": self.evicted,
+                "spilled": self.spilled,
+                "restored": self.restored,
+            }
@@ -0,0 +1,304 @@
+# catalog_io.py
+# Массовый импорт/экспорт каталога (CSV или XLSX).
+#
+# Колонки: id, name, category, price, min_qty, image, description
+# (допустимы и русские заголовки: название, категория, цена, мин_кол, картинка, описание).
+#  * строка с id существующего товара — обновление; без id — поиск по названию, иначе новый товар;
+#  * обновляются только колонки, присутствующие в файле;
+#  * категории ищутся по названию и создаются при отсутствии.
+# Файл читается построчно, запись — пачками (executemany) по IMPORT_BATCH строк в транзакции.
+# Кэш каталога сбрасывает вызывающий код — один раз после импорта.
+# Функции принимают соединение con (SQLite или PostgreSQL, см. storage.py), чтобы модуль
+# не зависел от Admin_bot. Экспорт читает каталог серверным курсором (storage.iter_rows).
+# XLSX — через openpyxl, если он установлен.
+
+import csv
+import io
+import math
+import os
+import time
+
+import storage
+
+try:
+    import openpyxl
+except ImportError:      # XLSX — опционально
+    openpyxl = None
+
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "1000"))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+COLUMNS = ("id", "name", "category", "price", "min_qty", "image", "description")
+ALIASES = {
+    "id": "id", "артикул": "id",
+    "name": "name", "название": "name", "товар": "name",
+    "category": "category", "категория": "category",
+    "price": "price", "цена": "price",
+    "min_qty": "min_qty", "мин_кол": "min_qty", "минимум": "min_qty",
+    "image": "image", "картинка": "image", "фото": "image",
+    "description": "description", "описание": "description",
+}
+
+class ImportFormatError(ValueError):
+    """Файл не удаётся прочитать как таблицу каталога (заголовок, формат)."""
+
+# ============================ Чтение ============================
+
+def _decode_lines(data: bytes):
+    for enc in ("utf-8-sig", "cp1251"):
+        try:
+            return io.StringIO(data.decode(enc), newline="")
+        except UnicodeDecodeError:
+            continue
+    raise ImportFormatError("Не удалось определить кодировку CSV (ожидается UTF-8 или Windows-1251).")
+
+def iter_csv(data: bytes):
+    f = _decode_lines(data)
+    head = f.readline()
+    f.seek(0)
+    delim = ";" if head.count(";") > head.count(",") else ","
+    yield from csv.reader(f, delimiter=delim)
+
+def iter_xlsx(data: bytes):
+    if openpyxl is None:
+        raise ImportFormatError("Для XLSX нужен пакет openpyxl — пришлите CSV.")
+    wb = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        for row in wb.worksheets[0].iter_rows(values_only=True):
+            yield ["" if v is None else str(v) for v in row]
+    finally:
+        wb.close()
+
+def iter_rows(filename: str, data: bytes):
+    name = (filename or "").lower()
+    if name.endswith((".xlsx", ".xlsm")):
+        return iter_xlsx(data)
+    if name.endswith((".csv", ".txt")) or not name:
+        return iter_csv(data)
+    raise ImportFormatError("Поддерживаются файлы .csv и .xlsx.")
+
+def _header(row) -> dict:
+    cols = {}
+    for i, h in enumerate(row):
+        key = ALIASES.get(str(h).strip().lower().replace(" ", "_"))
+        if key and key not in cols:
+            cols[key] = i
+    if "name" not in cols and "id" not in cols:
+        raise ImportFormatError("В заголовке нет колонок name/название или id.")
+    return cols
+
+# ============================ Проверка строк ============================
+
+MAX_INT = 2 ** 63 - 1                # INTEGER SQLite / BIGINT PostgreSQL
+
+def _num(s: str) -> float:
+    v = float(str(s).strip().replace(" ", "").replace(" ", "").replace(",", "."))
+    if not math.isfinite(v):             # float() принимает nan, inf и 1e999
+        raise ValueError(f"«{s}» — не конечное число")
+    return v
+
+def _int(s: str) -> int:
+    v = int(_num(s))
+    if abs(v) > MAX_INT:
+        raise OverflowError(f"«{s}» — слишком большое число")
+    return v
+
+def parse_row(cols: dict, row: list) -> dict:
+    """Поля строки по заголовку; ValueError с понятным текстом при ошибке."""
+    def cell(key):
+        i = cols.get(key)
+        return str(row[i]).strip() if i is not None and i < len(row) else None
+
+    out = {}
+    raw_id = cell("id")
+    if raw_id:
+        try:
+            out["id"] = _int(raw_id)
+        except (ValueError, OverflowError):
+            raise ValueError(f"id «{raw_id}» — не число")
+        if out["id"] < 1:
+            raise ValueError(f"id «{raw_id}» меньше 1")
+    name = cell("name")
+    if name is not None:
+        if not name:
+            raise ValueError("пустое название")
+        out["name"] = name
+    price = cell("price")
+    if price is not None and price != "":
+        try:
+            out["price"] = _num(price)
+        except (ValueError, OverflowError):
+            raise ValueError(f"цена «{price}» — не число")
+        if out["price"] < 0:
+            raise ValueError("отрицательная цена")
+    min_qty = cell("min_qty")
+    if min_qty is not None and min_qty != "":
+        try:
+            out["min_qty"] = _int(min_qty)
+        except (ValueError, OverflowError):
+            raise ValueError(f"мин. количество «{min_qty}» — не число")
+        if out["min_qty"] < 1:
+            raise ValueError("мин. количество меньше 1")
+    for key in ("category", "image", "description"):
+        v = cell(key)
+        if v is not None:
+            out[key] = v
+    if "id" not in out and "name" not in out:
+        raise ValueError("нет ни id, ни названия")
+    return out
+
+# ============================ Импорт ============================
+
+def import_catalog(con, filename: str, data: bytes, batch: int = IMPORT_BATCH) -> dict:
+    """
+    Импорт каталога из файла. Возвращает отчёт:
+    {rows, inserted, updated, skipped, categories_created, errors: [(номер строки, текст)], seconds,
+     aborted}
+    inserted/updated/categories_created — записанное в БД. Если импорт прервался на середине
+    (битый файл, ошибка БД), записанные пачки остаются, текущая откатывается,
+    а в aborted — текст ошибки (иначе None).
+    """
+    t0 = time.perf_counter()
+    rows = iter_rows(filename, data)
+    try:
+        header = next(rows)
+    except StopIteration:
+        raise ImportFormatError("Файл пуст.")
+    cols = _header(header)
+
+    cat_ids = {}
+    for cid, name in con.execute("SELECT id, name FROM categories ORDER BY id"):
+        cat_ids.setdefault(name.strip().lower(), cid)
+    existing = {}     # id -> category_id
+    by_name = {}      # название (lower) -> id
+    for pid, name, cat_id in con.execute("SELECT id, name, category_id FROM products ORDER BY id"):
+        existing[pid] = cat_id
+        by_name.setdefault(name.strip().lower(), pid)
+    next_id = max(existing, default=0) + 1
+    next_cat = (con.execute("SELECT COALESCE(MAX(id), 0) FROM categories").fetchone()[0] or 0) + 1
+
+    report = {"rows": 0, "inserted": 0, "updated": 0, "skipped": 0, "categories_created": 0, "errors": [],
+              "aborted": None}
+    new_cats, inserts, updates = [], [], {}
+
+    def flush():
+        with con:
+            # id назначаются здесь — счётчик автоинкремента PostgreSQL подтягивается следом
+            if new_cats:
+                con.executemany("INSERT INTO categories(id, name) VALUES (?, ?)", new_cats)
+                storage.sync_ids(con, "categories")
+            if inserts:
+                con.executemany("""
+                    INSERT INTO products(id, name, price, min_qty, image, description, category_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, inserts)
+                storage.sync_ids(con, "products")
+            # обновления группируются по набору колонок — по одному executemany на набор
+            for fields, params in updates.items():
+                sets = ", ".join(f"{f}=?" for f in fields)
+                con.executemany(f"UPDATE products SET {sets} WHERE id=?", params)
+        report["categories_created"] += len(new_cats)
+        report["inserted"] += len(inserts)
+        report["updated"] += sum(len(params) for params in updates.values())
+        new_cats.clear(); inserts.clear(); updates.clear()
+
+    try:
+        pending = 0
+        for line_no, row in enumerate(rows, start=2):
+            if not any(str(c).strip() for c in row):
+                continue
+            report["rows"] += 1
+            try:
+                rec = parse_row(cols, row)
+                pid = rec.get("id")
+                if pid is None:
+                    pid = by_name.get(rec["name"].lower())
+                is_update = pid is not None and pid in existing
+                if not is_update:
+                    if "name" not in rec:
+                        raise ValueError(f"товара с id {pid} нет, а для нового нужно название")
+                    if "price" not in rec:
+                        raise ValueError("для нового товара нужна цена")
+                    if not rec.get("category"):
+                        raise ValueError("для нового товара нужна категория")
+                # категория создаётся только для строки, прошедшей проверку
+                cat_id = None
+                if rec.get("category"):
+                    key = rec["category"].lower()
+                    cat_id = cat_ids.get(key)
+                    if cat_id is None:
+                        cat_id = cat_ids[key] = next_cat
+                        next_cat += 1
+                        new_cats.append((cat_id, rec["category"]))
+                if is_update:
+                    fields = {k: rec[k] for k in ("name", "price", "min_qty", "image", "description") if k in rec}
+                    if cat_id is not None:
+                        fields["category_id"] = cat_id
+                    if not fields:
+                        report["skipped"] += 1
+                        continue
+                    updates.setdefault(tuple(fields), []).append(tuple(fields.values()) + (pid,))
+                else:
+                    if pid is None:
+                        pid = next_id
+                    next_id = max(next_id, pid + 1)
+                    inserts.append((pid, rec["name"], rec["price"], rec.get("min_qty", 1),
+                                    rec.get("image", ""), rec.get("description", ""), cat_id))
+                    existing[pid] = cat_id
+                    by_name.setdefault(rec["name"].lower(), pid)
+            except ValueError as e:
+                if len(report["errors"]) < IMPORT_MAX_ERRORS:
+                    report["errors"].append((line_no, str(e)))
+                continue
+            pending += 1
+            if pending >= batch:
+                flush()
+                pending = 0
+        flush()
+    except Exception as e:
+        report["aborted"] = f"{type(e).__name__}: {e}"
+    report["seconds"] = round(time.perf_counter() - t0, 3)
+    return report
+
+def errors_csv(errors: list) -> bytes:
+    out = io.StringIO()
+    w = csv.writer(out, delimiter=";")
+    w.writerow(("строка", "ошибка"))
+    w.writerows(errors)
+    return out.getvalue().encode("utf-8-sig")
+
+# ============================ Экспорт ============================
+
+_EXPORT_SQL = """
+    SELECT p.id, p.name, COALESCE(c.name, ''), p.price, p.min_qty,
+           COALESCE(p.image, ''), COALESCE(p.description, '')
+    FROM products p
+    LEFT JOIN categories c ON c.id = p.category_id
+    ORDER BY p.id
+"""
+
+def export_csv(con, fileobj):
+    """Записать каталог в бинарный fileobj построчно (курсор не материализуется). Возвращает число строк."""
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="", write_through=True)
+    w = csv.writer(text, delimiter=";")
+    w.writerow(COLUMNS)
+    n = 0
+    for row in storage.iter_rows(con, _EXPORT_SQL):
+        w.writerow(row)
+        n += 1
+    text.flush()
+    text.detach()
+    return n
+
+def export_xlsx(con, fileobj):
+    if openpyxl is None:
+        raise ImportFormatError("Для XLSX нужен пакет openpyxl.")
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("catalog")
+    ws.append(COLUMNS)
+    n = 0
+    for row in storage.iter_rows(con, _EXPORT_SQL):
+        ws.append(list(row))
+        n += 1
+    wb.save(fileobj)
+    return n
@@ -0,0 +1,114 @@
+# circuit.py
+# Автоматы защиты (circuit breaker) по ключу — для внешних хостов с картинками.
+# closed: запросы идут; BREAKER_FAILS неудач подряд (ошибка или ответ дольше BREAKER_SLOW_MS)
+#         → open: запросы сразу отклоняются, вызывающий код отдаёт запасной вариант;
+# через BREAKER_OPEN_S → half-open: пропускается один пробный запрос; успех закрывает
+#         автомат, неудача снова открывает его с удвоенной паузой (до BREAKER_MAX_OPEN_S).
+
+import os
+import threading
+import time
+
+BREAKER_FAILS = int(os.getenv("BREAKER_FAILS", "3"))
+BREAKER_SLOW_MS = int(os.getenv("BREAKER_SLOW_MS", "5000"))
+BREAKER_OPEN_S = float(os.getenv("BREAKER_OPEN_S", "60"))
+BREAKER_MAX_OPEN_S = float(os.getenv("BREAKER_MAX_OPEN_S", "900"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+class CircuitBreaker:
+    def __init__(self, fails: int = BREAKER_FAILS, slow_ms: int = BREAKER_SLOW_MS,
+                 open_s: float = BREAKER_OPEN_S, max_open_s: float = BREAKER_MAX_OPEN_S):
+        self.fails_limit = max(1, fails)
+        self.slow_ms = slow_ms
+        self.base_open_s = open_s
+        self.max_open_s = max_open_s
+        self.state = CLOSED
+        self.fails = 0
+        self.trips = 0
+        self.open_s = open_s
+        self.opened_at = 0.0
+        self.last_error = None
+        self._probe = False
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Можно ли сейчас идти к хосту. В half-open разрешается ровно один пробный запрос."""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and now - self.opened_at >= self.open_s:
+                self.state = HALF_OPEN
+                self._probe = False
+            # проба, не вернувшая результат за open_s, считается потерянной
+            if self.state == HALF_OPEN and (not self._probe or now - self._probe_at >= self.open_s):
+                self._probe, self._probe_at = True, now
+                return True
+            return False
+
+    def is_open(self) -> bool:
+        """Без побочных эффектов: открыт и пауза ещё не истекла (или идёт проба)."""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN:
+                return now - self.opened_at < self.open_s
+            return self.state == HALF_OPEN and self._probe and now - self._probe_at < self.open_s
+
+    def record(self, ok: bool, latency_ms: float = 0.0, error: str | None = None):
+        if ok and latency_ms > self.slow_ms:
+            ok, error = False, f"медленно: {latency_ms:.0f} мс"
+        with self._lock:
+            if ok:
+                self.state, self.fails, self.open_s = CLOSED, 0, self.base_open_s
+                return
+            self.fails += 1
+            self.last_error = error
+            if self.state == HALF_OPEN:
+                self.open_s = min(self.max_open_s, self.open_s * 2)
+                self._trip()
+            elif self.state == CLOSED and self.fails >= self.fails_limit:
+                self._trip()
+
+    def release(self):
+        """Запрос закончился без вердикта о хосте (кончился бюджет апдейта): пробу можно повторить."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe = False
+
+    def _trip(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self._probe = False
+        self.trips += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            left = max(0.0, self.open_s - (time.monotonic() - self.opened_at)) if self.state == OPEN else 0.0
+            return {"state": self.state, "fails": self.fails, "trips": self.trips,
+                    "retry_in_s": round(left), "last_error": self.last_error}
+
+class BreakerBoard:
+    """Набор автоматов по ключу (хосту); создаются при первом обращении."""
+
+    def __init__(self, **params):
+        self._params = params
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, key) -> CircuitBreaker:
+        with self._lock:
+            b = self._breakers.get(key)
+            if b is None:
+                b = self._breakers[key] = CircuitBreaker(**self._params)
+            return b
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            items = list(self._breakers.items())
+        return {k: b.snapshot() for k, b in items}
+
+    def total_trips(self) -> int:
+        with self._lock:
+            return sum(b.trips for b in self._breakers.values())
@@ -0,0 +1,261 @@
+# columnar_export.py
+# Инкрементальная выгрузка заказов в колоночные файлы для офлайн-аналитики (analytics.py).
+# Аналитика читает только выгрузку — живая store.db не блокируется тяжёлыми запросами.
+#
+#   python columnar_export.py --db store.db --out /data/columnar
+#   python columnar_export.py --db store.db --out /data/columnar --format parquet   # нужен pyarrow
+#
+# Формат npy (по умолчанию, без зависимостей): одна колонка = один .npy-файл, новые строки
+# дописываются в конец, заголовок с длиной переписывается на месте — файлы открываются
+# np.load(path, mmap_mode="r"). Формат parquet: каждый запуск пишет part-<hwm>.parquet.
+# meta.json — последним: число строк и high-water mark (последний выгруженный orders.id).
+# Справочники (товар → категория, названия) перезаписываются целиком при каждом запуске.
+# Статус заказа не выгружается — он меняется после оформления, а выгрузка только дописывает.
+# Заказы, которые archive.py успел перенести в помесячные архивы раньше, чем их выгрузили
+# (отставшая или новая выгрузка), читаются из архивов: нужные месяцы подключаются через ATTACH
+# по order_archives, пачка берётся из рабочей БД и архивов одним запросом по id.
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from array import array
+from datetime import date
+
+import archive
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:      # parquet — опционально
+    pa = pq = None
+
+EXPORT_BATCH = int(os.getenv("EXPORT_BATCH", "20000"))
+EXPORT_PAUSE_MS = int(os.getenv("EXPORT_PAUSE_MS", "5"))   # пауза между пачками, чтобы не мешать записи
+
+# имя колонки -> (typecode array, dtype numpy)
+ORDER_COLS = {
+    "id": ("q", "<i8"),
+    "user_id": ("q", "<i8"),
+    "total": ("d", "<f8"),
+    "day": ("i", "<i4"),      # дней от 1970-01-01
+}
+ITEM_COLS = {
+    "order_id": ("q", "<i8"),
+    "product_id": ("q", "<i8"),
+    "qty": ("i", "<i4"),
+    "price": ("d", "<f8"),
+    "day": ("i", "<i4"),      # день заказа (денормализовано для выручки по дням)
+}
+PRODUCT_COLS = {
+    "id": ("q", "<i8"),
+    "category_id": ("q", "<i8"),
+}
+
+_EPOCH = date(1970, 1, 1).toordinal()
+
+def day_number(ts: str) -> int:
+    """'YYYY-MM-DD HH:MM:SS' -> дней от 1970-01-01 (как datetime64[D])."""
+    return date(int(ts[0:4]), int(ts[5:7]), int(ts[8:10])).toordinal() - _EPOCH
+
+def connect_ro(db_path: str) -> sqlite3.Connection:
+    """Только чтение: выгрузка не может ничего записать в живую БД."""
+    return sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True, timeout=30)
+
+# ============================ .npy с дозаписью ============================
+
+_NPY_HEADER_LEN = 128
+
+def _npy_header(dtype: str, rows: int) -> bytes:
+    body = f"{{'descr': '{dtype}', 'fortran_order': False, 'shape': ({rows},), }}"
+    pad = _NPY_HEADER_LEN - 10 - len(body) - 1
+    return b"\x93NUMPY\x01\x00" + (_NPY_HEADER_LEN - 10).to_bytes(2, "little") + (body + " " * pad + "\n").encode()
+
+def _itemsize(dtype: str) -> int:
+    return int(dtype[2:])
+
+def npy_append(path: str, dtype: str, rows_before: int, values: array):
+    """Дописать значения после rows_before строк (хвост от оборванного запуска отрезается)."""
+    mode = "r+b" if os.path.exists(path) else "w+b"
+    with open(path, mode) as f:
+        f.truncate(_NPY_HEADER_LEN + rows_before * _itemsize(dtype))
+        f.seek(0, os.SEEK_END)
+        if f.tell() < _NPY_HEADER_LEN:
+            f.write(_npy_header(dtype, 0))
+        values.tofile(f)
+        f.seek(0)
+        f.write(_npy_header(dtype, rows_before + len(values)))
+        f.flush()
+        os.fsync(f.fileno())
+
+def npy_write(path: str, dtype: str, values: array):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_npy_header(dtype, len(values)))
+        values.tofile(f)
+    os.replace(tmp, path)
+
+# ============================ Выгрузка ============================
+
+def load_meta(out_dir: str) -> dict:
+    try:
+        with open(os.path.join(out_dir, "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_meta(out_dir: str, meta: dict):
+    tmp = os.path.join(out_dir, "meta.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, os.path.join(out_dir, "meta.json"))
+
+def _archive_months(con, after_id: int) -> list:
+    """Месяцы архивов с заказами id > after_id: [(первый такой id, month)] по возрастанию id."""
+    try:
+        months = [r[0] for r in con.execute(
+            "SELECT month FROM order_archives WHERE max_id > ? ORDER BY min_id", (after_id,))]
+    except sqlite3.OperationalError:     # БД без архивации
+        return []
+    db_path = archive.main_path(con)
+    missing = [m for m in months if not os.path.exists(archive.archive_file(db_path, m))]
+    if missing:
+        print(f"[export] archive files missing, orders skipped: {', '.join(missing)}")
+    months = [m for m in months if m not in missing]
+    out = []
+    for group in archive.groups(months):
+        with archive.attached(con, group) as schemas:
+            for s, month in zip(schemas, group):
+                first = con.execute(f"SELECT MIN(id) FROM {s}.orders WHERE id > ?", (after_id,)).fetchone()[0]
+                if first is not None:
+                    out.append((first, month))
+    return sorted(out)
+
+def _read_batch(con, after_id: int, limit: int):
+    """
+    Пачка заказов с id > after_id и их позиции — одной короткой транзакцией чтения
+    по рабочей БД и подключённым архивам. Месяцы, не поместившиеся в ARCHIVE_ATTACH_MAX,
+    ограничивают пачку сверху (своим первым невыгруженным id): их заказы — в следующих пачках.
+    """
+    months = _archive_months(con, after_id)
+    use, rest = months[:archive.ARCHIVE_ATTACH_MAX], months[archive.ARCHIVE_ATTACH_MAX:]
+    upper = rest[0][0] if rest else 2 ** 63 - 1
+    with archive.attached(con, [m for _, m in use]) as schemas:
+        src = ["main"] + schemas
+        con.execute("BEGIN")
+        try:
+            orders = con.execute(" UNION ALL ".join(
+                f"SELECT id, user_id, total, created_at FROM {s}.orders WHERE id > ? AND id < ?" for s in src
+            ) + " ORDER BY id LIMIT ?", (after_id, upper) * len(src) + (limit,)).fetchall()
+            items = []
+            if orders:
+                lo, hi = orders[0][0], orders[-1][0]
+                items = con.execute(" UNION ALL ".join(
+                    f"SELECT order_id, product_id, qty, price, id FROM {s}.order_items "
+                    f"WHERE order_id BETWEEN ? AND ?" for s in src
+                ) + " ORDER BY 1, 5", (lo, hi) * len(src)).fetchall()
+                items = [r[:4] for r in items]
+        finally:
+            con.execute("COMMIT")
+    return orders, items
+
+def _columns(spec: dict) -> dict:
+    return {name: array(tc) for name, (tc, _) in spec.items()}
+
+def _export_dims(con, out_dir: str, fmt: str):
+    prods = con.execute("SELECT id, category_id, name FROM products ORDER BY id").fetchall()
+    cats = con.execute("SELECT id, name FROM categories ORDER BY id").fetchall()
+    cols = _columns(PRODUCT_COLS)
+    for pid, cat_id, _ in prods:
+        cols["id"].append(pid)
+        cols["category_id"].append(cat_id if cat_id is not None else -1)
+    d = os.path.join(out_dir, "products")
+    os.makedirs(d, exist_ok=True)
+    if fmt == "parquet":
+        pq.write_table(pa.table({k: v.tolist() for k, v in cols.items()}), os.path.join(d, "products.parquet"))
+    else:
+        for name, (_, dtype) in PRODUCT_COLS.items():
+            npy_write(os.path.join(d, f"{name}.npy"), dtype, cols[name])
+    names = {"products": {str(p[0]): p[2] for p in prods}, "categories": {str(c[0]): c[1] for c in cats}}
+    tmp = os.path.join(out_dir, "names.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(names, f, ensure_ascii=False)
+    os.replace(tmp, os.path.join(out_dir, "names.json"))
+
+def export(db_path: str, out_dir: str, fmt: str = "npy", batch: int = EXPORT_BATCH) -> dict:
+    """Дописать в out_dir заказы новее high-water mark. Возвращает обновлённый meta."""
+    if fmt == "parquet" and pq is None:
+        raise SystemExit("Для --format parquet нужен pyarrow (pip install pyarrow).")
+    os.makedirs(out_dir, exist_ok=True)
+    meta = load_meta(out_dir)
+    if meta and meta.get("format", "npy") != fmt:
+        raise SystemExit(f"{out_dir} уже содержит выгрузку в формате {meta['format']}.")
+    meta.setdefault("format", fmt)
+    meta.setdefault("hwm_order_id", 0)
+    meta.setdefault("rows", {"orders": 0, "order_items": 0})
+    meta["columns"] = {
+        "orders": {k: v[1] for k, v in ORDER_COLS.items()},
+        "order_items": {k: v[1] for k, v in ITEM_COLS.items()},
+        "products": {k: v[1] for k, v in PRODUCT_COLS.items()},
+    }
+    for t in ("orders", "order_items"):
+        os.makedirs(os.path.join(out_dir, t), exist_ok=True)
+
+    t0 = time.perf_counter()
+    con = connect_ro(db_path)
+    con.isolation_level = None
+    new_orders = new_items = 0
+    try:
+        while True:
+            orders, items = _read_batch(con, meta["hwm_order_id"], batch)
+            if not orders:
+                break
+            oc, ic = _columns(ORDER_COLS), _columns(ITEM_COLS)
+            days, by_date = {}, {}
+            for oid, uid, total, created in orders:
+                day = by_date.get(created[:10])
+                if day is None:
+                    day = by_date[created[:10]] = day_number(created)
+                days[oid] = day
+                oc["id"].append(oid); oc["user_id"].append(uid)
+                oc["total"].append(total); oc["day"].append(day)
+            for oid, pid, qty, price in items:
+                ic["order_id"].append(oid); ic["product_id"].append(pid)
+                ic["qty"].append(qty); ic["price"].append(price); ic["day"].append(days[oid])
+            hwm = orders[-1][0]
+            for table, spec, cols in (("orders", ORDER_COLS, oc), ("order_items", ITEM_COLS, ic)):
+                d = os.path.join(out_dir, table)
+                if fmt == "parquet":
+                    pq.write_table(pa.table({k: v.tolist() for k, v in cols.items()}),
+                                   os.path.join(d, f"part-{hwm:012d}.parquet"))
+                else:
+                    for name, (_, dtype) in spec.items():
+                        npy_append(os.path.join(d, f"{name}.npy"), dtype, meta["rows"][table], cols[name])
+            meta["rows"]["orders"] += len(orders)
+            meta["rows"]["order_items"] += len(items)
+            meta["hwm_order_id"] = hwm
+            meta["updated_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            save_meta(out_dir, meta)
+            new_orders += len(orders); new_items += len(items)
+            if EXPORT_PAUSE_MS:
+                time.sleep(EXPORT_PAUSE_MS / 1000)
+        _export_dims(con, out_dir, fmt)
+    finally:
+        con.close()
+    save_meta(out_dir, meta)
+    print(f"[export] +{new_orders} orders, +{new_items} items in {time.perf_counter() - t0:.1f}s "
+          f"(hwm={meta['hwm_order_id']}, total orders={meta['rows']['orders']})")
+    return meta
+
+def main():
+    ap = argparse.ArgumentParser(description="Инкрементальная колоночная выгрузка заказов")
+    ap.add_argument("--db", default=os.getenv("DB_PATH", "store.db"))
+    ap.add_argument("--out", required=True, help="каталог выгрузки")
+    ap.add_argument("--format", choices=("npy", "parquet"), default="npy")
+    ap.add_argument("--batch", type=int, default=EXPORT_BATCH)
+    args = ap.parse_args()
+    export(args.db, args.out, args.format, args.batch)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# debounce.py
+# Отложенный запуск по ключу: повторный submit с тем же ключом заменяет ожидающую задачу
+# и сдвигает срок. Срабатывает последняя задача — промежуточные отбрасываются.
+# Один фоновый поток на экземпляр (без threading.Timer на каждое нажатие).
+# Задача выполняется в контексте (contextvars) своего submit — например, в своём магазине.
+
+import contextvars
+import functools
+import heapq
+import itertools
+import threading
+import time
+
+class Debouncer:
+    """
+    delay     — тишина после последнего submit, после которой задача выполняется;
+    max_delay — верхняя граница ожидания от первого submit серии (чтобы непрерывные
+                нажатия не откладывали выполнение бесконечно).
+    """
+
+    def __init__(self, delay: float, max_delay: float | None = None, name: str = "debouncer"):
+        self.delay = float(delay)
+        self.max_delay = float(max_delay) if max_delay else None
+        self._pending = {}          # key -> [due, first_submit, fn]
+        self._heap = []             # (due, seq, key)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.submitted = 0
+        self.executed = 0
+        self._running = 0
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, key, fn):
+        now = time.monotonic()
+        with self._cond:
+            self.submitted += 1
+            ent = self._pending.get(key)
+            first = ent[1] if ent else now
+            due = now + self.delay
+            if self.max_delay is not None:
+                due = min(due, first + self.max_delay)
+            self._pending[key] = [due, first, functools.partial(contextvars.copy_context().run, fn)]
+            heapq.heappush(self._heap, (due, next(self._seq), key))
+            self._cond.notify_all()
+
+    def cancel(self, key):
+        with self._cond:
+            self._pending.pop(key, None)
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def wait_idle(self, timeout: float = 10.0) -> bool:
+        """Дождаться выполнения всех отложенных задач (для бенчмарков и остановки)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._running:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._cond.wait(min(left, 0.05))
+        return True
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    due, _, key = self._heap[0]
+                    now = time.monotonic()
+                    if due > now:
+                        self._cond.wait(due - now)
+                        continue
+                    heapq.heappop(self._heap)
+                    ent = self._pending.get(key)
+                    # устаревшая запись кучи (задачу заменили или отменили)
+                    if not ent or ent[0] != due:
+                        continue
+                    del self._pending[key]
+                    fn = ent[2]
+                    self._running += 1
+                    break
+            try:
+                fn()
+            except Exception as e:
+                print(f"[debounce] task error: {e}")
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self.executed += 1
+                    self._cond.notify_all()
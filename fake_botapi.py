@@ -0,0 +1,164 @@
+# fake_botapi.py
+# Локальная заглушка Telegram Bot API для бенчмарков и реплея.
+# Поднимает HTTP-сервер на 127.0.0.1, отвечает на getUpdates/sendMessage/sendPhoto/
+# editMessage*/answerCallbackQuery и считает вызовы по методам.
+
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from telebot import apihelper
+
+# Методы, которые возвращают объект Message
+MESSAGE_METHODS = {
+    "sendMessage", "sendPhoto", "sendDocument", "sendLocation",
+    "editMessageText", "editMessageReplyMarkup", "editMessageCaption",
+}
+
+class FakeBotAPI:
+    """
+    Заглушка Bot API. Использование:
+        api = FakeBotAPI(delay_ms=0).start()
+        api.install()          # направить telebot на заглушку
+        ...
+        api.stop()
+    delay_ms — искусственная задержка ответа (имитация RTT до Telegram).
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, delay_ms: float = 0.0):
+        self.delay = max(0.0, float(delay_ms)) / 1000.0
+        self.calls = Counter()
+        self.errors = Counter()  # answerCallbackQuery с текстом "Ошибка" и т.п.
+        self._lock = threading.Lock()
+        self._msg_id = 1000
+        self._updates = []   # очередь для getUpdates
+        self._cond = threading.Condition()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    # ---------- жизненный цикл ----------
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def install(self):
+        apihelper.API_URL = self.url + "/bot{0}/{1}"
+        apihelper.FILE_URL = self.url + "/file/bot{0}/{1}"
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # ---------- getUpdates ----------
+    def push_updates(self, updates: list):
+        with self._cond:
+            self._updates.extend(updates)
+            self._cond.notify_all()
+
+    def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            # offset подтверждает всё, что меньше него
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            return list(self._updates[:limit])
+
+    # ---------- ответы ----------
+    def _next_message_id(self) -> int:
+        with self._lock:
+            self._msg_id += 1
+            return self._msg_id
+
+    def _result(self, method: str, params: dict):
+        if method == "getUpdates":
+            return self._get_updates(params)
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+        if method in MESSAGE_METHODS:
+            chat_id = int(params.get("chat_id") or 0)
+            mid = int(params.get("message_id") or 0) or self._next_message_id()
+            msg = {
+                "message_id": mid,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+            }
+            if method in ("sendPhoto",):
+                msg["photo"] = [{"file_id": f"fake-{mid}", "file_unique_id": f"u{mid}", "width": 1, "height": 1}]
+                msg["caption"] = params.get("caption", "")
+            elif method == "sendDocument":
+                msg["document"] = {"file_id": f"fake-{mid}", "file_unique_id": f"u{mid}"}
+            else:
+                msg["text"] = params.get("text", "")
+            return msg
+        # answerCallbackQuery, deleteMessage и прочее
+        if method == "answerCallbackQuery" and params.get("text") == "Ошибка":
+            with self._lock:
+                self.errors[method] += 1
+        return True
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # иначе keep-alive ответы ждут delayed ACK (~40 мс)
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                parsed = urlparse(self.path)
+                parts = parsed.path.strip("/").split("/")
+                method = parts[-1] if parts else ""
+                params = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                ctype = self.headers.get("Content-Type", "")
+                if body and ctype.startswith("application/x-www-form-urlencoded"):
+                    params.update({k: v[-1] for k, v in parse_qs(body.decode("utf-8")).items()})
+                elif body and ctype.startswith("application/json"):
+                    try:
+                        params.update(json.loads(body))
+                    except ValueError:
+                        pass
+
+                with api._lock:
+                    api.calls[method] += 1
+                if api.delay and method != "getUpdates":
+                    time.sleep(api.delay)
+
+                payload = json.dumps({"ok": True, "result": api._result(method, params)}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = _handle
+            do_POST = _handle
+
+        return Handler
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"calls": dict(self.calls), "errors": dict(self.errors)}
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.errors.clear()
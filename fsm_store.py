@@ -0,0 +1,144 @@
+# fsm_store.py
+# Хранилище пошаговых состояний (FSM) с сохранением в SQLite и сроком жизни по типу шага.
+# Память — рабочая копия: при первом обращении поднимаются все живые состояния из БД,
+# дальше чтения идут из памяти, а каждая запись сразу сохраняется в таблицу fsm_states.
+# Просроченные состояния удаляются пачкой (sweep) фоновым потоком.
+# Интерфейс как у dict: get / [] / []= / pop / in — заменяет прежний admin_fsm = {}.
+# Важно: изменение полученного dict на месте не сохраняется — нужно присвоить его обратно.
+
+import json
+import os
+import threading
+import time
+
+FSM_SWEEP_SEC = int(os.getenv("FSM_SWEEP_SEC", "300"))
+
+# Время жизни состояния по префиксу action, секунды
+FSM_TTLS = {
+    "checkout_": 2 * 3600,     # оформление заказа
+    "user_edit_": 3600,        # правка профиля
+    "adm_": 24 * 3600,         # многошаговые формы админки
+}
+FSM_TTL_DEFAULT = 6 * 3600
+
+def state_ttl(state: dict) -> int:
+    action = (state or {}).get("action") or ""
+    for prefix, ttl in FSM_TTLS.items():
+        if action.startswith(prefix):
+            return ttl
+    return FSM_TTL_DEFAULT
+
+class FSMStore:
+    def __init__(self, connect, sweep_sec: int = FSM_SWEEP_SEC):
+        self._connect = connect
+        self._sweep_sec = sweep_sec
+        self._mem = {}            # user_id -> (state, expires_at)
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.swept = 0
+
+    # ---------- загрузка / фон ----------
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            now = time.time()
+            con = self._connect()
+            try:
+                rows = con.execute(
+                    "SELECT user_id, state, expires_at FROM fsm_states WHERE expires_at > ?", (now,)
+                ).fetchall()
+            finally:
+                con.close()
+            for r in rows:
+                try:
+                    self._mem[r[0]] = (json.loads(r[1]), r[2])
+                except ValueError:
+                    continue
+            self._loaded = True
+            if self._sweep_sec > 0:
+                threading.Thread(target=self._sweeper, name="fsm-sweep", daemon=True).start()
+
+    def _sweeper(self):
+        while True:
+            time.sleep(self._sweep_sec)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"[fsm] sweep error: {e}")
+
+    def sweep(self) -> int:
+        """Удалить все просроченные состояния (в памяти и в БД одним DELETE)."""
+        now = time.time()
+        with self._lock:
+            dead = [uid for uid, (_, exp) in self._mem.items() if exp <= now]
+            for uid in dead:
+                del self._mem[uid]
+        con = self._connect()
+        try:
+            with con:
+                n = con.execute("DELETE FROM fsm_states WHERE expires_at <= ?", (now,)).rowcount
+        finally:
+            con.close()
+        self.swept += max(n, len(dead))
+        return max(n, len(dead))
+
+    # ---------- dict-интерфейс ----------
+    def get(self, user_id: int, default=None):
+        self._ensure_loaded()
+        with self._lock:
+            ent = self._mem.get(user_id)
+            if ent is None:
+                return default
+            if ent[1] <= time.time():
+                del self._mem[user_id]
+                return default
+            return ent[0]
+
+    def __getitem__(self, user_id: int):
+        st = self.get(user_id)
+        if st is None:
+            raise KeyError(user_id)
+        return st
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
+
+    def __setitem__(self, user_id: int, state: dict):
+        self._ensure_loaded()
+        expires = time.time() + state_ttl(state)
+        payload = json.dumps(state, ensure_ascii=False)
+        with self._lock:
+            self._mem[user_id] = (state, expires)
+        # запись вне блокировки: шаги одного пользователя и так идут по очереди (lanes)
+        con = self._connect()
+        try:
+            with con:
+                con.execute("""
+                    INSERT INTO fsm_states(user_id, state, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET state=excluded.state, expires_at=excluded.expires_at
+                """, (user_id, payload, expires))
+        finally:
+            con.close()
+
+    def pop(self, user_id: int, default=None):
+        self._ensure_loaded()
+        with self._lock:
+            ent = self._mem.pop(user_id, None)
+        if ent is not None:
+            con = self._connect()
+            try:
+                with con:
+                    con.execute("DELETE FROM fsm_states WHERE user_id=?", (user_id,))
+            finally:
+                con.close()
+        if ent is None or ent[1] <= time.time():
+            return default
+        return ent[0]
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        with self._lock:
+            return len(self._mem)
@@ -0,0 +1,79 @@
+# geo_index.py
+# Поиск ближайших пунктов раздачи по координатам: равномерная сетка в градусах
+# (ячейка GEO_CELL_DEG) + обход колец ячеек вокруг точки запроса, пока K-й найденный
+# пункт не окажется ближе любой ещё не просмотренной ячейки.
+# Индекс неизменяемый: строится из снимка каталога и пересоздаётся вместе с ним.
+
+import math
+import os
+
+GEO_CELL_DEG = float(os.getenv("GEO_CELL_DEG", "0.25"))   # ~28 км по широте
+EARTH_KM = 6371.0
+_KM_PER_DEG = math.pi * EARTH_KM / 180.0
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_KM * math.asin(min(1.0, math.sqrt(a)))
+
+class GridIndex:
+    """points: [{..., "lat": float, "lon": float}] — точки без координат пропускаются."""
+
+    def __init__(self, points, cell_deg: float = GEO_CELL_DEG):
+        self.cell = cell_deg
+        self._cells = {}
+        self.size = 0
+        lo_i = lo_j = hi_i = hi_j = 0
+        for p in points:
+            lat, lon = p.get("lat"), p.get("lon")
+            if lat is None or lon is None:
+                continue
+            key = self._key(lat, lon)
+            self._cells.setdefault(key, []).append(p)
+            if not self.size:
+                lo_i, lo_j, hi_i, hi_j = key[0], key[1], key[0], key[1]
+            lo_i, hi_i = min(lo_i, key[0]), max(hi_i, key[0])
+            lo_j, hi_j = min(lo_j, key[1]), max(hi_j, key[1])
+            self.size += 1
+        self._bounds = (lo_i, lo_j, hi_i, hi_j)
+
+    def __len__(self):
+        return self.size
+
+    def _key(self, lat: float, lon: float):
+        return (math.floor(lat / self.cell), math.floor(lon / self.cell))
+
+    def _ring(self, ci: int, cj: int, r: int):
+        if r == 0:
+            yield (ci, cj)
+            return
+        for j in range(cj - r, cj + r + 1):
+            yield (ci - r, j)
+            yield (ci + r, j)
+        for i in range(ci - r + 1, ci + r):
+            yield (i, cj - r)
+            yield (i, cj + r)
+
+    def nearest(self, lat: float, lon: float, k: int = 3) -> list:
+        """[(distance_km, point)] — k ближайших по возрастанию расстояния."""
+        if not self.size or k <= 0:
+            return []
+        ci, cj = self._key(lat, lon)
+        lo_i, lo_j, hi_i, hi_j = self._bounds
+        max_r = max(abs(ci - lo_i), abs(ci - hi_i), abs(cj - lo_j), abs(cj - hi_j))
+        # 1° долготы короче 1° широты — для нижней оценки берём худшую широту в пределах индекса
+        cos_min = max(0.01, min(math.cos(math.radians(min(89.9, abs(x) * self.cell + self.cell)))
+                                for x in (lo_i, hi_i, ci)))
+        found = []
+        for r in range(max_r + 1):
+            for key in self._ring(ci, cj, r):
+                for p in self._cells.get(key, ()):
+                    found.append((haversine_km(lat, lon, p["lat"], p["lon"]), p))
+            if len(found) >= k:
+                found.sort(key=lambda x: x[0])
+                # всё, что дальше кольца r, не ближе r ячеек от точки запроса
+                if found[k - 1][0] <= r * self.cell * _KM_PER_DEG * cos_min:
+                    break
+        found.sort(key=lambda x: x[0])
+        return found[:k]
@@ -3,22 +3,93 @@
 # История заказов в личном кабинете + «Повторить заказ»
 
 import os
-import io
-import re
-import requests
+import time
 import telebot
 from telebot import types
 import Admin_bot
+import image_cache
+import image_norm
+import ingest
+import media_fetch
+import lanes
+import tenants
+from debounce import Debouncer
+from outbox import Outbox, QueuedBot
+from cart_store import CartStore, CART_SPILL
 
 # === Инициализация ===
-API_TOKEN = os.getenv("BOT_TOKEN")
+# Магазины процесса (tenants.py): без TENANTS_FILE — один, из BOT_TOKEN / DB_PATH.
+shops = tenants.load()
+API_TOKEN = shops[0].token
 if not API_TOKEN:
     raise SystemExit("BOT_TOKEN не установлен в окружении.")
 
-bot = telebot.TeleBot(API_TOKEN, parse_mode="HTML")
-
-# Инициализируем БД (создаст таблицы и применит миграции)
-Admin_bot.init_db()
+# Обработчики регистрируются на bot (бот первого магазина); боты остальных магазинов
+# используют те же списки обработчиков (см. _shop_bot).
+bot = telebot.TeleBot(API_TOKEN, parse_mode="HTML", threaded=False)
+
+# Апдейты одного пользователя — строго по порядку, разных пользователей — параллельно
+# (число полос: WORKER_LANES). Заменяет пул потоков telebot. Полосы общие для всех магазинов.
+dispatcher = lanes.OrderedLanes(lanes.WORKER_LANES, name="upd")
+
+def attach(bot_, shop: tenants.Tenant):
+    """Направить апдейты bot_ в общие полосы, в контексте магазина shop."""
+    process_updates = bot_.process_new_updates
+
+    def in_update_context(updates):
+        # все картинки одного апдейта делят общий бюджет времени (MEDIA_UPDATE_BUDGET_S);
+        # update_id доступен обработчикам через ingest.current_update_id() (идемпотентность заказов)
+        update_id = updates[0].update_id if len(updates) == 1 else None
+        t0 = time.perf_counter()
+        failed = True
+        try:
+            with media_fetch.budget(), ingest.update_context(update_id):
+                res = process_updates(updates)
+            failed = False
+            return res
+        finally:
+            shop.count((time.perf_counter() - t0) * 1000, failed)
+
+    bot_.process_new_updates = in_update_context
+    lanes.install(bot_, dispatcher)
+    queued = bot_.process_new_updates
+
+    def in_shop(updates):
+        with tenants.use(shop):
+            return queued(updates)
+
+    bot_.process_new_updates = in_shop
+    return bot_
+
+def _shop_bot():
+    shop = tenants.current()
+    if shop is shops[0]:
+        return bot
+    if not shop.token:
+        raise RuntimeError(f"у магазина {shop.name} нет токена (вызов вне tenants.use?)")
+    bot_ = telebot.TeleBot(shop.token, parse_mode="HTML", threaded=False)
+    for name, handlers in vars(bot).items():
+        if name.endswith("_handlers") and isinstance(handlers, list):
+            setattr(bot_, name, handlers)
+    return attach(bot_, shop)
+
+attach(bot, shops[0])
+bots = tenants.local(_shop_bot)     # бот текущего магазина
+
+# Ответы обработчиков — через очередь исходящих (outbox.py): обработчик возвращается,
+# не дожидаясь Telegram; порядок сообщений в чате сохраняется, answer_callback_query — вне очереди.
+# Очередь общая; отправка идёт от бота того магазина, в контексте которого поставлена.
+outbox = Outbox()
+api = QueuedBot(bots, outbox)
+
+# Инициализируем БД магазинов (создаст таблицы и применит миграции)
+for _shop in shops:
+    with tenants.use(_shop):
+        Admin_bot.init_db()
+
+# Окно склейки частых нажатий в корзине (+/−/удалить/очистить), мс
+CART_DEBOUNCE_MS = int(os.getenv("CART_DEBOUNCE_MS", "350"))
+CART_DEBOUNCE_MAX_MS = int(os.getenv("CART_DEBOUNCE_MAX_MS", "1500"))
 
 # ====== Главное меню ======
 BTN_CATALOG = "🛍 Каталог"
@@ -29,7 +100,7 @@ BTN_ADMIN = "🛠 Админ-панель"
 BTN_EXIT_ADMIN = "⬅️ Выйти из админ-панели"
 
 # Флаг “демо-админ” (кто прислал "demo admin")
-demo_admin_access = set()
+demo_admin_access = tenants.local(set)
 
 def has_demo_admin(user_id:int)->bool:
     return user_id in demo_admin_access
@@ -52,55 +123,95 @@ def fmt_price(v) -> str:
     except Exception:
         return f"{v} RSD"
 
-def safe_send_photo(chat_id: int, image_url: str, caption: str, reply_markup=None):
+def send_photo_now(chat_id: int, image_url: str, caption: str, reply_markup=None):
     """
-    Универсальная отправка фото:
+    Универсальная отправка фото (синхронно; из обработчиков — через safe_send_photo):
+    0) Если фото уже отправлялось — шлём по file_id; если URL уже разрезолвлен
+       (прогрев или прошлые отправки) — сразу по прямой ссылке.
     1) Пытаемся отправить URL напрямую (Telegram сам скачает).
     2) Если это HTML-страница (ibb.co и т.п.), вытягиваем <meta property="og:image" ...>.
     3) Затем пробуем отправить найденный прямой URL.
-    4) Если не получилось — скачиваем байты и отправляем как файл.
+    4) Если не получилось — скачиваем байты и отправляем как файл
+       (уменьшенный и пережатый, см. image_norm.py).
     5) В крайнем случае — отправляем текст.
+    Если автомат хоста картинки открыт (media_fetch/circuit.py) — текст сразу;
+    шаги 1–4 ограничены общим бюджетом времени апдейта.
     """
-    try:
-        return bot.send_photo(chat_id, image_url, caption=caption, reply_markup=reply_markup)
-    except Exception as e:
-        print(f"[safe_send_photo] direct url send failed: {e}")
-
-    headers = {
-        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome Safari"
-    }
-    try:
-        r = requests.get(image_url, timeout=20, allow_redirects=True, headers=headers)
-        r.raise_for_status()
-        ctype = r.headers.get("Content-Type", "")
-        if "text/html" in ctype.lower():
-            html = r.text
-            m = re.search(r'<meta[^>]+property=["\']og:image["\'][^>]+content=["\']([^"\']+)["\']', html, re.IGNORECASE)
-            if m:
-                direct = m.group(1)
+    if not image_url or Admin_bot.image_health.is_bad(image_url):
+        # пустой или заведомо битый URL (см. image_health.py) — сразу текст
+        return bots.send_message(chat_id, caption, reply_markup=reply_markup)
+
+    fid = image_cache.file_id(bots, image_url)
+    if fid:
+        try:
+            return bots.send_photo(chat_id, fid, caption=caption, reply_markup=reply_markup)
+        except Exception as e:
+            print(f"[safe_send_photo] cached file_id send failed: {e}")
+
+    def sent(msg):
+        image_cache.remember_message(bots, image_url, msg)
+        return msg
+
+    def as_text(why: str):
+        print(f"[safe_send_photo] fallback to text: {why}")
+        return bots.send_message(chat_id, caption, reply_markup=reply_markup)
+
+    first = image_cache.direct_url(image_url) or image_url
+    if not media_fetch.host_available(first):
+        # автомат хоста открыт (см. circuit.py) — не ждём таймаутов, сразу текст
+        return as_text(f"host {media_fetch.host_of(first)} is down")
+
+    # все шаги ниже укладываются в общий бюджет времени (MEDIA_UPDATE_BUDGET_S)
+    with media_fetch.budget():
+        try:
+            return sent(bots.send_photo(chat_id, first, caption=caption, reply_markup=reply_markup))
+        except Exception as e:
+            print(f"[safe_send_photo] direct url send failed: {e}")
+
+        try:
+            media = media_fetch.fetch(image_url)
+            if media["mime"] == "text/html":
+                direct = media_fetch.og_image(media["text"])
+                if not direct:
+                    raise media_fetch.MediaError("HTML без og:image")
+                image_cache.remember_direct(image_url, direct)
+                if not media_fetch.host_available(direct):
+                    raise media_fetch.CircuitOpen(f"host {media_fetch.host_of(direct)} is down")
                 try:
-                    return bot.send_photo(chat_id, direct, caption=caption, reply_markup=reply_markup)
+                    return sent(bots.send_photo(chat_id, direct, caption=caption, reply_markup=reply_markup))
                 except Exception as e2:
                     print(f"[safe_send_photo] og:image send failed: {e2}")
-                    rr = requests.get(direct, timeout=20, allow_redirects=True, headers=headers)
-                    rr.raise_for_status()
-                    content = rr.content
-                    if not content or len(content) < 10:
-                        raise ValueError("Empty og:image content")
-                    fileobj = io.BytesIO(content)
-                    fileobj.name = "photo.jpg"
-                    return bot.send_photo(chat_id, fileobj, caption=caption, reply_markup=reply_markup)
-
-        content = r.content
-        if not content or len(content) < 10:
-            raise ValueError("Empty content")
-        fileobj = io.BytesIO(content)
-        fileobj.name = "photo.jpg"
-        return bot.send_photo(chat_id, fileobj, caption=caption, reply_markup=reply_markup)
+                    media = media_fetch.fetch(direct)
+            if not (media["mime"] or "").startswith("image/"):
+                raise media_fetch.MediaError(f"не картинка: {media['mime'] or 'неизвестный формат'}")
+            return sent(bots.send_photo(chat_id, image_norm.upload_file(media["data"]),
+                                       caption=caption, reply_markup=reply_markup))
+
+        except Exception as e:
+            return as_text(e)
 
+def safe_send_photo(chat_id: int, image_url: str, caption: str, reply_markup=None):
+    """Отправка фото целиком в очереди чата: обработчик не ждёт скачиваний и загрузки."""
+    return outbox.submit(chat_id, send_photo_now, chat_id, image_url, caption, reply_markup)
+
+def edit_or_send(bot_, chat_id: int, message_id: int | None, text: str, reply_markup=None):
+    """Править сообщение message_id, а если нельзя — прислать новое. Выполняется в очереди чата."""
+    if message_id:
+        try:
+            bot_.edit_message_text(text, chat_id, message_id, reply_markup=reply_markup)
+            return
+        except Exception as e:
+            if "message is not modified" in str(e).lower():
+                return
+            print(f"[edit_or_send] edit_message_text failed, send new: {e}")
+    bot_.send_message(chat_id, text, reply_markup=reply_markup)
+
+def edit_markup_quiet(bot_, chat_id: int, message_id: int, reply_markup):
+    try:
+        bot_.edit_message_reply_markup(chat_id, message_id, reply_markup=reply_markup)
     except Exception as e:
-        print(f"[safe_send_photo] fallback to text: {e}")
-        return bot.send_message(chat_id, caption, reply_markup=reply_markup)
+        if "message is not modified" not in str(e).lower():
+            print(f"[edit_markup] edit_message_reply_markup error: {e}")
 
 # ====== Доступ к данным (через Admin_bot) ======
 def DB_categories():
@@ -121,18 +232,62 @@ def DB_get_post(post_id: int):
 def DB_min_delivery_sum() -> float:
     return Admin_bot.client_get_min_delivery_sum()
 
-def DB_pickup_address() -> str:
+def DB_pickup_address(user_id: int | None = None) -> str:
     try:
-        return Admin_bot.client_get_pickup_address()
+        return Admin_bot.client_get_pickup_address(get_user_location(user_id) if user_id else None)
     except Exception as e:
         print(f"[pickup address read error] {e}")
         return ""
 
-# ====== Корзины (в памяти процесса) ======
-carts = {}  # {user_id: {product_id: qty}}
+# ====== Геопозиция пользователя (для ближайших пунктов раздачи) ======
+BTN_SEND_LOCATION = "📍 Отправить геопозицию"
+BTN_NO_LOCATION = "Без геопозиции"
+USER_LOC_CACHE = int(os.getenv("USER_LOC_CACHE", "50000"))
+
+user_locations = tenants.local(dict)   # user_id -> (lat, lon) | None; промахи тоже кэшируются
+
+def get_user_location(user_id: int):
+    if user_id in user_locations:
+        return user_locations[user_id]
+    loc = Admin_bot.get_profile_location(user_id)
+    if len(user_locations) >= USER_LOC_CACHE:
+        user_locations.clear()
+    user_locations[user_id] = loc
+    return loc
+
+def set_user_location(user_id: int, lat: float, lon: float):
+    Admin_bot.set_profile_location(user_id, lat, lon)
+    user_locations[user_id] = (lat, lon)
+
+def location_request_keyboard() -> types.ReplyKeyboardMarkup:
+    kb = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True, row_width=1)
+    kb.add(types.KeyboardButton(BTN_SEND_LOCATION, request_location=True))
+    kb.add(types.KeyboardButton(BTN_NO_LOCATION))
+    return kb
+
+def send_pickup_choice(chat_id: int, location=None, show_all: bool = False):
+    """Кнопки выбора пункта раздачи: ближайшие к геопозиции или (без неё) первые 20."""
+    kb = types.InlineKeyboardMarkup(row_width=1)
+    near = [] if show_all or not location else \
+        Admin_bot.client_nearest_pickup_points(location[0], location[1])
+    if near:
+        for d, p in near:
+            kb.add(types.InlineKeyboardButton(f"{p['address']} · {d:.1f} км", callback_data=f"choose_pickup:{p['id']}"))
+        kb.add(types.InlineKeyboardButton("📋 Все пункты", callback_data="pickup:all"))
+        api.send_message(chat_id, "<b>Ближайшие пункты раздачи:</b>", reply_markup=kb)
+        return
+    for p in Admin_bot.client_list_pickup_points()[:20]:
+        kb.add(types.InlineKeyboardButton(p["address"], callback_data=f"choose_pickup:{p['id']}"))
+    api.send_message(chat_id, "<b>Выберите адрес раздачи:</b>", reply_markup=kb)
+
+# ====== Корзины (в памяти процесса, простаивающие вытесняются — см. cart_store.py) ======
+carts = tenants.local(lambda: CartStore(
+    spill_save=tenants.bound(Admin_bot.save_cart) if CART_SPILL else None,
+    spill_load=tenants.bound(Admin_bot.pop_saved_cart) if CART_SPILL else None,
+))
 
 def get_cart(user_id:int)->dict:
-    return carts.setdefault(user_id, {})
+    return carts.get(user_id)
 
 def cart_totals(cart:dict):
     total_qty,total_sum = 0,0.0
@@ -178,13 +333,31 @@ def render_cart_text(user_id: int) -> str:
         min_sum = float(DB_min_delivery_sum() or 0)
     except Exception:
         min_sum = 0.0
-    addr = DB_pickup_address()
+    addr = DB_pickup_address(user_id)
     if min_sum > 0:
         lines += [f"\nМинимальная сумма для доставки на дом: <b>{fmt_price(min_sum)}</b>"]
     if addr:
         lines += [f"Адрес(а) раздачи: <b>{addr}</b>"]
     return "\n".join(lines)
 
+# Перерисовка корзины после серии нажатий: изменения применяются сразу,
+# а сообщение правится одним edit_message_text по истечении окна тишины.
+cart_renderer = Debouncer(CART_DEBOUNCE_MS / 1000.0, CART_DEBOUNCE_MAX_MS / 1000.0, name="cart-render")
+
+def flush_cart_render(user_id: int, chat_id: int, message_id: int | None):
+    text = render_cart_text(user_id)
+    kb = build_cart_keyboard(get_cart(user_id))
+    api.run(chat_id, edit_or_send, chat_id, message_id, text, kb)
+
+def schedule_cart_render(user_id: int, call: types.CallbackQuery):
+    """Отложенная перерисовка корзины в сообщении, на котором нажали кнопку."""
+    msg = call.message
+    editable = getattr(msg, "content_type", "") == "text" and bool(msg.text)
+    mid = msg.message_id if editable else None
+    # перерисовка идёт через полосу пользователя — не гоняется с его же нажатиями
+    key = tenants.key(user_id)
+    cart_renderer.submit(key, lambda: dispatcher.submit(key, flush_cart_render, user_id, msg.chat.id, mid))
+
 def build_product_keyboard(pid: int, user_id: int) -> types.InlineKeyboardMarkup:
     p = DB_get_product(pid)
     min_qty = int((p or {}).get("min_qty", 1))
@@ -200,7 +373,7 @@ def build_product_keyboard(pid: int, user_id: int) -> types.InlineKeyboardMarkup
 @bot.message_handler(commands=["start"])
 def cmd_start(message: types.Message):
     Admin_bot.upsert_username(message.from_user.id, message.from_user.username)
-    bot.send_message(
+    api.send_message(
         message.chat.id,
         "Привет! Это демо-бот. Напишите <code>demo admin</code>, чтобы открыть админ-панель.",
         reply_markup=build_main_menu(message.from_user.id)
@@ -211,19 +384,19 @@ def cmd_admin(message: types.Message):
     """Открыть админ-панель командой, даже если в меню сейчас только «Выйти из админ-панели»."""
     uid, cid = message.from_user.id, message.chat.id
     if not has_demo_admin(uid):
-        bot.send_message(cid, "⛔ Доступ появится после сообщения: demo admin")
+        api.send_message(cid, "⛔ Доступ появится после сообщения: demo admin")
         return
     kb = Admin_bot.admin_menu_markup()
-    bot.send_message(cid, "<b>🛠 Админ-панель</b>", reply_markup=kb)
+    api.send_message(cid, "<b>🛠 Админ-панель</b>", reply_markup=kb)
 
 # Демо-включение админки
 @bot.message_handler(func=lambda m: isinstance(m.text,str) and m.text.strip().lower()=="demo admin")
 def enable_demo_admin(message: types.Message):
     demo_admin_access.add(message.from_user.id)
-    bot.send_message(message.chat.id, "✅ Режим демо-администратора активирован", reply_markup=build_main_menu(message.from_user.id))
+    api.send_message(message.chat.id, "✅ Режим демо-администратора активирован", reply_markup=build_main_menu(message.from_user.id))
     # сразу откроем админ-меню для удобства
     kb = Admin_bot.admin_menu_markup()
-    bot.send_message(message.chat.id, "<b>🛠 Админ-панель</b>", reply_markup=kb)
+    api.send_message(message.chat.id, "<b>🛠 Админ-панель</b>", reply_markup=kb)
 
 # Главные кнопки
 @bot.message_handler(func=lambda m: m.text in {BTN_CATALOG, BTN_NEWS, BTN_CART, BTN_PROFILE, BTN_ADMIN, BTN_EXIT_ADMIN})
@@ -233,17 +406,17 @@ def main_buttons(message: types.Message):
 
     if txt == BTN_ADMIN:
         if not has_demo_admin(uid):
-            bot.send_message(cid, "⛔ Доступ появится после сообщения: demo admin")
+            api.send_message(cid, "⛔ Доступ появится после сообщения: demo admin")
             return
         kb = Admin_bot.admin_menu_markup()
-        bot.send_message(cid, "<b>🛠 Админ-панель</b>", reply_markup=kb)
-        bot.send_message(cid, "Режим админ-панели активен.", reply_markup=build_main_menu(uid))
+        api.send_message(cid, "<b>🛠 Админ-панель</b>", reply_markup=kb)
+        api.send_message(cid, "Режим админ-панели активен.", reply_markup=build_main_menu(uid))
         return
 
     if txt == BTN_EXIT_ADMIN:
         if uid in demo_admin_access:
             demo_admin_access.remove(uid)
-        bot.send_message(cid, "Вы вышли из админ-панели.", reply_markup=build_main_menu(uid))
+        api.send_message(cid, "Вы вышли из админ-панели.", reply_markup=build_main_menu(uid))
         return
 
     if txt == BTN_PROFILE:
@@ -252,7 +425,7 @@ def main_buttons(message: types.Message):
         kb = types.InlineKeyboardMarkup()
         kb.add(types.InlineKeyboardButton("✏️ Телефон", callback_data="profile:phone"))
         kb.add(types.InlineKeyboardButton("✏️ Адрес доставки", callback_data="profile:addr"))
-        bot.send_message(
+        api.send_message(
             cid,
             f"<b>👤 Личный кабинет</b>\n"
             f"Username: @{(prof.get('username') or '')}\n"
@@ -263,7 +436,7 @@ def main_buttons(message: types.Message):
         # История заказов
         orders = Admin_bot.list_orders_by_user(uid, limit=10)
         if not orders:
-            bot.send_message(cid, "📦 История заказов: пока пусто.")
+            api.send_message(cid, "📦 История заказов: пока пусто.")
         else:
             lines = ["<b>📦 История заказов (последние 10):</b>", ""]
             kb2 = types.InlineKeyboardMarkup(row_width=2)
@@ -274,40 +447,47 @@ def main_buttons(message: types.Message):
                     types.InlineKeyboardButton(f"ℹ️ #{o['id']}", callback_data=f"order:view:{o['id']}"),
                     types.InlineKeyboardButton(f"🧺 Повторить #{o['id']}", callback_data=f"order:readd:{o['id']}")
                 )
-            bot.send_message(cid, "\n".join(lines), reply_markup=kb2)
+            api.send_message(cid, "\n".join(lines), reply_markup=kb2)
         return
 
     if txt == BTN_CATALOG:
         cats = DB_categories()
         if not cats:
-            bot.send_message(cid, "Каталог пуст. Добавьте категории в админ-панели.")
+            api.send_message(cid, "Каталог пуст. Добавьте категории в админ-панели.")
             return
         kb = types.InlineKeyboardMarkup(row_width=1)
         for c in cats:
             kb.add(types.InlineKeyboardButton(c["name"], callback_data=f"cat:{c['id']}"))
-        bot.send_message(cid, "<b>Категории:</b>", reply_markup=kb)
+        api.send_message(cid, "<b>Категории:</b>", reply_markup=kb)
         return
 
     if txt == BTN_NEWS:
-        posts = DB_posts()
+        posts, has_more = Admin_bot.client_feed_page()
         if not posts:
-            bot.send_message(cid, "Пока нет публикаций.")
+            api.send_message(cid, "Пока нет публикаций.")
             return
-        # Список с картинкой и кнопкой «Читать»
-        for p in posts[:10]:
-            when = p.get('publish_at') or p.get('created_at') or ''
-            cap = f"<b>[{p['type']}] {p['title']}</b>\nДата: {when}"
-            kb = types.InlineKeyboardMarkup()
-            kb.add(types.InlineKeyboardButton("Читать", callback_data=f"post:{p['id']}"))
-            safe_send_photo(cid, p["image"], caption=cap, reply_markup=kb)
+        send_feed_page(cid, posts, has_more)
         return
 
     if txt == BTN_CART:
         text = render_cart_text(uid)
         kb = build_cart_keyboard(get_cart(uid))
-        bot.send_message(cid, text, reply_markup=kb)
+        api.send_message(cid, text, reply_markup=kb)
         return
 
+def send_feed_page(chat_id: int, posts: list, has_more: bool):
+    """Карточки публикаций с кнопкой «Читать»; в конце — «Более ранние», если есть ещё."""
+    for p in posts:
+        when = p.get('publish_at') or p.get('created_at') or ''
+        cap = f"<b>[{p['type']}] {p['title']}</b>\nДата: {when}"
+        kb = types.InlineKeyboardMarkup()
+        kb.add(types.InlineKeyboardButton("Читать", callback_data=f"post:{p['id']}"))
+        safe_send_photo(chat_id, p["image"], caption=cap, reply_markup=kb)
+    if has_more and posts:
+        kb = types.InlineKeyboardMarkup()
+        kb.add(types.InlineKeyboardButton("⬇️ Более ранние публикации", callback_data=f"news:older:{posts[-1]['id']}"))
+        api.send_message(chat_id, "Показаны не все публикации.", reply_markup=kb)
+
 # ====== CALLBACKS ======
 
 @bot.callback_query_handler(func=lambda c: True)
@@ -319,7 +499,7 @@ def all_callbacks(call: types.CallbackQuery):
     """
     try:
         # 1) Админка
-        if Admin_bot.handle_callback(bot, call, DB_get_product):
+        if Admin_bot.handle_callback(api, call, DB_get_product):
             return
 
         # 2) Пользовательские
@@ -333,26 +513,21 @@ def all_callbacks(call: types.CallbackQuery):
             cat_id = int(cat_id)
             prods = DB_products(cat_id)
             if not prods:
-                bot.answer_callback_query(call.id)
-                bot.send_message(cid, "В этой категории пока нет товаров.")
+                api.answer_callback_query(call.id)
+                api.send_message(cid, "В этой категории пока нет товаров.")
                 return
             kb = types.InlineKeyboardMarkup(row_width=1)
             for p in prods:
                 kb.add(types.InlineKeyboardButton(f"{p['name']} — {fmt_price(p['price'])}", callback_data=f"prod:{p['id']}"))
-            try:
-                if getattr(call.message, "content_type", "") == "text" and call.message.text:
-                    bot.edit_message_text("<b>Товары:</b>", cid, call.message.message_id, reply_markup=kb)
-                else:
-                    bot.send_message(cid, "<b>Товары:</b>", reply_markup=kb)
-            except Exception:
-                bot.send_message(cid, "<b>Товары:</b>", reply_markup=kb)
-            bot.answer_callback_query(call.id); return
+            editable = getattr(call.message, "content_type", "") == "text" and call.message.text
+            api.run(cid, edit_or_send, cid, call.message.message_id if editable else None, "<b>Товары:</b>", kb)
+            api.answer_callback_query(call.id); return
 
         if data.startswith("prod:"):
             pid = int(data.split(":")[1])
             p = DB_get_product(pid)
             if not p:
-                bot.answer_callback_query(call.id, "Товар не найден"); return
+                api.answer_callback_query(call.id, "Товар не найден"); return
             caption = (
                 f"<b>{p['name']}</b>\n\n"
                 f"{p['description']}\n\n"
@@ -361,28 +536,21 @@ def all_callbacks(call: types.CallbackQuery):
             )
             kb = build_product_keyboard(pid, uid)
             safe_send_photo(cid, p["image"], caption=caption, reply_markup=kb)
-            bot.answer_callback_query(call.id); return
+            api.answer_callback_query(call.id); return
 
         # --- Корзина (просмотр/редактирование/оформление) ---
         if data == "cart:open":
             text = render_cart_text(uid)
             kb = build_cart_keyboard(get_cart(uid))
-            if getattr(call.message, "content_type", "") == "text" and call.message.text:
-                try:
-                    bot.edit_message_text(text, cid, call.message.message_id, reply_markup=kb)
-                except Exception as e:
-                    print(f"[cart:open] edit_message_text failed, send new: {e}")
-                    bot.send_message(cid, text, reply_markup=kb)
-            else:
-                bot.send_message(cid, text, reply_markup=kb)
-            bot.answer_callback_query(call.id); return
+            editable = getattr(call.message, "content_type", "") == "text" and call.message.text
+            api.run(cid, edit_or_send, cid, call.message.message_id if editable else None, text, kb)
+            api.answer_callback_query(call.id); return
 
         if data == "cart:clear":
-            carts[uid] = {}
-            text = render_cart_text(uid)
-            kb = build_cart_keyboard(get_cart(uid))
-            bot.send_message(cid, text, reply_markup=kb)
-            bot.answer_callback_query(call.id, "Корзина очищена"); return
+            carts.reset(uid)
+            api.answer_callback_query(call.id, "Корзина очищена")
+            schedule_cart_render(uid, call)
+            return
 
         if data.startswith("inc:") or data.startswith("dec:"):
             pid = int(data.split(":")[1])
@@ -390,42 +558,36 @@ def all_callbacks(call: types.CallbackQuery):
             if pid in cart:
                 cart[pid] += 1 if data.startswith("inc:") else -1
                 if cart[pid] <= 0: del cart[pid]
-            text = render_cart_text(uid)
-            kb = build_cart_keyboard(cart)
-            bot.send_message(cid, text, reply_markup=kb)
-            bot.answer_callback_query(call.id); return
+            api.answer_callback_query(call.id)
+            schedule_cart_render(uid, call)
+            return
 
         if data.startswith("del:"):
             pid = int(data.split(":")[1])
             cart = get_cart(uid)
             if pid in cart: del cart[pid]
-            text = render_cart_text(uid)
-            kb = build_cart_keyboard(cart)
-            bot.send_message(cid, text, reply_markup=kb)
-            bot.answer_callback_query(call.id, "Товар удалён"); return
+            api.answer_callback_query(call.id, "Товар удалён")
+            schedule_cart_render(uid, call)
+            return
 
         if data.startswith("add:"):
             pid = int(data.split(":")[1])
             p = DB_get_product(pid)
             if not p:
-                bot.answer_callback_query(call.id, "Товар не найден"); return
+                api.answer_callback_query(call.id, "Товар не найден"); return
             cart = get_cart(uid)
             add_qty = int(p.get("min_qty", 1))
             cart[pid] = cart.get(pid, 0) + add_qty
             new_kb = build_product_keyboard(pid, uid)
-            try:
-                bot.edit_message_reply_markup(cid, call.message.message_id, reply_markup=new_kb)
-            except Exception as e:
-                if "message is not modified" not in str(e).lower():
-                    print(f"[add] edit_message_reply_markup error: {e}")
-            bot.answer_callback_query(call.id, f"Добавлено: {p['name']} × {add_qty}")
+            api.run(cid, edit_markup_quiet, cid, call.message.message_id, new_kb)
+            api.answer_callback_query(call.id, f"Добавлено: {p['name']} × {add_qty}")
             return
 
         if data == "checkout:start":
             cart = get_cart(uid)
             tqty, tsum = cart_totals(cart)
             if tqty == 0:
-                bot.answer_callback_query(call.id, "Корзина пуста"); return
+                api.answer_callback_query(call.id, "Корзина пуста"); return
 
             # Порог для доставки на дом
             try:
@@ -436,25 +598,30 @@ def all_callbacks(call: types.CallbackQuery):
 
             # ВСЕГДА сначала телефон (и заменить в профиле)
             Admin_bot.admin_fsm[uid] = {"action": "checkout_phone", "need_home": need_home}
-            bot.answer_callback_query(call.id)
-            bot.send_message(cid, "Введите номер телефона (будет сохранён в вашем профиле):")
+            api.answer_callback_query(call.id)
+            api.send_message(cid, "Введите номер телефона (будет сохранён в вашем профиле):")
+            return
+
+        if data == "pickup:all":
+            api.answer_callback_query(call.id)
+            send_pickup_choice(cid, show_all=True)
             return
 
         if data.startswith("choose_pickup:"):
             pid = int(data.split(":")[1])
-            points = {p["id"]: p for p in Admin_bot.list_pickup_points()}
-            addr_txt = points.get(pid, {}).get("address", "")
+            addr_txt = (Admin_bot.client_get_pickup_point(pid) or {}).get("address", "")
 
             cart = get_cart(uid)
             tqty, tsum = cart_totals(cart)
             if tqty == 0:
-                bot.answer_callback_query(call.id, "Корзина пуста"); return
+                api.answer_callback_query(call.id, "Корзина пуста"); return
 
-            order_id = Admin_bot.record_order(uid, cart, DB_get_product, call.message.chat.id)
-            carts[uid] = {}
+            order_id = Admin_bot.record_order(uid, cart, DB_get_product, call.message.chat.id,
+                                               update_id=ingest.current_update_id())
+            carts.reset(uid)
             Admin_bot.admin_fsm.pop(uid, None)
-            bot.answer_callback_query(call.id)
-            bot.send_message(
+            api.answer_callback_query(call.id)
+            api.send_message(
                 cid,
                 f"✅ Заказ <b>#{order_id}</b> принят.\n"
                 f"Позиции: {tqty} шт., сумма: <b>{fmt_price(tsum)}</b>.\n"
@@ -463,23 +630,33 @@ def all_callbacks(call: types.CallbackQuery):
             return
 
         # --- Новости и акции ---
+        if data.startswith("news:older:"):
+            before = int(data.split(":")[2])
+            posts, has_more = Admin_bot.client_feed_page(before)
+            api.answer_callback_query(call.id)
+            if not posts:
+                api.send_message(cid, "Более ранних публикаций нет.")
+                return
+            send_feed_page(cid, posts, has_more)
+            return
+
         if data.startswith("post:"):
             pid = int(data.split(":")[1])
             post = DB_get_post(pid)
             if not post:
-                bot.answer_callback_query(call.id, "Публикация не найдена"); return
+                api.answer_callback_query(call.id, "Публикация не найдена"); return
             cap = f"<b>{post['title']}</b>\n\n{post['text']}"
             safe_send_photo(cid, post["image"], caption=cap)
-            bot.answer_callback_query(call.id); return
+            api.answer_callback_query(call.id); return
 
         # --- История заказов: подробно + повторить ---
         if data.startswith("order:view:"):
             oid = int(data.split(":")[2])
             o = Admin_bot.get_order(oid)
             if not o or o.get("user_id") != uid:
-                bot.answer_callback_query(call.id, "Заказ не найден")
+                api.answer_callback_query(call.id, "Заказ не найден")
                 return
-            items = Admin_bot.get_order_items(oid)
+            items = o["items"]
             items_str = "\n".join([f"• {it['name']} — {it['qty']} × {fmt_price(it['price'])}" for it in items]) or "—"
             text = (
                 f"<b>Заказ #{o['id']}</b>\n"
@@ -491,19 +668,19 @@ def all_callbacks(call: types.CallbackQuery):
             kb = types.InlineKeyboardMarkup()
             kb.add(types.InlineKeyboardButton(f"🧺 Повторить #{o['id']}", callback_data=f"order:readd:{o['id']}"))
             kb.add(types.InlineKeyboardButton("🛒 Открыть корзину", callback_data="cart:open"))
-            bot.answer_callback_query(call.id)
-            bot.send_message(cid, text, reply_markup=kb)
+            api.answer_callback_query(call.id)
+            api.send_message(cid, text, reply_markup=kb)
             return
 
         if data.startswith("order:readd:"):
             oid = int(data.split(":")[2])
             o = Admin_bot.get_order(oid)
             if not o or o.get("user_id") != uid:
-                bot.answer_callback_query(call.id, "Заказ не найден")
+                api.answer_callback_query(call.id, "Заказ не найден")
                 return
-            items = Admin_bot.get_order_items(oid)
+            items = o["items"]
             if not items:
-                bot.answer_callback_query(call.id, "В заказе нет товаров")
+                api.answer_callback_query(call.id, "В заказе нет товаров")
                 return
             cart = get_cart(uid)
             for it in items:
@@ -514,30 +691,54 @@ def all_callbacks(call: types.CallbackQuery):
                 cart[pid] = cart.get(pid, 0) + qty
             text = render_cart_text(uid)
             kb = build_cart_keyboard(cart)
-            bot.answer_callback_query(call.id, f"Товары из заказа #{oid} добавлены в корзину")
-            bot.send_message(cid, text, reply_markup=kb)
+            api.answer_callback_query(call.id, f"Товары из заказа #{oid} добавлены в корзину")
+            api.send_message(cid, text, reply_markup=kb)
             return
 
         # --- Профиль (редактирование) ---
         if data == "profile:phone":
-            bot.answer_callback_query(call.id)
-            bot.send_message(cid, "Введите номер телефона (только вы его можете изменить):")
+            api.answer_callback_query(call.id)
+            api.send_message(cid, "Введите номер телефона (только вы его можете изменить):")
             Admin_bot.admin_fsm[uid] = {"action":"user_edit_phone"}
             return
 
         if data == "profile:addr":
-            bot.answer_callback_query(call.id)
-            bot.send_message(cid, "Введите адрес доставки:")
+            api.answer_callback_query(call.id)
+            api.send_message(cid, "Введите адрес доставки:")
             Admin_bot.admin_fsm[uid] = {"action":"user_edit_addr"}
             return
 
-        bot.answer_callback_query(call.id, "Ок")
+        api.answer_callback_query(call.id, "Ок")
 
     except Exception as e:
         print(f"[Callback error] {e}")
-        try: bot.answer_callback_query(call.id, "Ошибка")
+        try: api.answer_callback_query(call.id, "Ошибка")
         except Exception: pass
 
+# ====== Документы: импорт каталога в админ-панели ======
+
+@bot.message_handler(content_types=["document"])
+def on_document(message: types.Message):
+    if Admin_bot.handle_document(api, message):
+        return
+    api.send_message(message.chat.id, "Выберите раздел:", reply_markup=build_main_menu(message.from_user.id))
+
+# ====== Геопозиция: шаг выбора пункта раздачи или просто сохранение в профиль ======
+
+@bot.message_handler(content_types=["location"])
+def on_location(message: types.Message):
+    uid = message.from_user.id
+    loc = message.location
+    set_user_location(uid, loc.latitude, loc.longitude)
+    st = Admin_bot.admin_fsm.get(uid)
+    if st and st.get("action") in ("checkout_pickup_loc", "checkout_pickup"):
+        Admin_bot.admin_fsm[uid] = {"action": "checkout_pickup"}
+        api.send_message(message.chat.id, "📍 Геопозиция получена.", reply_markup=build_main_menu(uid))
+        send_pickup_choice(message.chat.id, (loc.latitude, loc.longitude))
+        return
+    api.send_message(message.chat.id, "📍 Геопозиция сохранена — в корзине покажем ближайшие пункты раздачи.",
+                     reply_markup=build_main_menu(uid))
+
 # ====== FALLBACK: текст → сначала админ-панель (FSM), затем шаги чекаута, затем профиль ======
 
 @bot.message_handler(func=lambda m: True)
@@ -545,7 +746,7 @@ def fallback(message: types.Message):
     uid = message.from_user.id
 
     # 1) Дадим шанс админ-панели обработать пошаговый ввод (категории, посты, настройки и т.д.)
-    if Admin_bot.handle_text(bot, message, DB_get_product):
+    if Admin_bot.handle_text(api, message, DB_get_product):
         return
 
     st = Admin_bot.admin_fsm.get(uid)
@@ -554,33 +755,42 @@ def fallback(message: types.Message):
     if st and st.get("action") == "checkout_phone":
         phone = (message.text or "").strip()
         if not phone:
-            bot.send_message(message.chat.id, "Номер пуст. Введите номер телефона:")
+            api.send_message(message.chat.id, "Номер пуст. Введите номер телефона:")
             return
         Admin_bot.set_profile_phone(uid, phone)
 
         need_home = bool(st.get("need_home"))
         if need_home:
             Admin_bot.admin_fsm[uid] = {"action": "checkout_addr_home"}  # следующий шаг
-            bot.send_message(message.chat.id, "Введите адрес доставки (будет сохранён в вашем профиле):")
+            api.send_message(message.chat.id, "Введите адрес доставки (будет сохранён в вашем профиле):")
             return
         else:
-            points = Admin_bot.list_pickup_points()
-            if not points:
-                bot.send_message(message.chat.id, "Пункты раздачи не настроены. Обратитесь к администратору.")
+            if not Admin_bot.client_list_pickup_points():
+                api.send_message(message.chat.id, "Пункты раздачи не настроены. Обратитесь к администратору.")
                 Admin_bot.admin_fsm.pop(uid, None)
                 return
-            kb = types.InlineKeyboardMarkup(row_width=1)
-            for p in points[:20]:
-                kb.add(types.InlineKeyboardButton(p["address"], callback_data=f"choose_pickup:{p['id']}"))
+            if Admin_bot.client_pickup_points_located():
+                # Есть пункты с координатами — предложим найти ближайшие
+                Admin_bot.admin_fsm[uid] = {"action": "checkout_pickup_loc"}
+                api.send_message(message.chat.id, "Отправьте геопозицию — покажем ближайшие пункты раздачи:",
+                                 reply_markup=location_request_keyboard())
+                return
             Admin_bot.admin_fsm[uid] = {"action": "checkout_pickup"}
-            bot.send_message(message.chat.id, "<b>Выберите адрес раздачи:</b>", reply_markup=kb)
+            send_pickup_choice(message.chat.id)
             return
 
+    # 2б) Чекаут: отказ от отправки геопозиции — сохранённая в профиле или общий список
+    if st and st.get("action") == "checkout_pickup_loc":
+        Admin_bot.admin_fsm[uid] = {"action": "checkout_pickup"}
+        api.send_message(message.chat.id, "Хорошо.", reply_markup=build_main_menu(uid))
+        send_pickup_choice(message.chat.id, get_user_location(uid))
+        return
+
     # 3) Чекаут — шаг 2 (только при доставке на дом): адрес
     if st and st.get("action") == "checkout_addr_home":
         addr_text = (message.text or "").strip()
         if not addr_text:
-            bot.send_message(message.chat.id, "Адрес пустой. Введите адрес доставки одной строкой:")
+            api.send_message(message.chat.id, "Адрес пустой. Введите адрес доставки одной строкой:")
             return
 
         Admin_bot.set_profile_address(uid, addr_text)
@@ -589,14 +799,15 @@ def fallback(message: types.Message):
         tqty, tsum = cart_totals(cart)
         if tqty == 0:
             Admin_bot.admin_fsm.pop(uid, None)
-            bot.send_message(message.chat.id, "Корзина пуста.")
+            api.send_message(message.chat.id, "Корзина пуста.")
             return
 
-        order_id = Admin_bot.record_order(uid, cart, DB_get_product, message.chat.id)
-        carts[uid] = {}
+        order_id = Admin_bot.record_order(uid, cart, DB_get_product, message.chat.id,
+                                           update_id=ingest.current_update_id())
+        carts.reset(uid)
         Admin_bot.admin_fsm.pop(uid, None)
 
-        bot.send_message(
+        api.send_message(
             message.chat.id,
             f"✅ Заказ <b>#{order_id}</b> принят.\n"
             f"Позиции: {tqty} шт., сумма: <b>{fmt_price(tsum)}</b>.\n"
@@ -608,16 +819,16 @@ def fallback(message: types.Message):
     if st and st.get("action") == "user_edit_phone":
         Admin_bot.set_profile_phone(uid, message.text.strip())
         Admin_bot.admin_fsm.pop(uid, None)
-        bot.send_message(message.chat.id, "✅ Телефон обновлён", reply_markup=build_main_menu(uid))
+        api.send_message(message.chat.id, "✅ Телефон обновлён", reply_markup=build_main_menu(uid))
         return
     if st and st.get("action") == "user_edit_addr":
         Admin_bot.set_profile_address(uid, message.text.strip())
         Admin_bot.admin_fsm.pop(uid, None)
-        bot.send_message(message.chat.id, "✅ Адрес обновлён", reply_markup=build_main_menu(uid))
+        api.send_message(message.chat.id, "✅ Адрес обновлён", reply_markup=build_main_menu(uid))
         return
 
     # 5) По умолчанию — главное меню
-    bot.send_message(message.chat.id, "Выберите раздел:", reply_markup=build_main_menu(uid))
+    api.send_message(message.chat.id, "Выберите раздел:", reply_markup=build_main_menu(uid))
 
 
 # ====== Экспорт бота для main.py ======
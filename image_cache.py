@@ -0,0 +1,64 @@
+# image_cache.py
+# Кэш картинок для отправки фото:
+#  * URL → прямая ссылка (страницы вида ibb.co отдают HTML с og:image); сам резолвинг —
+#    media_fetch.resolve / fetch_image, здесь только кэш;
+#  * file_id, который Telegram вернул после первой отправки, — повторно фото
+#    уходит по file_id без скачивания. file_id привязан к боту, поэтому ключ (token, url).
+# Оба кэша ограничены по размеру (LRU).
+
+import os
+import re
+import threading
+from collections import OrderedDict
+
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", "5000"))
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome Safari"
+}
+OG_IMAGE_RE = re.compile(r'<meta[^>]+property=["\']og:image["\'][^>]+content=["\']([^"\']+)["\']', re.IGNORECASE)
+
+class _LRU:
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._d = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            v = self._d.get(key)
+            if v is not None:
+                self._d.move_to_end(key)
+            return v
+
+    def put(self, key, value):
+        with self._lock:
+            self._d[key] = value
+            self._d.move_to_end(key)
+            while len(self._d) > self.size:
+                self._d.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._d)
+
+_resolved = _LRU(IMAGE_CACHE_SIZE)    # url -> прямой url
+_file_ids = _LRU(IMAGE_CACHE_SIZE)    # (token, url) -> file_id
+
+def direct_url(url: str) -> str | None:
+    return _resolved.get(url)
+
+def remember_direct(url: str, direct: str):
+    _resolved.put(url, direct)
+
+def file_id(bot, url: str) -> str | None:
+    return _file_ids.get((bot.token, url))
+
+def remember_message(bot, url: str, msg):
+    """Запомнить file_id самого крупного размера из отправленного сообщения с фото."""
+    photo = getattr(msg, "photo", None)
+    if url and photo:
+        _file_ids.put((bot.token, url), photo[-1].file_id)
+
+def stats() -> dict:
+    return {"resolved": len(_resolved), "file_ids": len(_file_ids)}
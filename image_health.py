@@ -0,0 +1,253 @@
+# image_health.py
+# Фоновая проверка картинок каталога и публикаций.
+# Обходит все products.image и posts.image пулом из IMAGE_HEALTH_WORKERS потоков и пишет
+# в таблицу image_health: статус, HTTP-код, задержку, Content-Type, размер и прямую
+# ссылку из og:image (её сразу получает image_cache).
+# Повторная проверка — инкрементально: хорошие раз в IMAGE_HEALTH_OK_HOURS, плохие —
+# с экспоненциальной паузой (backoff) от IMAGE_HEALTH_RETRY_MIN до IMAGE_HEALTH_MAX_BACKOFF_H.
+# URL, упавший IMAGE_HEALTH_BAD_AFTER раз подряд, считается «плохим»: safe_send_photo
+# сразу отправляет текст, не тратя таймауты.
+# Запросы идут через общие keep-alive сессии media_fetch.
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import image_cache
+import media_fetch
+
+IMAGE_HEALTH_WORKERS = int(os.getenv("IMAGE_HEALTH_WORKERS", "4"))
+IMAGE_HEALTH_INTERVAL_MIN = int(os.getenv("IMAGE_HEALTH_INTERVAL_MIN", "60"))
+IMAGE_HEALTH_OK_HOURS = float(os.getenv("IMAGE_HEALTH_OK_HOURS", "24"))
+IMAGE_HEALTH_RETRY_MIN = float(os.getenv("IMAGE_HEALTH_RETRY_MIN", "15"))
+IMAGE_HEALTH_MAX_BACKOFF_H = float(os.getenv("IMAGE_HEALTH_MAX_BACKOFF_H", "48"))
+IMAGE_HEALTH_BAD_AFTER = int(os.getenv("IMAGE_HEALTH_BAD_AFTER", "2"))
+IMAGE_HEALTH_SLOW_MS = int(os.getenv("IMAGE_HEALTH_SLOW_MS", "3000"))
+IMAGE_HEALTH_TIMEOUT = (5, 10)      # connect, read
+_HTML_LIMIT = 512 * 1024            # для поиска og:image хватает начала страницы
+_SIZE_LIMIT = 20 * 1024 * 1024      # дальше не дочитываем — размер «не меньше»
+
+class ImageHealth:
+    def __init__(self, connect, workers: int = IMAGE_HEALTH_WORKERS):
+        self._connect = connect
+        self.workers = max(1, workers)
+        self._bad = set()
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._crawl_lock = threading.Lock()
+        self.last_crawl = {}
+
+    # ---------- «плохие» URL ----------
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        con = self._connect()
+        try:
+            rows = con.execute("SELECT url FROM image_health WHERE fail_count >= ?",
+                               (IMAGE_HEALTH_BAD_AFTER,)).fetchall()
+        finally:
+            con.close()
+        with self._lock:
+            self._bad = {r[0] for r in rows}
+            self._loaded = True
+
+    def is_bad(self, url: str) -> bool:
+        if not url:
+            return False
+        try:
+            self._ensure_loaded()
+        except Exception as e:       # таблицы ещё нет / БД занята — не мешаем отправке
+            print(f"[image_health] load error: {e}")
+            return False
+        return url in self._bad
+
+    # ---------- проверка одного URL ----------
+    @staticmethod
+    def _fetch(url: str) -> dict:
+        t0 = time.perf_counter()
+        with media_fetch.session_for(url).get(url, timeout=IMAGE_HEALTH_TIMEOUT,
+                                              allow_redirects=True, stream=True) as r:
+            latency = (time.perf_counter() - t0) * 1000
+            ctype = (r.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+            res = {"http_status": r.status_code, "latency_ms": round(latency, 1), "content_type": ctype}
+            if r.status_code >= 400:
+                res["error"] = f"HTTP {r.status_code}"
+                return res
+            limit = _SIZE_LIMIT
+            body = bytearray()
+            sniffed = None
+            for chunk in r.iter_content(64 * 1024):
+                body += chunk
+                if sniffed is None and len(body) >= 16:
+                    # тип — как у отправки (media_fetch): по первым байтам, заголовок — запасной вариант
+                    sniffed = media_fetch.sniff(bytes(body[:1024])) or ctype
+                    if sniffed == "text/html":
+                        limit = _HTML_LIMIT
+                if len(body) >= limit:
+                    break
+            ctype = res["content_type"] = sniffed or media_fetch.sniff(bytes(body)) or ctype
+            res["size"] = int(r.headers.get("Content-Length") or len(body))
+            if ctype == "text/html":
+                res["html"] = body.decode(r.encoding or "utf-8", "replace")
+            return res
+
+    def check(self, url: str) -> dict:
+        """Статус URL: ok=True, если по нему (или по его og:image) отдаётся картинка."""
+        res = {"url": url, "ok": False, "resolved_url": None}
+        try:
+            res.update(self._fetch(url))
+            html = res.pop("html", None)
+            if html is not None:
+                m = image_cache.OG_IMAGE_RE.search(html)
+                if not m:
+                    res["error"] = "HTML без og:image"
+                    return res
+                res["resolved_url"] = m.group(1)
+                direct = self._fetch(res["resolved_url"])
+                direct.pop("html", None)
+                res.update({k: v for k, v in direct.items() if k != "latency_ms"})
+                res["latency_ms"] = round(res["latency_ms"] + direct["latency_ms"], 1)
+            if "error" not in res:
+                if res["content_type"].startswith("image/"):
+                    res["ok"] = True
+                else:
+                    res["error"] = f"не картинка: {res['content_type'] or '?'}"
+        except Exception as e:
+            res["error"] = f"{type(e).__name__}: {e}"[:300]
+        return res
+
+    # ---------- обход ----------
+    def due_urls(self, now: float | None = None, limit: int | None = None) -> list:
+        """URL, которые пора проверить: новые и с истёкшим next_check."""
+        now = time.time() if now is None else now
+        sql = """
+            SELECT u.url FROM (
+                SELECT TRIM(image) AS url FROM products WHERE image IS NOT NULL AND TRIM(image) <> ''
+                UNION
+                SELECT TRIM(image) FROM posts WHERE image IS NOT NULL AND TRIM(image) <> ''
+            ) u
+            LEFT JOIN image_health h ON h.url = u.url
+            WHERE h.url IS NULL OR h.next_check <= ?
+            ORDER BY h.next_check IS NOT NULL, h.next_check
+        """
+        params = [now]
+        if limit:
+            sql += " LIMIT ?"; params.append(int(limit))
+        con = self._connect()
+        try:
+            return [r[0] for r in con.execute(sql, params)]
+        finally:
+            con.close()
+
+    def _save(self, results: list):
+        now = time.time()
+        con = self._connect()
+        try:
+            prev = {}
+            urls = [r["url"] for r in results]
+            for i in range(0, len(urls), 500):
+                part = urls[i:i + 500]
+                q = f"SELECT url, fail_count FROM image_health WHERE url IN ({','.join('?' * len(part))})"
+                prev.update({u: n for u, n in con.execute(q, part)})
+            rows = []
+            for r in results:
+                fails = 0 if r["ok"] else prev.get(r["url"], 0) + 1
+                if r["ok"]:
+                    delay = IMAGE_HEALTH_OK_HOURS * 3600
+                else:
+                    delay = min(IMAGE_HEALTH_MAX_BACKOFF_H * 3600, IMAGE_HEALTH_RETRY_MIN * 60 * 2 ** (fails - 1))
+                status = "bad" if not r["ok"] else ("slow" if r.get("latency_ms", 0) > IMAGE_HEALTH_SLOW_MS else "ok")
+                rows.append((r["url"], status, r.get("http_status"), r.get("latency_ms"), r.get("content_type"),
+                             r.get("size"), r.get("resolved_url"), r.get("error"), now, fails, now + delay))
+            with con:
+                con.executemany("""
+                    INSERT INTO image_health(url, status, http_status, latency_ms, content_type, size,
+                                             resolved_url, error, checked_at, fail_count, next_check)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(url) DO UPDATE SET
+                        status=excluded.status, http_status=excluded.http_status,
+                        latency_ms=excluded.latency_ms, content_type=excluded.content_type,
+                        size=excluded.size, resolved_url=excluded.resolved_url, error=excluded.error,
+                        checked_at=excluded.checked_at, fail_count=excluded.fail_count,
+                        next_check=excluded.next_check
+                """, rows)
+        finally:
+            con.close()
+        with self._lock:
+            for r, row in zip(results, rows):
+                if row[9] >= IMAGE_HEALTH_BAD_AFTER:
+                    self._bad.add(r["url"])
+                else:
+                    self._bad.discard(r["url"])
+        for r in results:
+            if r["ok"] and r.get("resolved_url"):
+                image_cache.remember_direct(r["url"], r["resolved_url"])
+
+    def crawl(self, limit: int | None = None) -> dict:
+        """Проверить все URL, которым пора; результаты пишутся пачками по мере готовности."""
+        if not self._crawl_lock.acquire(blocking=False):
+            return {"skipped": "already running"}
+        try:
+            self._ensure_loaded()
+            t0 = time.perf_counter()
+            urls = self.due_urls(limit=limit)
+            summary = {"checked": 0, "ok": 0, "bad": 0}
+            batch = []
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="img-health") as ex:
+                for res in ex.map(self.check, urls):
+                    batch.append(res)
+                    summary["checked"] += 1
+                    summary["ok" if res["ok"] else "bad"] += 1
+                    if len(batch) >= 100:
+                        self._save(batch); batch = []
+            if batch:
+                self._save(batch)
+            summary["seconds"] = round(time.perf_counter() - t0, 1)
+            summary["at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            self.last_crawl = summary
+            if urls:
+                print(f"[image_health] {summary}")
+            return summary
+        finally:
+            self._crawl_lock.release()
+
+    def crawl_async(self) -> bool:
+        if self._crawl_lock.locked():
+            return False
+        threading.Thread(target=self.crawl, name="img-health-crawl", daemon=True).start()
+        return True
+
+    def _loop(self, interval_min: int):
+        while True:
+            try:
+                self.crawl()
+            except Exception as e:
+                print(f"[image_health] crawl error: {e}")
+            time.sleep(interval_min * 60)
+
+    def start(self, interval_min: int = IMAGE_HEALTH_INTERVAL_MIN):
+        if interval_min <= 0:
+            return None
+        th = threading.Thread(target=self._loop, args=(interval_min,), name="img-health", daemon=True)
+        th.start()
+        return th
+
+    # ---------- отчёт ----------
+    def report(self, limit: int = 20) -> dict:
+        con = self._connect()
+        try:
+            counts = {r[0]: r[1] for r in con.execute("SELECT status, COUNT(*) FROM image_health GROUP BY status")}
+            worst = [dict(zip(("url", "status", "error", "fail_count", "latency_ms", "products", "posts"), r))
+                     for r in con.execute("""
+                SELECT h.url, h.status, h.error, h.fail_count, h.latency_ms,
+                       (SELECT GROUP_CONCAT(id) FROM products WHERE TRIM(image) = h.url),
+                       (SELECT GROUP_CONCAT(id) FROM posts WHERE TRIM(image) = h.url)
+                FROM image_health h
+                WHERE h.status <> 'ok'
+                ORDER BY h.status = 'bad' DESC, h.fail_count DESC, h.latency_ms DESC
+                LIMIT ?
+            """, (limit,))]
+        finally:
+            con.close()
+        return {"counts": counts, "worst": worst, "last_crawl": dict(self.last_crawl)}
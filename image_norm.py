@@ -0,0 +1,181 @@
+# image_norm.py
+# Нормализация картинок перед загрузкой байтами в Telegram.
+# Хостинги иногда отдают PNG по 5–10 МБ: долго качать, долго заливать, Telegram может
+# отказать. Перед send_photo картинка уменьшается до IMAGE_MAX_SIDE по длинной стороне
+# и перекодируется в JPEG (или WebP) с качеством IMAGE_QUALITY.
+#  * CPU-работа — в пуле процессов (IMAGE_NORM_PROCS), потоки обработчиков только ждут;
+#  * результат кэшируется по sha256 исходных байтов (LRU, до IMAGE_NORM_CACHE_MB);
+#  * небольшие картинки, которые и так в пределах размера, уходят как есть;
+#  * без Pillow или при любой ошибке — отправляются исходные байты.
+
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:      # Pillow — опционально
+    Image = ImageOps = None
+
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1280"))      # Telegram показывает фото не крупнее
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "jpeg").lower()        # jpeg | webp
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "82"))
+IMAGE_NORM_MIN_BYTES = int(os.getenv("IMAGE_NORM_MIN_BYTES", str(200 * 1024)))
+IMAGE_NORM_PROCS = int(os.getenv("IMAGE_NORM_PROCS", "2"))
+IMAGE_NORM_TIMEOUT = float(os.getenv("IMAGE_NORM_TIMEOUT", "20"))
+IMAGE_NORM_CACHE_MB = int(os.getenv("IMAGE_NORM_CACHE_MB", "64"))
+
+_EXT = {"jpeg": "jpg", "webp": "webp"}
+
+# ============================ Рабочий процесс ============================
+
+def _transcode(data: bytes, max_side: int, fmt: str, quality: int) -> bytes | None:
+    """Уменьшить и перекодировать; None — оставить исходные байты."""
+    img = Image.open(io.BytesIO(data))
+    if getattr(img, "is_animated", False):
+        return None                      # анимацию не трогаем
+    w, h = img.size
+    if max(w, h) <= max_side and len(data) <= IMAGE_NORM_MIN_BYTES:
+        return None
+    # JPEG декодируется сразу в уменьшенном масштабе (1/2, 1/4, 1/8) — в разы быстрее
+    img.draft("RGB", (max_side, max_side))
+    img = ImageOps.exif_transpose(img)
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        bg = Image.new("RGB", img.size, (255, 255, 255))
+        bg.paste(img, mask=img.getchannel("A"))
+        img = bg
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+    out = io.BytesIO()
+    if fmt == "webp":
+        img.save(out, "WEBP", quality=quality, method=4)
+    else:
+        img.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+    res = out.getvalue()
+    if len(res) >= len(data) and max(w, h) <= max_side:
+        return None                      # перекодирование не помогло
+    return res
+
+# ============================ Пул и кэш ============================
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: процесс бота многопоточный, fork из него небезопасен.
+            # Дочерний процесс заново импортирует __main__ — у main.py на уровне
+            # модуля нет импортов бота, так что воркер не создаёт ботов и не трогает БД.
+            _pool = ProcessPoolExecutor(max_workers=max(1, IMAGE_NORM_PROCS),
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+class _BytesLRU:
+    """LRU, ограниченный суммарным размером значений."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._d = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            v = self._d.get(key)
+            if v is not None:
+                self._d.move_to_end(key)
+            return v
+
+    def put(self, key, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._d.pop(key, None)
+            if old is not None:
+                self.used -= len(old)
+            self._d[key] = value
+            self.used += len(value)
+            while self.used > self.max_bytes:
+                _, v = self._d.popitem(last=False)
+                self.used -= len(v)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._d)
+
+_cache = _BytesLRU(IMAGE_NORM_CACHE_MB * 1024 * 1024)
+_KEEP = b""                              # в кэше: «оставить исходные байты»
+_stats = {"calls": 0, "cache_hits": 0, "converted": 0, "kept": 0, "errors": 0,
+          "bytes_in": 0, "bytes_out": 0, "ms": 0.0}
+_stats_lock = threading.Lock()
+
+def _count(**kw):
+    with _stats_lock:
+        for k, v in kw.items():
+            _stats[k] += v
+
+def available() -> bool:
+    return Image is not None and IMAGE_NORM_PROCS > 0
+
+def normalize(data: bytes) -> bytes:
+    """Байты для загрузки: уменьшенная перекодированная картинка или исходные data."""
+    if not data or not available():
+        return data
+    key = hashlib.sha256(data).digest()
+    cached = _cache.get(key)
+    if cached is not None:
+        _count(calls=1, cache_hits=1, bytes_in=len(data), bytes_out=len(cached or data))
+        return cached or data
+    t0 = time.perf_counter()
+    try:
+        res = _get_pool().submit(_transcode, data, IMAGE_MAX_SIDE, IMAGE_FORMAT, IMAGE_QUALITY) \
+                         .result(timeout=IMAGE_NORM_TIMEOUT)
+    except BrokenProcessPool as e:
+        print(f"[image_norm] pool broken, restarting: {e}")
+        _reset_pool()
+        _count(calls=1, errors=1)
+        return data
+    except Exception as e:               # не картинка, битый файл, таймаут — шлём как есть
+        print(f"[image_norm] {type(e).__name__}: {e}")
+        _count(calls=1, errors=1)
+        return data
+    ms = (time.perf_counter() - t0) * 1000
+    _cache.put(key, res or _KEEP)
+    if res:
+        _count(calls=1, converted=1, bytes_in=len(data), bytes_out=len(res), ms=ms)
+        return res
+    _count(calls=1, kept=1, bytes_in=len(data), bytes_out=len(data), ms=ms)
+    return data
+
+def upload_file(data: bytes) -> io.BytesIO:
+    """Файловый объект для bot.send_photo с нормализованными байтами."""
+    out = normalize(data)
+    f = io.BytesIO(out)
+    f.name = f"photo.{_EXT.get(IMAGE_FORMAT, 'jpg')}" if out is not data else "photo.jpg"
+    return f
+
+def stats() -> dict:
+    with _stats_lock:
+        s = dict(_stats)
+    s["ms"] = round(s["ms"], 1)
+    s["cached"] = len(_cache)
+    s["cache_mb"] = round(_cache.used / (1 << 20), 1)
+    s["enabled"] = available()
+    return s
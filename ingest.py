@@ -0,0 +1,192 @@
+# ingest.py
+# Приём апдейтов long polling'ом с сохранением смещения в БД (вместо bot.polling).
+# Цикл конвейерный: getUpdates(offset = последний закоммиченный + 1) → новые апдейты уходят
+# в полосы обработки (по пользователю — по порядку, разные — параллельно), и, не дожидаясь
+# их, следующий getUpdates. Медленный апдейт одного пользователя не задерживает приём
+# остальных.
+# Смещение в update_offsets — наибольший update_id, до которого все апдейты обработаны
+# и их ответы отправлены (outbox.flush). Апдейт, не успевший за INGEST_BATCH_TIMEOUT,
+# считается зависшим: о нём пишется в лог, и смещение дальше него пока не двигается.
+# Зависший дольше INGEST_ABANDON_SEC считается упавшим: он убирается из работы, и смещение
+# идёт дальше — иначе один повисший обработчик за INGEST_BATCH апдейтов остановил бы приём
+# для всех. Апдейт, упавший с исключением, тоже считается обработанным (иначе он
+# повторялся бы вечно).
+# Telegram считает апдейты доставленными только после запроса с большим offset, поэтому
+# незакоммиченные апдейты приходят снова: уже взятые в работу пропускаются по update_id.
+# После падения процесса они приходят повторно и обрабатываются заново. От повтора
+# защищены только заказы (Admin_bot.record_order привязан к update_id, текущий update_id
+# обработчик получает через current_update_id()); нажатия корзины add:/inc:/dec:
+# применяются ещё раз, ответы отправляются повторно.
+
+import contextvars
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import contextmanager
+
+INGEST_BATCH = int(os.getenv("INGEST_BATCH", "100"))            # максимум Bot API
+INGEST_POLL_TIMEOUT = int(os.getenv("INGEST_POLL_TIMEOUT", "20"))
+INGEST_BATCH_TIMEOUT = float(os.getenv("INGEST_BATCH_TIMEOUT", "120"))
+INGEST_ABANDON_SEC = float(os.getenv("INGEST_ABANDON_SEC", "600"))
+INGEST_NAME = os.getenv("INGEST_NAME", "main")
+# Пауза перед повторным getUpdates, пока в работе есть апдейты: Telegram возвращает их снова
+# сразу, без long polling'а. Столько же максимум ждёт новый апдейт, пока обрабатываются старые.
+INGEST_REFETCH_SEC = float(os.getenv("INGEST_REFETCH_SEC", "0.2"))
+
+_current = contextvars.ContextVar("update_id", default=None)
+
+@contextmanager
+def update_context(update_id: int):
+    token = _current.set(update_id)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+def current_update_id() -> int | None:
+    """update_id обрабатываемого апдейта (None — вне обработки апдейта)."""
+    return _current.get()
+
+class OffsetStore:
+    """Последний полностью обработанный update_id в таблице update_offsets."""
+
+    def __init__(self, connect, name: str = INGEST_NAME):
+        self._connect = connect
+        self.name = name
+
+    def load(self) -> int | None:
+        con = self._connect()
+        try:
+            r = con.execute("SELECT update_id FROM update_offsets WHERE name=?", (self.name,)).fetchone()
+        finally:
+            con.close()
+        return r[0] if r else None
+
+    def commit(self, update_id: int):
+        con = self._connect()
+        try:
+            with con:
+                con.execute("""
+                    INSERT INTO update_offsets(name, update_id, updated_at) VALUES (?, ?, ?)
+                    ON CONFLICT(name) DO UPDATE SET update_id=excluded.update_id, updated_at=excluded.updated_at
+                    WHERE excluded.update_id > update_offsets.update_id
+                """, (self.name, int(update_id), time.time()))
+        finally:
+            con.close()
+
+_stats = {"batches": 0, "updates": 0, "max_batch": 0, "errors": 0, "redelivered": 0,
+          "stuck": 0, "abandoned": 0, "inflight": 0, "last_update_id": None}
+
+def stats() -> dict:
+    return dict(_stats)
+
+class Inflight:
+    """Апдейты, взятые в работу и ещё не закоммиченные: update_id → Future."""
+
+    def __init__(self, timeout: float = INGEST_BATCH_TIMEOUT, abandon: float = INGEST_ABANDON_SEC):
+        self.timeout = timeout
+        self.abandon = max(abandon, timeout)
+        self._futures = {}
+        self._started = {}
+        self._stuck = set()
+
+    def __len__(self):
+        return len(self._futures)
+
+    def submit(self, bot, updates: list) -> int:
+        """Отдать в обработку апдейты, которых ещё нет в работе; вернуть их число."""
+        fresh = [u for u in updates if u.update_id not in self._futures]
+        _stats["redelivered"] += len(updates) - len(fresh)
+        if not fresh:
+            return 0
+        futures = bot.process_new_updates(fresh) or ()
+        now = time.monotonic()
+        for u, f in zip(fresh, futures):
+            self._futures[u.update_id] = f
+            self._started[u.update_id] = now
+        return len(fresh)
+
+    def wait(self, timeout: float):
+        """Дождаться завершения хотя бы одного апдейта (не дольше timeout)."""
+        pending = [f for f in self._futures.values() if not f.done()]
+        if pending:
+            wait(pending, timeout, return_when=FIRST_COMPLETED)
+
+    def finished_upto(self) -> int | None:
+        """
+        Наибольший update_id, до которого (включительно) все апдейты завершились;
+        зависшие дольше abandon считаются завершёнными (release() засчитает их упавшими).
+        """
+        upto = None
+        now = time.monotonic()
+        for uid in sorted(self._futures):
+            if not self._futures[uid].done():
+                if now - self._started[uid] > self.abandon:
+                    upto = uid
+                    continue
+                if now - self._started[uid] > self.timeout and uid not in self._stuck:
+                    self._stuck.add(uid)
+                    _stats["stuck"] += 1
+                    print(f"[ingest] update {uid} still running after {self.timeout:.0f}s; "
+                          f"offset held at {upto}")
+                break
+            upto = uid
+        return upto
+
+    def release(self, upto: int) -> int:
+        """Убрать завершённые апдейты до upto включительно; вернуть число упавших."""
+        failed = 0
+        for uid in [u for u in self._futures if u <= upto]:
+            f = self._futures.pop(uid)
+            started = self._started.pop(uid)
+            self._stuck.discard(uid)
+            if not f.done():
+                failed += 1
+                _stats["abandoned"] += 1
+                print(f"[ingest] update {uid} abandoned after {time.monotonic() - started:.0f}s; "
+                      f"offset moves past it")
+                continue
+            e = f.exception()
+            if e is not None:
+                failed += 1
+                print(f"[ingest] update {uid} failed: {type(e).__name__}: {e}")
+        return failed
+
+def poll(bot, offsets: OffsetStore, flush=None, batch: int = INGEST_BATCH,
+         poll_timeout: int = INGEST_POLL_TIMEOUT):
+    """Бесконечный цикл приёма апдейтов (замена bot.polling)."""
+    last = offsets.load()
+    print(f"[ingest] start from update_id {last + 1 if last is not None else '(new)'}")
+    inflight = Inflight(INGEST_BATCH_TIMEOUT, INGEST_ABANDON_SEC)
+    backoff = 1.0
+    while True:
+        upto = inflight.finished_upto()
+        if upto is not None:
+            if flush is not None:
+                flush(inflight.timeout)
+            failed = inflight.release(upto)
+            offsets.commit(upto)
+            last = upto
+            _stats["errors"] += failed
+            _stats["last_update_id"] = last
+        _stats["inflight"] = len(inflight)
+        if len(inflight) >= batch:
+            # Telegram отдаёт не больше batch апдейтов от offset — новых всё равно не будет
+            inflight.wait(poll_timeout)
+            continue
+        try:
+            updates = bot.get_updates(offset=None if last is None else last + 1, limit=batch,
+                                      timeout=poll_timeout, long_polling_timeout=poll_timeout)
+            backoff = 1.0
+        except Exception as e:
+            print(f"[ingest] getUpdates error: {e}; retry in {backoff:.0f}s")
+            time.sleep(backoff)
+            backoff = min(60.0, backoff * 2)
+            continue
+        n = inflight.submit(bot, updates or [])
+        if n:
+            _stats["batches"] += 1
+            _stats["updates"] += n
+            _stats["max_batch"] = max(_stats["max_batch"], n)
+        if len(inflight):
+            inflight.wait(INGEST_REFETCH_SEC)
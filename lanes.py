@@ -0,0 +1,138 @@
+# lanes.py
+# Упорядоченные «полосы» обработки: задачи с одним ключом (user_id) выполняются строго
+# по очереди в одном потоке, задачи разных ключей — параллельно в разных полосах.
+# Заменяет пул потоков telebot, в котором апдейты одного пользователя могли гоняться
+# друг с другом (корзина, FSM).
+# Задача выполняется в контексте (contextvars) того, кто её поставил: магазин, бюджеты.
+
+import contextvars
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, wait
+
+import tenants
+
+WORKER_LANES = int(os.getenv("WORKER_LANES", "16"))
+
+def _noop():
+    return None
+
+class OrderedLanes:
+    def __init__(self, n: int = WORKER_LANES, name: str = "lane"):
+        self.n = max(1, int(n))
+        self._queues = [queue.SimpleQueue() for _ in range(self.n)]
+        self._backlog = [0] * self.n      # поставлено, но не завершено
+        self._done = [0] * self.n
+        self._errors = 0
+        self._lock = threading.Condition()
+        self._threads = []
+        for i in range(self.n):
+            t = threading.Thread(target=self._worker, args=(i,), name=f"{name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def lane_of(self, key) -> int:
+        return hash(key) % self.n
+
+    def submit(self, key, fn, *args, **kwargs) -> Future:
+        fut = Future()
+        i = self.lane_of(key)
+        with self._lock:
+            self._backlog[i] += 1
+        ctx = contextvars.copy_context()
+        self._queues[i].put((fut, ctx.run, (fn,) + args, kwargs, time.monotonic()))
+        return fut
+
+    def _worker(self, i: int):
+        q = self._queues[i]
+        while True:
+            fut, fn, args, kwargs, _ = q.get()
+            if fut.set_running_or_notify_cancel():
+                try:
+                    fut.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    with self._lock:
+                        self._errors += 1
+                    print(f"[lanes] task error in lane {i}: {e}")
+                    fut.set_exception(e)
+            with self._lock:
+                self._backlog[i] -= 1
+                self._done[i] += 1
+                self._lock.notify_all()
+
+    # ---------- наблюдаемость ----------
+    def backlog(self) -> list:
+        with self._lock:
+            return list(self._backlog)
+
+    def stats(self) -> dict:
+        with self._lock:
+            bl = list(self._backlog)
+            return {
+                "lanes": self.n,
+                "backlog_total": sum(bl),
+                "backlog_max": max(bl),
+                "busy_lanes": sum(1 for x in bl if x),
+                "done": sum(self._done),
+                "errors": self._errors,
+            }
+
+    def barrier(self, timeout: float = 30.0) -> bool:
+        """
+        Дождаться выполнения всего, что уже поставлено во все полосы. В отличие от
+        wait_idle не ждёт задач, поставленных после вызова, — годится под нагрузкой.
+        """
+        marks = []
+        for i in range(self.n):
+            fut = Future()
+            with self._lock:
+                self._backlog[i] += 1
+            self._queues[i].put((fut, _noop, (), {}, time.monotonic()))
+            marks.append(fut)
+        done, not_done = wait(marks, timeout)
+        return not not_done
+
+    def wait_idle(self, timeout: float = 30.0) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while any(self._backlog):
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._lock.wait(left)
+        return True
+
+# ============================ Привязка к telebot ============================
+
+def update_key(update) -> int:
+    """Ключ упорядочивания апдейта: id пользователя, иначе чата, иначе update_id."""
+    for attr in ("message", "edited_message", "callback_query", "inline_query",
+                 "chosen_inline_result", "shipping_query", "pre_checkout_query",
+                 "my_chat_member", "chat_member", "chat_join_request"):
+        obj = getattr(update, attr, None)
+        if obj is None:
+            continue
+        user = getattr(obj, "from_user", None)
+        if user is not None:
+            return user.id
+        chat = getattr(obj, "chat", None)
+        if chat is not None:
+            return chat.id
+    return update.update_id
+
+def install(bot, lanes: OrderedLanes):
+    """
+    Направляет bot.process_new_updates в полосы: каждый апдейт обрабатывается
+    синхронным telebot-обработчиком в полосе своего пользователя.
+    Возвращает список Future (по одному на апдейт) — удобно для бенчмарков.
+    """
+    bot.threaded = False
+    orig = bot.process_new_updates
+
+    def process_new_updates(updates):
+        return [lanes.submit(tenants.key(update_key(u)), orig, [u]) for u in updates]
+
+    bot.process_new_updates = process_new_updates
+    return bot
@@ -1,33 +1,98 @@
 # main.py — точка входа
-from handlers_user import get_bot
-import Admin_bot
-import threading, time
+# На уровне модуля — только стандартная библиотека: рабочие процессы image_norm
+# запускаются через spawn и заново импортируют этот файл как __mp_main__.
+# Импорт handlers_user там создал бы ботов, потоки и открыл БД — поэтому модули бота
+# импортируются внутри функций.
+import os, threading, time
 from datetime import datetime
 
-def notif_scheduler(bot):
-    """Простой планировщик отправки уведомлений (если они есть)."""
+def notif_scheduler(shops):
+    """Простой планировщик отправки уведомлений (если они есть) — по всем магазинам."""
+    import Admin_bot, handlers_user, tenants
     while True:
-        try:
-            due = Admin_bot.fetch_due_notifications(datetime.utcnow())
-            for n in due:
-                try:
-                    bot.send_message(n["chat_id"], n["text"], parse_mode="HTML")
-                except Exception as e:
-                    print(f"[notif send error] {e}")
-        except Exception as e:
-            print(f"[notif_scheduler] loop error: {e}")
+        for shop in shops:
+            try:
+                with tenants.use(shop):
+                    # созревшие уведомления одного чата уходят одним сообщением
+                    Admin_bot.send_due_notifications(handlers_user.bots, datetime.utcnow())
+            except Exception as e:
+                print(f"[notif_scheduler] {shop.name} loop error: {e}")
         time.sleep(5)
 
+def runtime_monitor(interval: int):
+    """Периодический лог очередей полос обработки, исходящих, памяти корзин (при изменении) и уведомлений (RUNTIME_STATS_SEC > 0)."""
+    import Admin_bot, handlers_user, storage, tenants
+    last_carts = {}       # магазин -> прошлые stats() корзин: в лог — только изменения
+    while True:
+        time.sleep(interval)
+        st = handlers_user.dispatcher.stats()
+        if st["backlog_total"] or st["errors"]:
+            print(f"[lanes] {st} per-lane={handlers_user.dispatcher.backlog()}")
+        ob = handlers_user.outbox.stats()
+        if ob["backlog_total"] or ob["errors"]:
+            print(f"[outbox] {ob}")
+        for shop in handlers_user.shops:
+            with tenants.use(shop):
+                cs = handlers_user.carts.stats()
+            if cs != last_carts.get(shop.name):
+                last_carts[shop.name] = cs
+                print(f"[carts] {shop.name}: {cs}")
+        print(f"[notify] {Admin_bot.notification_stats}")
+        for name, st in storage.stats().items():
+            if st["kind"] == "postgres":
+                print(f"[storage] {name}: {st}")
+        if len(handlers_user.shops) > 1:
+            print(f"[tenants] {tenants.stats()}")
+
+def poll_shop(shop):
+    """Приём апдейтов одного магазина; смещение — в его БД."""
+    import Admin_bot, handlers_user, ingest, tenants
+    with tenants.use(shop):
+        ingest.poll(handlers_user.bots, Admin_bot.update_offsets, flush=handlers_user.outbox.flush)
+
 def main():
-    Admin_bot.init_db()
-    bot = get_bot()
+    import Admin_bot, archive, backup, handlers_user, storage, tenants, update_log, warmup
+    shops = handlers_user.shops
+    # Схема, каталог и настройки — до приёма апдейтов; картинки и page cache греются в фоне
+    for shop in shops:
+        with tenants.use(shop):
+            warmup.warm_start()
+
+    # Запись входящих апдейтов для реплея (анонимизированно)
+    if os.getenv("UPDATE_LOG"):
+        keep = {handlers_user.BTN_CATALOG, handlers_user.BTN_NEWS, handlers_user.BTN_CART,
+                handlers_user.BTN_PROFILE, handlers_user.BTN_ADMIN, handlers_user.BTN_EXIT_ADMIN}
+        update_log.install_capture(os.getenv("UPDATE_LOG"), keep_texts=keep)
 
     # Запускаем планировщик в фоне
-    th = threading.Thread(target=notif_scheduler, args=(bot,), daemon=True)
+    th = threading.Thread(target=notif_scheduler, args=(shops,), daemon=True)
     th.start()
 
-    print("Бот запущен…")
-    bot.polling(none_stop=True, interval=0, timeout=20)
+    # Фоновая проверка картинок каталога и публикаций (IMAGE_HEALTH_INTERVAL_MIN, 0 — выключено)
+    for shop in shops:
+        with tenants.use(shop):
+            Admin_bot.image_health.start()
+
+    # Бэкапы и архив — для файлов SQLite; у PostgreSQL это средства сервера (pg_dump, партиции)
+    sqlite_shops = [s for s in shops if not storage.is_postgres(Admin_bot.db_dsn(s))]
+    if sqlite_shops:
+        # Горячие бэкапы БД по расписанию (BACKUP_INTERVAL_MIN, 0 — выключено)
+        backup.start_scheduler(shops=sqlite_shops)
+
+        # Вынос старых заказов в помесячные архивы (ARCHIVE_INTERVAL_MIN, 0 — выключено)
+        archive.start_scheduler(Admin_bot.connect, sqlite_shops)
+
+    # LANES_STATS_SEC — прежнее имя настройки, читается, если RUNTIME_STATS_SEC не задан
+    stats_sec = int(os.getenv("RUNTIME_STATS_SEC") or os.getenv("LANES_STATS_SEC", "0"))
+    if stats_sec > 0:
+        threading.Thread(target=runtime_monitor, args=(stats_sec,), daemon=True).start()
+
+    print(f"Бот запущен… (магазинов: {len(shops)}, полос обработки: {handlers_user.dispatcher.n})")
+    # Приём апдейтов пачками со смещением в БД: после перезапуска — с того же места.
+    # Каждый магазин — свой long polling (поток почти всё время ждёт ответа getUpdates).
+    for shop in shops[1:]:
+        threading.Thread(target=poll_shop, args=(shop,), name=f"poll-{shop.name}", daemon=True).start()
+    poll_shop(shops[0])
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,275 @@
+# media_fetch.py
+# Единая загрузка картинок по URL для отправки фото.
+#  * на каждый хост — свой requests.Session с keep-alive пулом соединений
+#    (MEDIA_POOL_SIZE), не больше MEDIA_MAX_HOSTS сессий (LRU, старые закрываются);
+#  * ограниченные повторы (MEDIA_RETRIES) на обрывы соединения и 429/5xx, с backoff
+#    (таймауты не повторяются — мёртвый хост не должен стоить кратного времени);
+#  * тело читается потоково и обрывается, как только превышен MEDIA_MAX_BYTES
+#    (для HTML — MEDIA_HTML_LIMIT: для og:image хватает начала страницы);
+#  * тип определяется по первым байтам (magic bytes), а не по Content-Type;
+#  * на каждый хост — автомат защиты (circuit.py): после серии ошибок/медленных ответов
+#    запросы к хосту сразу отклоняются (CircuitOpen), отправка уходит текстом;
+#  * общий бюджет времени на медиа в рамках одного апдейта (budget()): таймауты
+#    запросов урезаются до остатка, по его исчерпании — BudgetExceeded. Такой отказ —
+#    следствие бюджета, а не хоста: в автомат хоста он не записывается.
+
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import image_cache
+from circuit import BreakerBoard
+
+MEDIA_TIMEOUT = (float(os.getenv("MEDIA_CONNECT_TIMEOUT", "5")), float(os.getenv("MEDIA_READ_TIMEOUT", "10")))
+MEDIA_RETRIES = int(os.getenv("MEDIA_RETRIES", "2"))
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(20 * 1024 * 1024)))
+MEDIA_HTML_LIMIT = int(os.getenv("MEDIA_HTML_LIMIT", str(512 * 1024)))
+MEDIA_POOL_SIZE = int(os.getenv("MEDIA_POOL_SIZE", "8"))
+MEDIA_MAX_HOSTS = int(os.getenv("MEDIA_MAX_HOSTS", "64"))
+MEDIA_UPDATE_BUDGET_S = float(os.getenv("MEDIA_UPDATE_BUDGET_S", "8"))
+_CHUNK = 64 * 1024
+_BUDGET_SLACK_S = 0.05       # таймаут, сработавший за столько до конца бюджета, — из-за бюджета
+
+class MediaError(Exception):
+    """URL не дал картинку: сеть, HTTP-ошибка, не тот тип, пустой ответ."""
+
+class MediaTooLarge(MediaError):
+    """Тело больше допустимого — загрузка прервана."""
+
+class CircuitOpen(MediaError):
+    """Автомат хоста открыт — к хосту сейчас не ходим."""
+
+class BudgetExceeded(MediaError):
+    """Исчерпан бюджет времени апдейта на медиа."""
+
+# ============================ Бюджет и автоматы ============================
+
+_deadline = contextvars.ContextVar("media_deadline", default=None)
+breakers = BreakerBoard()
+
+@contextmanager
+def budget(seconds: float = MEDIA_UPDATE_BUDGET_S):
+    """Ограничить суммарное время медиа-запросов внутри блока; вложенный бюджет не продлевает внешний."""
+    outer = _deadline.get()
+    deadline = time.monotonic() + seconds
+    token = _deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining() -> float | None:
+    d = _deadline.get()
+    return None if d is None else d - time.monotonic()
+
+def host_of(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+def host_available(url: str) -> bool:
+    """False — автомат хоста открыт: картинку сейчас не достать, лучше сразу текст."""
+    return bool(url) and not breakers.get(host_of(url)).is_open()
+
+# ============================ Сессии ============================
+
+_sessions = OrderedDict()     # "scheme://host" -> Session
+_sessions_lock = threading.Lock()
+
+def _new_session() -> requests.Session:
+    # повторы — в _open(): они должны видеть бюджет апдейта, поэтому в адаптере их нет
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MEDIA_POOL_SIZE)
+    s = requests.Session()
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    s.headers.update(image_cache.HEADERS)
+    return s
+
+def session_for(url: str) -> requests.Session:
+    """Общая keep-alive сессия для хоста url."""
+    parts = urlsplit(url)
+    key = f"{parts.scheme}://{parts.netloc}".lower()
+    with _sessions_lock:
+        s = _sessions.get(key)
+        if s is not None:
+            _sessions.move_to_end(key)
+            return s
+        s = _sessions[key] = _new_session()
+        evicted = []
+        while len(_sessions) > max(1, MEDIA_MAX_HOSTS):
+            evicted.append(_sessions.popitem(last=False)[1])
+    for old in evicted:
+        old.close()
+    return s
+
+# ============================ Определение типа ============================
+
+_MAGIC = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
+def sniff(head: bytes) -> str | None:
+    """MIME по первым байтам: image/* или text/html; None — неизвестно."""
+    for magic, mime in _MAGIC:
+        if head.startswith(magic):
+            return mime
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    text = head[:1024].lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    if text.startswith((b"<!doctype html", b"<html")) or b"<head" in text or b"<meta" in text:
+        return "text/html"
+    return None
+
+# ============================ Загрузка ============================
+
+_RETRY_STATUS = (429, 500, 502, 503, 504)
+
+def _timeout(timeout):
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise BudgetExceeded("бюджет времени на медиа исчерпан")
+    return (min(timeout[0], left), min(timeout[1], left))
+
+def _budget_spent() -> bool:
+    left = remaining()
+    return left is not None and left <= _BUDGET_SLACK_S
+
+def _can_wait(pause: float) -> bool:
+    left = remaining()
+    return left is None or left > pause + 1.0
+
+def _open(url: str, timeout):
+    """GET с повторами на обрыв соединения и 429/5xx; повтор — только если хватает бюджета."""
+    for attempt in range(MEDIA_RETRIES + 1):
+        pause = 0.3 * 2 ** attempt
+        last = attempt == MEDIA_RETRIES
+        try:
+            r = session_for(url).get(url, timeout=_timeout(timeout), allow_redirects=True, stream=True)
+        except requests.Timeout:
+            raise
+        except requests.ConnectionError:
+            if last or not _can_wait(pause):
+                raise
+        else:
+            if r.status_code not in _RETRY_STATUS or last or not _can_wait(pause):
+                return r
+            r.close()
+        time.sleep(pause)
+
+def fetch(url: str, max_bytes: int = MEDIA_MAX_BYTES, timeout=MEDIA_TIMEOUT, head_only: bool = False) -> dict:
+    """
+    Скачать url. Возвращает {"url", "final_url", "status", "mime", "data"};
+    для HTML тело обрезается до MEDIA_HTML_LIMIT и добавляется "text".
+    head_only — не HTML читается только до определения типа (data — первые байты).
+    MediaError — HTTP-ошибка, сеть; MediaTooLarge — картинка больше max_bytes;
+    CircuitOpen — автомат хоста открыт; BudgetExceeded — вышел бюджет апдейта.
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        raise BudgetExceeded("бюджет времени на медиа исчерпан")
+    breaker = breakers.get(host_of(url))
+    if not breaker.allow():
+        raise CircuitOpen(f"хост {host_of(url)} недоступен (автомат открыт)")
+    t0 = time.perf_counter()
+    host_ok, error = False, None
+    try:
+        with _open(url, timeout) as r:
+            # 4xx — проблема конкретного URL, хост отвечает; 429/5xx — проблема хоста
+            host_ok = r.status_code < 500 and r.status_code != 429
+            if r.status_code >= 400:
+                error = f"HTTP {r.status_code}"
+                raise MediaError(error)
+            declared = int(r.headers.get("Content-Length") or 0)
+            body = bytearray()
+            mime = None
+            limit = max_bytes
+            for chunk in r.iter_content(_CHUNK):
+                body += chunk
+                if mime is None and len(body) >= 16:
+                    mime = sniff(bytes(body[:1024]))
+                    if mime == "text/html":
+                        limit = MEDIA_HTML_LIMIT
+                    elif head_only:
+                        break
+                    elif declared > max_bytes:
+                        raise MediaTooLarge(f"{declared} байт > {max_bytes}")
+                if len(body) > limit:
+                    if mime == "text/html":
+                        del body[limit:]
+                        break
+                    raise MediaTooLarge(f"больше {max_bytes} байт")
+                if left is not None and remaining() <= 0:
+                    raise BudgetExceeded("бюджет времени на медиа исчерпан")
+            data = bytes(body)
+            res = {"url": url, "final_url": r.url, "status": r.status_code,
+                   "mime": mime or sniff(data), "data": data}
+            if res["mime"] == "text/html":
+                res["text"] = data.decode(r.encoding or "utf-8", "replace")
+            return res
+    except requests.RequestException as e:
+        if isinstance(e, (requests.Timeout, requests.ConnectionError)) and _budget_spent():
+            # таймаут был урезан до остатка бюджета и сработал вместе с ним
+            host_ok = None
+            raise BudgetExceeded("бюджет времени на медиа исчерпан") from e
+        host_ok, error = False, f"{type(e).__name__}: {e}"[:200]
+        raise MediaError(error) from e
+    except BudgetExceeded:
+        host_ok = None
+        raise
+    finally:
+        if host_ok is None:              # отказ из-за бюджета апдейта — хост ни при чём
+            breaker.release()
+        else:
+            breaker.record(host_ok, (time.perf_counter() - t0) * 1000, error)
+
+def og_image(html: str) -> str | None:
+    m = image_cache.OG_IMAGE_RE.search(html or "")
+    return m.group(1) if m else None
+
+def resolve(url: str) -> str:
+    """
+    Прямая ссылка на картинку: для HTML-страницы — её og:image, иначе сам url.
+    Картинка не скачивается (только первые байты для типа); результат — в image_cache.
+    """
+    cached = image_cache.direct_url(url)
+    if cached is not None:
+        return cached
+    res = fetch(url, head_only=True)
+    direct = url
+    if res["mime"] == "text/html":
+        direct = og_image(res["text"])
+        if not direct:
+            raise MediaError("HTML без og:image")
+    elif not (res["mime"] or "").startswith("image/"):
+        raise MediaError(f"не картинка: {res['mime'] or 'неизвестный формат'}")
+    image_cache.remember_direct(url, direct)
+    return direct
+
+def fetch_image(url: str, max_bytes: int = MEDIA_MAX_BYTES) -> dict:
+    """Картинка по url; для HTML-страницы — её og:image (прямая ссылка запоминается в image_cache)."""
+    res = fetch(url, max_bytes)
+    if res["mime"] == "text/html":
+        direct = og_image(res["text"])
+        if not direct:
+            raise MediaError("HTML без og:image")
+        image_cache.remember_direct(url, direct)
+        res = fetch(direct, max_bytes)
+    if not (res["mime"] or "").startswith("image/"):
+        raise MediaError(f"не картинка: {res['mime'] or 'неизвестный формат'}")
+    return res
+
+def stats() -> dict:
+    with _sessions_lock:
+        hosts = len(_sessions)
+    return {"hosts": hosts, "trips": breakers.total_trips(), "breakers": breakers.snapshot()}
@@ -0,0 +1,109 @@
+# outbox.py
+# Очередь исходящих запросов к Bot API: обработчик ставит ответ в очередь и сразу
+# возвращается, не дожидаясь HTTP-запроса к Telegram.
+#  * отправки в один чат идут строго по порядку (полосы lanes.OrderedLanes, ключ — chat_id),
+#    в разные чаты — параллельно в OUTBOX_LANES потоках;
+#  * answer_callback_query — отдельный пул без очереди чата: «часики» на кнопке
+#    гаснут сразу, даже если перед ними в чат стоят тяжёлые отправки;
+#  * у каждого потока свой keep-alive HTTP-сеанс telebot (apihelper держит сессию на поток).
+# Составные отправки, которым нужен результат или исключение (edit → при ошибке send,
+# цепочка safe_send_photo, отправка временного файла), ставятся целиком через run().
+
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import tenants
+from lanes import OrderedLanes
+
+OUTBOX_LANES = int(os.getenv("OUTBOX_LANES", "8"))
+OUTBOX_CALLBACK_WORKERS = int(os.getenv("OUTBOX_CALLBACK_WORKERS", "4"))
+
+# позиция chat_id среди аргументов метода TeleBot
+CHAT_METHODS = {
+    "send_message": 0, "send_photo": 0, "send_document": 0, "send_location": 0,
+    "send_chat_action": 0, "send_media_group": 0, "copy_message": 0, "forward_message": 0,
+    "edit_message_text": 1, "edit_message_caption": 1,
+    "edit_message_reply_markup": 0, "edit_message_media": 1, "delete_message": 0,
+}
+
+class Outbox:
+    def __init__(self, lanes: int = OUTBOX_LANES, callback_workers: int = OUTBOX_CALLBACK_WORKERS):
+        self._lanes = OrderedLanes(lanes, name="out")
+        self._callbacks = ThreadPoolExecutor(max_workers=max(1, callback_workers), thread_name_prefix="out-cb")
+        self._cb_pending = set()
+        self._cb_lock = threading.Condition()
+
+    def submit(self, chat_id, fn, *args, **kwargs) -> Future:
+        """Выполнить fn в очереди чата (в контексте вызывающего — бюджеты, магазин)."""
+        return self._lanes.submit(tenants.key(chat_id), fn, *args, **kwargs)
+
+    def submit_callback(self, fn, *args, **kwargs) -> Future:
+        ctx = contextvars.copy_context()
+        fut = self._callbacks.submit(ctx.run, fn, *args, **kwargs)
+        with self._cb_lock:
+            self._cb_pending.add(fut)
+        fut.add_done_callback(self._cb_done)
+        return fut
+
+    def _cb_done(self, fut: Future):
+        exc = fut.exception()
+        if exc is not None:
+            print(f"[outbox] answer_callback_query error: {exc}")
+        with self._cb_lock:
+            self._cb_pending.discard(fut)
+            self._cb_lock.notify_all()
+
+    def wait_idle(self, timeout: float = 30.0) -> bool:
+        with self._cb_lock:
+            self._cb_lock.wait_for(lambda: not self._cb_pending, timeout)
+        return self._lanes.wait_idle(timeout)
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """Дождаться отправки всего, что поставлено до вызова (новые отправки не ждём)."""
+        deadline = time.monotonic() + timeout
+        with self._cb_lock:
+            pending = list(self._cb_pending)
+        wait(pending, timeout)
+        return self._lanes.barrier(max(0.0, deadline - time.monotonic()))
+
+    def stats(self) -> dict:
+        st = self._lanes.stats()
+        with self._cb_lock:
+            st["callbacks_pending"] = len(self._cb_pending)
+        return st
+
+class QueuedBot:
+    """
+    Обёртка TeleBot для обработчиков: методы отправки возвращают Future и выполняются
+    в Outbox; остальные атрибуты (get_file, download_file, token…) — как у исходного бота.
+    """
+
+    def __init__(self, bot, outbox: Outbox):
+        self.raw = bot
+        self.outbox = outbox
+
+    def __getattr__(self, name):
+        attr = getattr(self.raw, name)
+        if name == "answer_callback_query":
+            return lambda *a, **kw: self.outbox.submit_callback(attr, *a, **kw)
+        pos = CHAT_METHODS.get(name)
+        if pos is None:
+            return attr
+
+        def queued(*args, **kwargs):
+            chat_id = kwargs.get("chat_id", args[pos] if len(args) > pos else None)
+            return self.outbox.submit(chat_id, attr, *args, **kwargs)
+        return queued
+
+    def run(self, chat_id, fn, *args, **kwargs) -> Future:
+        """Составная отправка: fn(исходный_бот, *args) целиком в очереди чата."""
+        return self.outbox.submit(chat_id, fn, self.raw, *args, **kwargs)
+
+def run_in_chat(bot, chat_id, fn, *args, **kwargs):
+    """fn(bot, *args) — через очередь чата, если bot — QueuedBot, иначе сразу."""
+    if isinstance(bot, QueuedBot):
+        return bot.run(chat_id, fn, *args, **kwargs)
+    return fn(bot, *args, **kwargs)
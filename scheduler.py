@@ -1,5 +1,6 @@
 # scheduler.py
-# Фоновый планировщик уведомлений: каждые 10 сек берёт due-уведомления из БД и отправляет их.
+# Фоновый планировщик уведомлений: каждые 10 сек берёт due-уведомления из БД и отправляет их
+# (по одному сообщению на чат — см. Admin_bot.send_due_notifications).
 
 import threading
 import time
@@ -10,13 +11,7 @@ def start_notification_scheduler(bot):
     def loop():
         while True:
             try:
-                now = datetime.utcnow()
-                due = Admin_bot.fetch_due_notifications(now)
-                for n in due:
-                    try:
-                        bot.send_message(n["chat_id"], n["text"], parse_mode="HTML")
-                    except Exception as e:
-                        print(f"[notif_scheduler] send error: {e}")
+                Admin_bot.send_due_notifications(bot, datetime.utcnow())
             except Exception as e:
                 print(f"[notif_scheduler] loop error: {e}")
             time.sleep(10)
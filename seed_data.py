@@ -0,0 +1,236 @@
+# seed_data.py
+# Генератор больших синтетических БД магазина (для тестов/бенчмарков под нагрузкой).
+# Схему создаёт Admin_bot.init_db(), данные заливаются пачками через executemany.
+# Генерация детерминирована (--seed), заказы пишутся в хронологическом порядке.
+#
+#   python seed_data.py --db /tmp/big.db --products 30000 --users 300000 --orders 3000000
+#
+# ВНИМАНИЕ: существующий файл --db перезаписывается только с --force.
+
+import argparse
+import bisect
+import math
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate, islice
+
+import Admin_bot
+
+BATCH = 50_000
+STATUSES = Admin_bot.ORDER_STATUSES
+TS_FMT = "%Y-%m-%d %H:%M:%S"
+
+# Суточный профиль заказов (доля по часам): ночью тихо, пик вечером
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 3, 5, 7, 8, 8, 9, 10, 9, 8, 8, 9, 11, 13, 14, 12, 9, 5, 2]
+HOUR_CUM = list(accumulate(HOUR_WEIGHTS))
+
+def _bulk(con: sqlite3.Connection, sql: str, rows) -> int:
+    """Вставка из генератора пачками по BATCH строк. Возвращает число строк."""
+    n = 0
+    it = iter(rows)
+    while True:
+        chunk = list(islice(it, BATCH))
+        if not chunk:
+            break
+        con.executemany(sql, chunk)
+        con.commit()
+        n += len(chunk)
+    return n
+
+def _zipf_cum(n: int, s: float) -> list:
+    """Накопленные веса распределения Ципфа для n элементов (для bisect-выборки)."""
+    return list(accumulate(1.0 / (r ** s) for r in range(1, n + 1)))
+
+def _pick(rnd: random.Random, cum: list) -> int:
+    """Индекс по накопленным весам: O(log n)."""
+    return bisect.bisect_right(cum, rnd.random() * cum[-1])
+
+# ============================ Генераторы строк ============================
+
+def gen_categories(n: int):
+    for i in range(1, n + 1):
+        yield (i, f"Категория {i:05d}")
+
+def gen_products(rnd: random.Random, n: int, n_cats: int, prices: list):
+    for i in range(1, n + 1):
+        price = round(math.exp(rnd.uniform(math.log(50), math.log(20000))), 2)
+        prices.append(price)
+        yield (
+            i, f"Товар {i:06d}", price, rnd.choice((1, 1, 1, 2, 5, 10)),
+            f"https://example.com/img/{i}.jpg", f"Описание товара {i}",
+            rnd.randint(1, n_cats),
+        )
+
+def gen_users(n: int, base_uid: int):
+    for i in range(n):
+        uid = base_uid + i
+        yield (uid, f"user{uid}", f"+3816{uid % 100_000_000:08d}", f"Улица {i % 997}, дом {i % 131 + 1}")
+
+def gen_orders(rnd, n_orders, days, end_dt, n_users, base_uid, n_products, prod_cum, prices, items_out):
+    """
+    Заказы по дням от старых к новым: объём растёт к концу периода (skew к свежим),
+    внутри дня — суточный профиль. Позиции заказа складываются в items_out и сбрасываются вместе с пачкой заказов.
+    """
+    user_cum = _zipf_cum(n_users, 0.8)
+    day_w = [math.exp(2.0 * d / max(1, days)) * (1.3 if (end_dt - timedelta(days=days - d)).weekday() >= 5 else 1.0)
+             for d in range(days)]
+    scale = n_orders / sum(day_w)
+    oid, carry = 0, 0.0
+    for d in range(days):
+        want = day_w[d] * scale + carry
+        cnt = int(want)
+        carry = want - cnt
+        if d == days - 1:
+            cnt = n_orders - oid
+        day0 = (end_dt - timedelta(days=days - d)).replace(hour=0, minute=0, second=0, microsecond=0)
+        secs = sorted(
+            bisect.bisect_right(HOUR_CUM, rnd.random() * HOUR_CUM[-1]) * 3600 + rnd.randrange(3600)
+            for _ in range(cnt)
+        )
+        age_days = days - d
+        for s in secs:
+            oid += 1
+            uid = base_uid + _pick(rnd, user_cum)
+            n_items = min(6, 1 + int(rnd.expovariate(0.7)))
+            total = 0.0
+            for _ in range(n_items):
+                pid = 1 + min(n_products - 1, _pick(rnd, prod_cum))
+                qty = rnd.randint(1, 5)
+                price = prices[pid - 1]
+                total += qty * price
+                items_out.append((oid, pid, qty, price))
+            if age_days > 3:
+                status = STATUSES[-1]
+            else:
+                status = rnd.choice(STATUSES)
+            yield (oid, uid, uid, round(total, 2), status, (day0 + timedelta(seconds=s)).strftime(TS_FMT))
+
+def gen_pickup_points(rnd, n):
+    """Пункты раздачи вокруг 40 «городов» сетки ~42–47° с.ш., 18–25° в.д. (примерно Балканы)."""
+    for i in range(1, n + 1):
+        city = i % 40
+        lat = 42.0 + (city % 8) * 0.65 + rnd.uniform(-0.08, 0.08)
+        lon = 18.5 + (city // 8) * 1.3 + rnd.uniform(-0.1, 0.1)
+        yield (f"Пункт раздачи №{i}, город {city}", round(lat, 5), round(lon, 5))
+
+def gen_notifications(rnd, n, end_dt, base_uid, n_users):
+    for _ in range(n):
+        send_at = end_dt + timedelta(seconds=rnd.randint(-7 * 86400, 7 * 86400))
+        yield (base_uid + rnd.randrange(n_users), "Синтетическое уведомление", send_at.strftime(TS_FMT), 0)
+
+def gen_posts(rnd, n, end_dt):
+    for i in range(1, n + 1):
+        created = end_dt - timedelta(minutes=rnd.randint(0, 365 * 24 * 60))
+        publish = None
+        if rnd.random() < 0.2:
+            publish = (end_dt + timedelta(minutes=rnd.randint(-30 * 1440, 30 * 1440))).strftime(TS_FMT)
+        yield (i, rnd.choice(("Новость", "Акция")), f"https://example.com/post/{i}.jpg",
+               f"Публикация {i}", f"Текст публикации {i}", publish, created.strftime(TS_FMT))
+
+# ============================ Основная процедура ============================
+
+def seed(db_path: str, *, categories: int, products: int, users: int, orders: int,
+         notifications: int, posts: int, pickup_points: int, days: int, seed: int,
+         end_dt: datetime, base_uid: int = 100_000_000):
+    rnd = random.Random(seed)
+
+    Admin_bot.DB_PATH = db_path
+    Admin_bot.init_db()
+    con = sqlite3.connect(db_path)
+    # Однократная заливка: журнал и fsync не нужны
+    con.execute("PRAGMA journal_mode=OFF")
+    con.execute("PRAGMA synchronous=OFF")
+    con.execute("PRAGMA locking_mode=EXCLUSIVE")
+    con.execute("PRAGMA cache_size=-262144")
+    con.execute("PRAGMA temp_store=MEMORY")
+
+    report = {}
+    def step(name, fn):
+        t0 = time.perf_counter()
+        n = fn()
+        dt = time.perf_counter() - t0
+        report[name] = n
+        print(f"  {name:<14}{n:>12,} rows  {dt:8.1f}s  {n / dt if dt else 0:>12,.0f} rows/s")
+
+    prices: list = []
+    items: list = []
+    prod_cum = _zipf_cum(products, 1.1)
+
+    print(f"Seeding {db_path} (seed={seed})")
+    step("categories", lambda: _bulk(con, "INSERT INTO categories(id, name) VALUES (?,?)", gen_categories(categories)))
+    step("products", lambda: _bulk(con, """
+        INSERT INTO products(id, name, price, min_qty, image, description, category_id)
+        VALUES (?,?,?,?,?,?,?)""", gen_products(rnd, products, categories, prices)))
+    # отдельный генератор — координаты не сдвигают последовательность основного rnd
+    step("pickup_points", lambda: _bulk(con, "INSERT INTO pickup_points(address, lat, lon) VALUES (?,?,?)",
+                                        gen_pickup_points(random.Random(seed + 1), pickup_points)))
+    step("users", lambda: _bulk(con, "INSERT INTO users(user_id, username, phone, address) VALUES (?,?,?,?)",
+                                gen_users(users, base_uid)))
+    step("posts", lambda: _bulk(con, """
+        INSERT INTO posts(id, type, image, title, text, publish_at, created_at)
+        VALUES (?,?,?,?,?,?,?)""", gen_posts(rnd, posts, end_dt)))
+    con.execute("UPDATE posts SET feed_at = COALESCE(publish_at, created_at)"); con.commit()
+
+    # Заказы и их позиции пишем одной транзакцией на пачку
+    def do_orders():
+        n = 0
+        it = gen_orders(rnd, orders, days, end_dt, users, base_uid, products, prod_cum, prices, items)
+        while True:
+            chunk = list(islice(it, BATCH))
+            if not chunk:
+                break
+            con.executemany("""
+                INSERT INTO orders(id, user_id, chat_id, total, status, created_at)
+                VALUES (?,?,?,?,?,?)""", chunk)
+            con.executemany("INSERT INTO order_items(order_id, product_id, qty, price) VALUES (?,?,?,?)", items)
+            report["order_items"] = report.get("order_items", 0) + len(items)
+            items.clear()
+            con.commit()
+            n += len(chunk)
+        return n
+    step("orders+items", do_orders)
+    print(f"  {'order_items':<14}{report.get('order_items', 0):>12,} rows")
+    step("snapshots", lambda: Admin_bot.backfill_order_snapshots(con, batch=BATCH))
+    step("notifications", lambda: _bulk(con, "INSERT INTO notifications(chat_id, text, send_at, sent) VALUES (?,?,?,?)",
+                                        gen_notifications(rnd, notifications, end_dt, base_uid, users)))
+
+    con.execute("PRAGMA journal_mode=DELETE")
+    con.execute("ANALYZE")
+    con.commit(); con.close()
+    return report
+
+def main():
+    ap = argparse.ArgumentParser(description="Генератор синтетической store.db")
+    ap.add_argument("--db", required=True, help="путь к создаваемой БД")
+    ap.add_argument("--force", action="store_true", help="перезаписать существующий файл")
+    ap.add_argument("--categories", type=int, default=200)
+    ap.add_argument("--products", type=int, default=20_000)
+    ap.add_argument("--users", type=int, default=100_000)
+    ap.add_argument("--orders", type=int, default=500_000)
+    ap.add_argument("--notifications", type=int, default=50_000)
+    ap.add_argument("--posts", type=int, default=500)
+    ap.add_argument("--pickup-points", type=int, default=300)
+    ap.add_argument("--days", type=int, default=365, help="глубина истории заказов")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--end", help="конец периода 'YYYY-MM-DD' (по умолчанию — сегодня); "
+                                  "одинаковые --seed и --end дают одинаковую БД")
+    args = ap.parse_args()
+    end_dt = datetime.strptime(args.end, "%Y-%m-%d") if args.end else \
+        datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if os.path.exists(args.db):
+        if not args.force:
+            raise SystemExit(f"{args.db} уже существует (используйте --force).")
+        os.remove(args.db)
+
+    t0 = time.perf_counter()
+    seed(args.db, categories=args.categories, products=args.products, users=args.users,
+         orders=args.orders, notifications=args.notifications, posts=args.posts,
+         pickup_points=args.pickup_points, days=args.days, seed=args.seed, end_dt=end_dt)
+    print(f"Done in {time.perf_counter() - t0:.1f}s")
+
+if __name__ == "__main__":
+    main()
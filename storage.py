@@ -0,0 +1,496 @@
+# storage.py
+# Хранилище БД магазина, выбирается по DSN:
+#  * путь к файлу — SQLite, как раньше: новое соединение на каждый Admin_bot.db(), один писатель;
+#  * postgresql://… (postgres://…) — PostgreSQL через psycopg 3 и пул соединений:
+#    писать могут несколько потоков и несколько процессов-воркеров бота одновременно.
+# Запросы остаются на своих местах (Admin_bot.py — репозиторий каталога, публикаций, настроек,
+# пунктов, пользователей, заказов, уведомлений, статистики; FSMStore, ImageHealth, OffsetStore…)
+# и пишутся на общем подмножестве SQL. Соединение PostgreSQL переводит текст запроса один раз (кэш).
+#
+# Поддерживаемое подмножество (всё прочее из SQLite в запросе к PostgreSQL — UnsupportedSQL
+# сразу, а не тихо неверный запрос):
+#  * стандартные SELECT/INSERT/UPDATE/DELETE, ON CONFLICT … DO UPDATE/NOTHING, RETURNING,
+#    сравнение кортежей, || , COALESCE/MIN/MAX/SUM/COUNT/TRIM/lower/substr;
+#  * плейсхолдеры ? (→ %s; литеральный % экранируется);
+#  * INSERT OR IGNORE INTO … (без RETURNING) → INSERT … ON CONFLICT DO NOTHING;
+#  * x COLLATE NOCASE → lower(x);
+#  * SELECT value FROM json_each(?) (JSON-массив целых) → json_array_elements_text;
+#  * json_group_array(json_array(…)) → json_agg(json_build_array(…)); GROUP_CONCAT(x) без разделителя;
+#  * схема main. → схема по умолчанию;
+#  * CREATE/ALTER TABLE: INTEGER PRIMARY KEY AUTOINCREMENT → BIGSERIAL, INTEGER → BIGINT,
+#    REAL → DOUBLE PRECISION, WITHOUT ROWID отбрасывается; внешние ключи не объявляются —
+#    SQLite их тоже не проверяет.
+# Не поддерживаются (_UNSUPPORTED): INSERT OR REPLACE, BEGIN …, PRAGMA, ATTACH/DETACH, sqlite_master,
+# функции дат SQLite (datetime/strftime/julianday), IFNULL, json_extract, last_insert_rowid/changes.
+# Новый запрос вне подмножества — пишется на общем SQL или с веткой по storage.is_pg(con).
+# Соединение ведёт себя как sqlite3.Connection: execute/executemany/cursor/commit/rollback,
+# «with con:» — транзакция, строки — как sqlite3.Row (r[0], r["name"], dict(r)); close() — в пул.
+# Различия, которые запрос не скрывает: новый id — через INSERT … RETURNING id (а не lastrowid),
+# схема — columns()/tables(), большие выборки — iter_rows() (в PostgreSQL — серверный курсор).
+# psycopg — опционально: нужен только для DSN PostgreSQL.
+
+import argparse
+import itertools
+import os
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from functools import lru_cache
+
+try:
+    import psycopg
+    from psycopg.pq import TransactionStatus
+except ImportError:      # PostgreSQL — опционально
+    psycopg = None
+
+STORAGE_POOL_MIN = int(os.getenv("STORAGE_POOL_MIN", "1"))
+STORAGE_POOL_MAX = int(os.getenv("STORAGE_POOL_MAX", "10"))
+STORAGE_POOL_TIMEOUT = float(os.getenv("STORAGE_POOL_TIMEOUT", "30"))
+STORAGE_FETCH = int(os.getenv("STORAGE_FETCH", "2000"))     # строк за раз у серверного курсора
+
+# нарушение уникальности / ограничения в любом из хранилищ
+IntegrityError = (sqlite3.IntegrityError,) + ((psycopg.IntegrityError,) if psycopg else ())
+
+class UnsupportedSQL(ValueError):
+    """Конструкция SQLite, которую перевод для PostgreSQL не поддерживает (см. заголовок)."""
+
+class PoolTimeout(RuntimeError):
+    """Все соединения пула заняты дольше STORAGE_POOL_TIMEOUT."""
+
+def is_postgres(dsn: str | None) -> bool:
+    return bool(dsn) and dsn.startswith(("postgresql://", "postgres://"))
+
+def redact(dsn: str) -> str:
+    """DSN без пароля — для логов."""
+    return re.sub(r"://([^:@/]*):[^@/]*@", r"://\1:***@", dsn)
+
+# ============================ SQLite ============================
+
+class SQLiteStorage:
+    kind = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def stats(self) -> dict:
+        return {"kind": self.kind, "path": self.path}
+
+    def close(self):
+        pass
+
+# ============================ Перевод запросов ============================
+
+_TOKENS = re.compile(r"'[^']*'|--[^\n]*|\?|%")
+
+def _strip_comment(m):
+    t = m.group()
+    return "" if t.startswith("--") else t
+
+def _placeholder(m):
+    t = m.group()
+    if t == "?":
+        return "%s"
+    if t.startswith("--"):
+        return ""
+    return t.replace("%", "%%")       # psycopg: литеральный % — %% (и внутри строк)
+
+_DDL = (
+    (re.compile(r"\bINTEGER PRIMARY KEY AUTOINCREMENT\b", re.I), "BIGSERIAL PRIMARY KEY"),
+    (re.compile(r"\bINTEGER\b", re.I), "BIGINT"),                   # id Telegram не влезают в int4
+    (re.compile(r"\bREAL\b", re.I), "DOUBLE PRECISION"),
+    (re.compile(r",\s*FOREIGN KEY\s*\([^)]*\)\s*REFERENCES\s+\w+\s*\([^)]*\)"
+                r"(?:\s+ON DELETE\s+(?:SET NULL|CASCADE))?", re.I), ""),
+    (re.compile(r"\)\s*WITHOUT ROWID", re.I), ")"),
+)
+
+_DML = (
+    (re.compile(r"\bINSERT OR IGNORE INTO\b(.*)", re.I | re.S), r"INSERT INTO\1 ON CONFLICT DO NOTHING"),
+    (re.compile(r"([\w.]+) COLLATE NOCASE", re.I), r"lower(\1)"),
+    (re.compile(r"SELECT value FROM json_each\(\?\)", re.I),
+     "SELECT value::bigint FROM json_array_elements_text(?::json)"),
+    (re.compile(r"\bjson_group_array\(", re.I), "json_agg("),
+    (re.compile(r"\bjson_array\(", re.I), "json_build_array("),
+    (re.compile(r"\bGROUP_CONCAT\(([^(),]*)\)", re.I), r"string_agg((\1)::text, ',')"),
+    (re.compile(r"(?<![\w.])main\.(?=\w)"), ""),          # схема SQLite main — схема по умолчанию
+)
+
+_UNSUPPORTED = re.compile(
+    r"\bINSERT\s+OR\s+(?!IGNORE\b)\w+|\bREPLACE\s+INTO\b|^\s*(?:BEGIN|PRAGMA|ATTACH|DETACH|VACUUM)\b"
+    r"|\bsqlite_\w+|\b(?:datetime|julianday|strftime|ifnull|json_extract|json_each|json_group_object"
+    r"|last_insert_rowid|changes|total_changes|printf|instr)\s*\(|\bAUTOINCREMENT\b|\bCOLLATE\b"
+    r"|\bGROUP_CONCAT\b|\bWITHOUT\s+ROWID\b|(?<![\w.])main\.",
+    re.I)
+
+def _literal_free(sql: str) -> str:
+    return re.sub(r"'[^']*'", "''", sql)
+
+@lru_cache(maxsize=2048)
+def translate(sql: str) -> str:
+    """Запрос на диалекте SQLite → PostgreSQL (плейсхолдеры %s). Вне подмножества — UnsupportedSQL."""
+    sql = _TOKENS.sub(_strip_comment, sql)
+    if re.search(r"\bINSERT OR IGNORE\b[\s\S]*\bRETURNING\b", _literal_free(sql), re.I):
+        raise UnsupportedSQL(f"INSERT OR IGNORE … RETURNING не переводится: {' '.join(sql.split())[:200]}")
+    if re.match(r"\s*(CREATE|ALTER)\s+TABLE\b", sql, re.I):
+        for rx, repl in _DDL:
+            sql = rx.sub(repl, sql)
+    for rx, repl in _DML:
+        sql = rx.sub(repl, sql)
+    m = _UNSUPPORTED.search(_literal_free(sql))
+    if m:                             # осталось то, что переводы выше не покрыли
+        raise UnsupportedSQL(f"не переводится для PostgreSQL: {m.group()!r} в {' '.join(sql.split())[:200]}")
+    return _TOKENS.sub(_placeholder, sql)
+
+# ============================ PostgreSQL ============================
+
+class Row(tuple):
+    """Строка результата как sqlite3.Row: по индексу, по имени колонки, dict(row)."""
+    __slots__ = ()
+    _names = ()
+    _index = {}
+
+    def __getitem__(self, k):
+        if isinstance(k, str):
+            return tuple.__getitem__(self, self._index[k])
+        return tuple.__getitem__(self, k)
+
+    def keys(self):
+        return list(self._names)
+
+@lru_cache(maxsize=512)
+def _row_class(names: tuple):
+    return type("Row", (Row,), {"__slots__": (), "_names": names,
+                                "_index": {n: i for i, n in enumerate(names)}})
+
+def _row_factory(cursor):
+    cls = _row_class(tuple(c.name for c in cursor.description or ()))
+    return lambda values: tuple.__new__(cls, values)
+
+class Pool:
+    """
+    Потокобезопасный пул соединений psycopg: не больше maxsize, ждать свободное — до timeout.
+    Возвращённое соединение с незавершённой транзакцией откатывается, сломанное — закрывается.
+    """
+
+    def __init__(self, dsn: str, minsize: int = STORAGE_POOL_MIN, maxsize: int = STORAGE_POOL_MAX,
+                 timeout: float = STORAGE_POOL_TIMEOUT):
+        self.dsn = dsn
+        self.maxsize = max(1, maxsize)
+        self.timeout = timeout
+        self._idle = []               # LIFO: горячие соединения используются чаще
+        self._size = 0
+        # RLock: put() может прийти из финализатора забытого соединения (сборка мусора
+        # запускается в любом потоке, в том числе внутри get()/put() этого пула)
+        self._cond = threading.Condition(threading.RLock())
+        self._stats = {"created": 0, "waits": 0, "timeouts": 0, "discarded": 0, "leaked": 0}
+        for _ in range(min(minsize, self.maxsize)):
+            self._size += 1
+            self._idle.append(self._new())
+
+    def _new(self):
+        raw = psycopg.connect(self.dsn, row_factory=_row_factory)
+        with self._cond:
+            self._stats["created"] += 1
+        return raw
+
+    def _drop(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats["discarded"] += 1
+            self._cond.notify()
+
+    def get(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    raw = self._idle.pop()
+                    break
+                if self._size < self.maxsize:
+                    self._size += 1
+                    raw = None
+                    break
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"пул {redact(self.dsn)}: все {self.maxsize} соединений заняты")
+                self._stats["waits"] += 1
+                self._cond.wait(left)
+        if raw is not None:
+            if not (raw.closed or raw.broken):
+                return raw
+            raw.close()               # место в пуле остаётся за новым соединением
+            with self._cond:
+                self._stats["discarded"] += 1
+        try:
+            return self._new()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def put(self, raw):
+        try:
+            if raw.closed or raw.broken:
+                raise ConnectionError
+            if raw.info.transaction_status != TransactionStatus.IDLE:
+                raw.rollback()        # чтение без commit или ошибка в транзакции
+        except Exception:
+            self._drop(raw)
+            return
+        with self._cond:
+            self._idle.append(raw)
+            self._cond.notify()
+
+    def reclaim(self, raw):
+        """Соединение, которое забыли закрыть (финализатор PgConnection)."""
+        with self._cond:
+            self._stats["leaked"] += 1
+        self.put(raw)
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for raw in idle:
+            raw.close()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return dict(self._stats, size=self._size, idle=len(self._idle))
+
+class PgCursor:
+    def __init__(self, con):
+        self._con = con               # держит соединение живым, пока жив курсор
+        self._cur = con._raw.cursor()
+
+    def execute(self, sql: str, params=()):
+        self._cur.execute(translate(sql), tuple(params))
+        return self
+
+    def executemany(self, sql: str, seq):
+        self._cur.executemany(translate(sql), [tuple(p) for p in seq])
+        return self
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def __iter__(self):
+        return iter(self._cur)
+
+    @property
+    def rowcount(self) -> int:
+        return self._cur.rowcount
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    def close(self):
+        self._cur.close()
+
+_cursor_names = itertools.count(1)
+
+class PgConnection:
+    """
+    Соединение из пула с интерфейсом sqlite3.Connection (см. заголовок модуля).
+    Возвращается в пул в close(); забытое (без close) — при сборке мусора, а не теряется для пула.
+    """
+
+    def __init__(self, pool: Pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._finalizer = weakref.finalize(self, pool.reclaim, raw)
+
+    def cursor(self) -> PgCursor:
+        return PgCursor(self)
+
+    def execute(self, sql: str, params=()) -> PgCursor:
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql: str, seq) -> PgCursor:
+        return self.cursor().executemany(sql, seq)
+
+    def iter_rows(self, sql: str, params=(), size: int = STORAGE_FETCH):
+        """Серверный курсор: строки приходят порциями по size, вся выборка в памяти не держится."""
+        with self._raw.cursor(name=f"iter_{next(_cursor_names)}") as cur:
+            cur.itersize = size
+            cur.execute(translate(sql), tuple(params))
+            yield from cur
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def close(self):
+        if self._finalizer.detach() is not None:
+            raw, self._raw = self._raw, None
+            self._pool.put(raw)
+
+class PostgresStorage:
+    kind = "postgres"
+
+    def __init__(self, dsn: str, minsize: int = STORAGE_POOL_MIN, maxsize: int = STORAGE_POOL_MAX,
+                 timeout: float = STORAGE_POOL_TIMEOUT):
+        if psycopg is None:
+            raise RuntimeError("Для PostgreSQL нужен пакет psycopg: pip install 'psycopg[binary]'")
+        self.dsn = dsn
+        self.pool = Pool(dsn, minsize, maxsize, timeout)
+        print(f"[storage] PostgreSQL {redact(dsn)}: pool {minsize}..{self.pool.maxsize}")
+
+    def connect(self) -> PgConnection:
+        return PgConnection(self.pool, self.pool.get())
+
+    def stats(self) -> dict:
+        return {"kind": self.kind, "dsn": redact(self.dsn), **self.pool.stats()}
+
+    def close(self):
+        self.pool.close()
+
+# ============================ Выбор по DSN ============================
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get(dsn: str):
+    """Хранилище для DSN (одно на процесс: у PostgreSQL — общий пул)."""
+    st = _stores.get(dsn)
+    if st is None:
+        with _stores_lock:
+            st = _stores.get(dsn)
+            if st is None:
+                st = _stores[dsn] = PostgresStorage(dsn) if is_postgres(dsn) else SQLiteStorage(dsn)
+    return st
+
+def stats() -> dict:
+    with _stores_lock:
+        stores = list(_stores.values())
+    out = {}
+    for s in stores:
+        st = s.stats()
+        out[st.get("dsn") or st["path"]] = st
+    return out
+
+# ============================ Различия диалектов ============================
+
+def is_pg(con) -> bool:
+    return isinstance(con, (PgConnection, PgCursor))
+
+def columns(con, table: str) -> set:
+    """Имена колонок таблицы (con — соединение или курсор)."""
+    if is_pg(con):
+        return {r[0] for r in con.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = ?
+        """, (table,))}
+    return {r[1] for r in con.execute(f"PRAGMA table_info({table})")}
+
+def tables(con) -> set:
+    if is_pg(con):
+        return {r[0] for r in con.execute("""
+            SELECT table_name FROM information_schema.tables WHERE table_schema = current_schema()
+        """)}
+    return {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+def iter_rows(con, sql: str, params=(), size: int = STORAGE_FETCH):
+    """Большая выборка без материализации (курсор SQLite и так читает по мере обхода)."""
+    if is_pg(con):
+        return con.iter_rows(sql, params, size)
+    return con.execute(sql, params)
+
+def sync_ids(con, table: str, column: str = "id"):
+    """После вставки с явными id: следующий BIGSERIAL — после максимального (SQLite это делает сам)."""
+    if is_pg(con):
+        con.execute(f"""
+            SELECT setval(pg_get_serial_sequence('{table}', '{column}'),
+                          COALESCE((SELECT MAX({column}) FROM {table}), 0) + 1, false)
+        """)
+
+# ============================ Перенос SQLite → PostgreSQL ============================
+
+def copy_sqlite(src_path: str, dst, batch: int = 5000) -> dict:
+    """
+    Скопировать все таблицы SQLite-файла в PostgreSQL (dst — соединение PgConnection,
+    схема уже создана Admin_bot.init_db). Целевые таблицы очищаются. Возвращает {таблица: строк}.
+    """
+    src = sqlite3.connect(f"file:{os.path.abspath(src_path)}?mode=ro", uri=True)
+    res = {}
+    try:
+        names = [r[0] for r in src.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+        have = tables(dst)
+        with dst:
+            for t in names:
+                if t not in have:
+                    print(f"[storage] skip {t}: нет в целевой схеме")
+                    continue
+                cols = [r[1] for r in src.execute(f"PRAGMA table_info({t})")]
+                cols = [c for c in cols if c in columns(dst, t)]
+                dst.execute(f"DELETE FROM {t}")
+                sql = f"INSERT INTO {t}({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})"
+                cur = src.execute(f"SELECT {', '.join(cols)} FROM {t}")
+                n = 0
+                while True:
+                    rows = cur.fetchmany(batch)
+                    if not rows:
+                        break
+                    dst.executemany(sql, rows)
+                    n += len(rows)
+                if "id" in cols:
+                    sync_ids(dst, t)
+                res[t] = n
+    finally:
+        src.close()
+    return res
+
+def main():
+    ap = argparse.ArgumentParser(description="Хранилище БД магазина: перенос SQLite → PostgreSQL")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("copy")
+    c.add_argument("--from", dest="src", default=os.getenv("DB_PATH", "store.db"))
+    c.add_argument("--to", dest="dst", required=True, help="postgresql://…")
+    args = ap.parse_args()
+
+    if args.cmd == "copy":
+        if not is_postgres(args.dst):
+            raise SystemExit("--to: нужен DSN PostgreSQL (postgresql://…)")
+        import Admin_bot                  # схема целевой БД
+        import tenants
+        t0 = time.perf_counter()
+        with tenants.use(tenants.Tenant("copy", None, dsn=args.dst)):
+            Admin_bot.init_db()
+            with Admin_bot.db() as con:
+                res = copy_sqlite(args.src, con)
+        for t, n in res.items():
+            print(f"{t:24} {n}")
+        print(f"[storage] copied {sum(res.values())} rows in {time.perf_counter() - t0:.1f}s")
+
+if __name__ == "__main__":
+    import storage        # те же классы соединений, что у Admin_bot, а не копия из __main__
+    storage.main()
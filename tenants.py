@@ -0,0 +1,146 @@
+# tenants.py
+# Несколько магазинов (токенов бота) в одном процессе.
+# Магазин (Tenant) — имя, токен и своя БД: файл SQLite или DSN PostgreSQL (storage.py). Текущий магазин обработки хранится в
+# contextvar: его выставляет приём апдейтов своего бота, а очереди (lanes, outbox, debounce)
+# переносят контекст в рабочие потоки. Admin_bot.db() открывает БД текущего магазина.
+# Общие на процесс: полосы обработки, очередь исходящих, HTTP-сессии media_fetch,
+# кэши картинок и пул image_norm. Своё у магазина — только то, что объявлено через local():
+# FSM, корзины, кэш каталога, бот и т.п.
+# Без TENANTS_FILE работает один магазин «main» из BOT_TOKEN / DB_DSN / DB_PATH — как раньше.
+# Формат TENANTS_FILE (JSON): [{"name": "shop1", "token": "123:ABC", "db_path": "data/shop1.db"},
+#                              {"name": "shop2", "token": "456:DEF", "dsn": "postgresql://bot@db/shop2"}, ...]
+
+import contextvars
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+TENANTS_FILE = os.getenv("TENANTS_FILE", "")
+
+class Tenant:
+    __slots__ = ("name", "token", "db_path", "dsn", "stats", "_locals", "_lock", "_init_lock")
+
+    def __init__(self, name: str, token: str | None, db_path: str | None = None, dsn: str | None = None):
+        self.name = name
+        self.token = token
+        self.db_path = db_path        # None — Admin_bot.DB_PATH
+        self.dsn = dsn                # postgresql://… — БД в PostgreSQL вместо файла db_path
+        self.stats = {"updates": 0, "errors": 0, "handler_ms": 0.0}
+        self._locals = {}
+        self._lock = threading.Lock()
+        self._init_lock = threading.RLock()   # фабрика local() может обращаться к другим local()
+
+    def count(self, ms: float, error: bool = False):
+        with self._lock:
+            self.stats["updates"] += 1
+            self.stats["errors"] += int(error)
+            self.stats["handler_ms"] += ms
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            st = dict(self.stats)
+        st["handler_ms"] = round(st["handler_ms"], 1)
+        st["avg_ms"] = round(st["handler_ms"] / st["updates"], 2) if st["updates"] else 0.0
+        return st
+
+    def __repr__(self):
+        return f"Tenant({self.name!r})"
+
+DEFAULT = Tenant("main", os.getenv("BOT_TOKEN"), dsn=os.getenv("DB_DSN") or None)
+_current = contextvars.ContextVar("tenant", default=None)
+_all = []
+
+def load(path: str = TENANTS_FILE) -> list:
+    """Магазины процесса: из TENANTS_FILE или один DEFAULT."""
+    if _all:
+        return list(_all)
+    if path:
+        with open(path, encoding="utf-8") as f:
+            items = json.load(f)
+        names = set()
+        for it in items:
+            name = str(it["name"])
+            if name in names:
+                raise ValueError(f"повтор имени магазина: {name}")
+            names.add(name)
+            _all.append(Tenant(name, it["token"], it.get("db_path") or f"{name}.db", it.get("dsn")))
+    if not _all:
+        _all.append(DEFAULT)
+    return list(_all)
+
+def current() -> Tenant:
+    return _current.get() or DEFAULT
+
+@contextmanager
+def use(tenant: Tenant):
+    token = _current.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current.reset(token)
+
+def bound(fn):
+    """fn, всегда выполняемая в магазине, текущем на момент вызова bound() (для фоновых потоков)."""
+    tenant = current()
+
+    def run(*args, **kwargs):
+        with use(tenant):
+            return fn(*args, **kwargs)
+    return run
+
+def key(k):
+    """Ключ очередей/кэшей с учётом магазина: одинаковые user_id в разных магазинах — разные ключи."""
+    t = current()
+    return k if t is DEFAULT else (t.name, k)
+
+class TenantLocal:
+    """
+    Значение «на магазин»: factory() вызывается один раз в контексте магазина при первом
+    обращении. Объект ведёт себя как само значение (атрибуты, [], in, len, итерация);
+    сам объект для данного магазина — _value().
+    """
+
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+
+    def _value(self):
+        t = current()
+        k = id(self)
+        v = t._locals.get(k)
+        if v is None:
+            with t._init_lock:
+                v = t._locals.get(k)
+                if v is None:
+                    v = t._locals[k] = self._factory()
+        return v
+
+    def __getattr__(self, name):
+        return getattr(self._value(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._value(), name, value)
+
+    def __getitem__(self, k):
+        return self._value()[k]
+
+    def __setitem__(self, k, v):
+        self._value()[k] = v
+
+    def __delitem__(self, k):
+        del self._value()[k]
+
+    def __contains__(self, k):
+        return k in self._value()
+
+    def __len__(self):
+        return len(self._value())
+
+    def __iter__(self):
+        return iter(self._value())
+
+def local(factory) -> TenantLocal:
+    return TenantLocal(factory)
+
+def stats() -> dict:
+    return {t.name: t.snapshot() for t in (_all or [DEFAULT])}
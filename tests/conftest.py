@@ -0,0 +1,63 @@
+# Общие фикстуры: БД магазина на обоих хранилищах (storage.py).
+# SQLite — временный файл; PostgreSQL — TEST_PG_DSN или локальный сервер pgserver,
+# на каждый тест — своя свежая база. Нет ни того ни другого — тесты PostgreSQL пропускаются.
+
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("FSM_SWEEP_SEC", "0")
+
+import storage
+import tenants
+
+try:
+    import pgserver
+except ImportError:
+    pgserver = None
+
+@pytest.fixture(scope="session")
+def pg_admin_dsn(tmp_path_factory):
+    """DSN служебной базы PostgreSQL (для CREATE/DROP DATABASE) или skip."""
+    if storage.psycopg is None:
+        pytest.skip("psycopg не установлен")
+    dsn = os.getenv("TEST_PG_DSN")
+    if dsn:
+        yield dsn
+        return
+    if pgserver is None:
+        pytest.skip("нет TEST_PG_DSN и pgserver")
+    srv = pgserver.get_server(str(tmp_path_factory.mktemp("pgdata")), cleanup_mode="stop")
+    yield srv.get_uri()
+    srv.cleanup()
+
+def _with_db(dsn: str, name: str) -> str:
+    base, sep, query = dsn.partition("?")
+    return f"{base.rsplit('/', 1)[0]}/{name}{sep}{query}"
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def shop(request, tmp_path):
+    """Магазин (tenants.Tenant) со схемой Admin_bot.init_db(), активный на время теста."""
+    import Admin_bot
+    if request.param == "sqlite":
+        t = tenants.Tenant("test", None, db_path=str(tmp_path / "store.db"))
+        drop = None
+    else:
+        admin = request.getfixturevalue("pg_admin_dsn")
+        name = f"t_{uuid.uuid4().hex[:12]}"
+        with storage.psycopg.connect(admin, autocommit=True) as con:
+            con.execute(f"CREATE DATABASE {name}")
+        t = tenants.Tenant("test", None, dsn=_with_db(admin, name))
+
+        def drop():
+            storage._stores.pop(t.dsn).close()
+            with storage.psycopg.connect(admin, autocommit=True) as con:
+                con.execute(f"DROP DATABASE {name} WITH (FORCE)")
+    with tenants.use(t):
+        Admin_bot.init_db()
+        yield t
+    if drop:
+        drop()
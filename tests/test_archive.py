@@ -0,0 +1,48 @@
+# Архив заказов (archive.py) и то, что должно его видеть: бэкап, колоночная выгрузка, админка.
+# Архивы — файлы SQLite, поэтому только SQLite.
+
+import os
+
+import pytest
+
+import Admin_bot
+import archive
+import backup
+import columnar_export
+
+@pytest.fixture
+def archived(shop, tmp_path):
+    """Восемь заказов, из них первые пять — трёхлетней давности и перенесены в архивы."""
+    if shop.dsn:
+        pytest.skip("архивы — только для SQLite")
+    cid = Admin_bot.add_category("Мыло")
+    pid = Admin_bot.add_product("Zeta", 10, 1, "", "", cid)
+    ids = [Admin_bot.record_order(i, {pid: 1}, Admin_bot.get_product, chat_id=i) for i in range(8)]
+    with Admin_bot.db() as con, con:
+        for n, oid in enumerate(ids[:5]):
+            con.execute("UPDATE orders SET created_at=? WHERE id=?", (f"2020-0{1 + n % 2}-15 12:00:00", oid))
+    with Admin_bot.db() as con:
+        res = archive.run(con)
+    assert res["orders"] == 5 and len(res["months"]) == 2
+    return ids
+
+def test_archived_order_is_read_only(archived):
+    o = Admin_bot.get_order(archived[0])
+    assert o["archived"] and o["items"][0]["name"] == "Zeta"
+    assert not Admin_bot.update_order_status(archived[0], "Доставка")
+    assert Admin_bot.get_order(archived[0])["status"] == o["status"]
+    assert not Admin_bot.get_order(archived[-1])["archived"]
+    assert Admin_bot.update_order_status(archived[-1], "Доставка")
+
+def test_backup_mirrors_archives(archived, shop, tmp_path):
+    bdir = str(tmp_path / "backups")
+    assert backup.backup_now(shop.db_path, bdir, keep=2)["archives"] == 2
+    assert backup.backup_now(shop.db_path, bdir, keep=2)["archives"] == 0     # не изменились
+    assert sorted(os.listdir(os.path.join(bdir, "archive"))) == [
+        "store-orders-2020-01.db", "store-orders-2020-02.db"]
+
+def test_export_reads_archived_months(archived, shop, tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_ATTACH_MAX", 1)   # месяцы — в разных пачках
+    meta = columnar_export.export(shop.db_path, str(tmp_path / "col"), batch=3)
+    assert meta["rows"] == {"orders": 8, "order_items": 8}
+    assert meta["hwm_order_id"] == max(archived)
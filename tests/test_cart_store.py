@@ -0,0 +1,59 @@
+# Корзины в памяти (cart_store.py): вытеснение и подъём из БД не теряют товары.
+
+import threading
+import time
+
+import cart_store
+
+class SlowSpill:
+    """spill_save/spill_load поверх dict; сохранение ждёт события (окно гонки)."""
+
+    def __init__(self, fail=False):
+        self.rows = {}
+        self.saving = threading.Event()
+        self.proceed = threading.Event()
+        self.fail = fail
+
+    def save(self, uid, items):
+        self.saving.set()
+        self.proceed.wait(5)
+        if self.fail:
+            raise OSError("db down")
+        self.rows[uid] = list(items)
+
+    def load(self, uid):
+        return self.rows.pop(uid, ())
+
+def _evict_in_background(store):
+    th = threading.Thread(target=store.advance, args=(time.monotonic() + 10,))
+    th.start()
+    return th
+
+def _store(spill):
+    return cart_store.CartStore(ttl_sec=1, tick_sec=1, spill_save=spill.save, spill_load=spill.load, start=False)
+
+def test_get_during_spill_waits_for_saved_cart():
+    spill = SlowSpill()
+    store = _store(spill)
+    store.get(1)[7] = 3
+    th = _evict_in_background(store)
+    assert spill.saving.wait(5)                      # корзина уже не в памяти, в БД ещё не записана
+    got = {}
+    reader = threading.Thread(target=lambda: got.update(store.get(1)))
+    reader.start()
+    time.sleep(0.05)
+    assert reader.is_alive()                         # get() ждёт сохранения, а не читает пустую строку
+    spill.proceed.set()
+    th.join(); reader.join(5)
+    assert got == {7: 3}
+    st = store.stats()
+    assert (st["evicted"], st["spilled"], st["restored"]) == (1, 1, 1)
+
+def test_failed_spill_keeps_cart_in_memory():
+    spill = SlowSpill(fail=True)
+    spill.proceed.set()
+    store = _store(spill)
+    store.get(1)[7] = 3
+    assert store.advance(time.monotonic() + 10) == 1
+    assert 1 in store and dict(store.get(1)) == {7: 3}
+    assert store.stats()["spilled"] == 0
@@ -0,0 +1,99 @@
+# Конвейерный приём апдейтов ingest.poll на поддельном боте.
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from types import SimpleNamespace
+
+import ingest
+
+class FakeBot:
+    """getUpdates как у Telegram: всё, что не подтверждено offset'ом; обработка — в пуле."""
+
+    def __init__(self, slow: dict, hang=()):
+        self.updates = []
+        self.slow = slow                 # update_id → threading.Event, которое ждёт обработчик
+        self.hang = set(hang)            # update_id, обработка которых не завершается никогда
+        self.runs = []
+        self.offsets = []
+        self._pool = ThreadPoolExecutor(8)
+
+    def get_updates(self, offset=None, limit=100, timeout=0, long_polling_timeout=0):
+        self.offsets.append(offset)
+        ups = [u for u in self.updates if offset is None or u.update_id >= offset][:limit]
+        if not ups:
+            time.sleep(0.01)
+        return ups
+
+    def _handle(self, uid):
+        self.runs.append(uid)
+        if uid in self.slow:
+            self.slow[uid].wait(5)
+
+    def _submit(self, uid):
+        if uid in self.hang:
+            self.runs.append(uid)
+            return Future()
+        return self._pool.submit(self._handle, uid)
+
+    def process_new_updates(self, updates):
+        return [self._submit(u.update_id) for u in updates]
+
+class MemOffsets:
+    def __init__(self):
+        self.value = None
+
+    def load(self):
+        return self.value
+
+    def commit(self, update_id):
+        self.value = max(update_id, self.value or 0)
+
+def _wait_for(cond, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not cond() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return cond()
+
+def test_slow_update_holds_offset_but_not_intake(monkeypatch):
+    monkeypatch.setattr(ingest, "INGEST_REFETCH_SEC", 0.02)
+    release = threading.Event()
+    bot = FakeBot(slow={2: release})
+    offsets = MemOffsets()
+    bot.updates = [SimpleNamespace(update_id=i) for i in (1, 2, 3)]
+    threading.Thread(target=ingest.poll, args=(bot, offsets), kwargs={"poll_timeout": 0},
+                     daemon=True).start()
+
+    assert _wait_for(lambda: offsets.value == 1)
+    bot.updates.append(SimpleNamespace(update_id=4))
+    assert _wait_for(lambda: 4 in bot.runs)          # приём не ждёт медленный апдейт
+    time.sleep(0.1)
+    assert offsets.value == 1                        # смещение не обгоняет незавершённый 2
+    assert sorted(bot.runs) == [1, 2, 3, 4]          # повторно полученные не запускаются снова
+
+    release.set()
+    assert _wait_for(lambda: offsets.value == 4)
+    assert sorted(bot.runs) == [1, 2, 3, 4]
+
+def test_hung_update_is_abandoned_after_deadline(monkeypatch):
+    monkeypatch.setattr(ingest, "INGEST_REFETCH_SEC", 0.02)
+    monkeypatch.setattr(ingest, "INGEST_BATCH_TIMEOUT", 0.1)
+    monkeypatch.setattr(ingest, "INGEST_ABANDON_SEC", 0.5)
+    bot = FakeBot(slow={}, hang={2})
+    offsets = MemOffsets()
+    bot.updates = [SimpleNamespace(update_id=i) for i in (1, 2, 3, 4)]
+    before = ingest.stats()
+    # batch=2: за зависшим 2 набирается полная пачка (2, 3), и приём ждёт только её
+    threading.Thread(target=ingest.poll, args=(bot, offsets), kwargs={"poll_timeout": 0, "batch": 2},
+                     daemon=True).start()
+
+    assert _wait_for(lambda: offsets.value == 1)
+    time.sleep(0.2)
+    assert offsets.value == 1 and 4 not in bot.runs   # пачка полна, 2 ещё не брошен
+
+    assert _wait_for(lambda: offsets.value == 4)      # после INGEST_ABANDON_SEC смещение идёт дальше
+    assert sorted(bot.runs) == [1, 2, 3, 4]
+    st = ingest.stats()
+    assert st["abandoned"] - before["abandoned"] == 1
+    assert st["errors"] - before["errors"] == 1
+    assert st["stuck"] - before["stuck"] == 1
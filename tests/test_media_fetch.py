@@ -0,0 +1,79 @@
+# Загрузка медиа (media_fetch.py): отказы из-за бюджета апдейта не записываются в автомат хоста.
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import media_fetch
+
+class _Slow(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(1.0)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.end_headers()
+        self.wfile.write(b"\x89PNG\r\n\x1a\n" + b"0" * 100)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def slow_url():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Slow)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{srv.server_address[1]}/p.png"
+    yield url
+    srv.shutdown()
+    srv.server_close()
+
+def test_budget_timeout_not_held_against_host(slow_url):
+    breaker = media_fetch.breakers.get(media_fetch.host_of(slow_url))
+    with media_fetch.budget(0.3), pytest.raises(media_fetch.BudgetExceeded):
+        media_fetch.fetch(slow_url)
+    assert breaker.fails == 0
+    with media_fetch.budget(5), pytest.raises(media_fetch.MediaError) as e:
+        media_fetch.fetch(slow_url, timeout=(1, 0.3))    # таймаут самого хоста
+    assert not isinstance(e.value, media_fetch.BudgetExceeded)
+    assert breaker.fails == 1
+
+def test_half_open_probe_released_on_budget(slow_url):
+    breaker = media_fetch.breakers.get(media_fetch.host_of(slow_url))
+    breaker._trip()
+    breaker.opened_at -= breaker.open_s                  # пауза истекла — пускаем пробу
+    with media_fetch.budget(0.3), pytest.raises(media_fetch.BudgetExceeded):
+        media_fetch.fetch(slow_url)
+    assert breaker.allow()                               # проба не «зависла»
+
+class _Pages(BaseHTTPRequestHandler):
+    """/page — HTML с og:image под видом PNG; /img — PNG под видом HTML."""
+
+    def do_GET(self):
+        self.send_response(200)
+        if self.path == "/page":
+            self.send_header("Content-Type", "image/png")
+            self.end_headers()
+            self.wfile.write(b'<html><head><meta property="og:image" content="http://cdn.test/a.png"></head>')
+        else:
+            self.send_header("Content-Type", "text/html")
+            self.end_headers()
+            self.wfile.write(b"\x89PNG\r\n\x1a\n" + b"0" * (1 << 20))
+
+    def log_message(self, *args):
+        pass
+
+def test_resolve_sniffs_type_and_caches():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Pages)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{srv.server_address[1]}"
+    try:
+        assert media_fetch.resolve(base + "/page") == "http://cdn.test/a.png"
+        assert media_fetch.resolve(base + "/img") == base + "/img"
+    finally:
+        srv.shutdown()
+        srv.server_close()
+    # из кэша — сервер уже остановлен
+    assert media_fetch.resolve(base + "/page") == "http://cdn.test/a.png"
@@ -0,0 +1,270 @@
+# Репозиторий Admin_bot и хранилища на SQLite и PostgreSQL (фикстура shop — оба варианта).
+
+import io
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import Admin_bot
+import catalog_io
+import storage
+from fsm_store import FSMStore
+from ingest import OffsetStore
+
+def _catalog():
+    cid = Admin_bot.add_category("Мыло")
+    a = Admin_bot.add_product("Zeta", 10.5, 1, "http://img/z.jpg", "z", cid)
+    b = Admin_bot.add_product("alpha", 3, 2, "", "a", cid)
+    return cid, a, b
+
+# ============================ Перевод SQL ============================
+
+def test_translate_subset():
+    t = storage.translate
+    assert t("SELECT a FROM t WHERE b=? AND c LIKE '50%'") == "SELECT a FROM t WHERE b=%s AND c LIKE '50%%'"
+    assert t("INSERT OR IGNORE INTO users(user_id) VALUES (?)").endswith("ON CONFLICT DO NOTHING")
+    assert "lower(name)" in t("SELECT id FROM categories ORDER BY name COLLATE NOCASE")
+    assert "BIGSERIAL PRIMARY KEY" in t("CREATE TABLE x (id INTEGER PRIMARY KEY AUTOINCREMENT, v REAL)")
+    assert t("SELECT '--?' FROM t -- комментарий ?") == "SELECT '--?' FROM t "
+
+@pytest.mark.parametrize("sql", [
+    "INSERT OR REPLACE INTO t VALUES (?)",
+    "BEGIN IMMEDIATE",
+    "SELECT datetime('now')",
+    "SELECT GROUP_CONCAT(a, ';') FROM t",
+    "INSERT OR IGNORE INTO t(a) VALUES (?) RETURNING id",
+    "SELECT name FROM sqlite_master",
+])
+def test_translate_rejects_unsupported(sql):
+    with pytest.raises(storage.UnsupportedSQL):
+        storage.translate(sql)
+
+# ============================ Каталог ============================
+
+def test_catalog_crud(shop):
+    cid, a, b = _catalog()
+    assert [p["name"] for p in Admin_bot.list_products(cid)] == ["alpha", "Zeta"]
+    Admin_bot.update_product(a, price=12.0)
+    assert Admin_bot.get_product(a)["price"] == 12.0
+    assert Admin_bot.client_get_product(a)["price"] == 12.0
+    Admin_bot.delete_product(b)
+    assert Admin_bot.get_product(b) is None
+    assert [p["id"] for p in Admin_bot.client_list_products(cid)] == [a]
+    pp = Admin_bot.add_pickup_point("Адрес", 44.8, 20.4)
+    assert Admin_bot.client_get_pickup_point(pp)["lat"] == 44.8
+    Admin_bot.set_min_delivery_sum(150)
+    assert Admin_bot.client_get_min_delivery_sum() == 150.0
+
+def test_stale_catalog_snapshot_not_installed(shop, monkeypatch):
+    _, a, _ = _catalog()
+    grid = Admin_bot.GridIndex
+
+    def write_during_load(points):       # запись и инвалидация посреди load_catalog
+        monkeypatch.setattr(Admin_bot, "GridIndex", grid)
+        Admin_bot.update_product(a, price=99.0)
+        return grid(points)
+    monkeypatch.setattr(Admin_bot, "GridIndex", write_during_load)
+    Admin_bot.invalidate_catalog()
+    assert Admin_bot.load_catalog()["products"][a]["price"] == 10.5
+    assert Admin_bot.client_get_product(a)["price"] == 99.0
+
+def test_posts_feed(shop):
+    p1 = Admin_bot.add_post("Новость", "", "one", "t", None)
+    p2 = Admin_bot.add_post("Акция", "", "two", "t", None)
+    Admin_bot.add_post("Новость", "", "later", "t", "2999-01-01 00:00:00")
+    posts, more = Admin_bot.list_feed(limit=1)
+    assert [p["id"] for p in posts] == [p2] and more
+    posts, more = Admin_bot.list_feed(before_id=p2, limit=1)
+    assert [p["id"] for p in posts] == [p1] and not more
+    assert Admin_bot.next_scheduled_post_at() == "2999-01-01 00:00:00"
+
+def test_stale_feed_page_not_installed(shop, monkeypatch):
+    Admin_bot.add_post("Новость", "", "one", "t", None)
+    scheduled = Admin_bot.next_scheduled_post_at
+
+    def post_during_load(now_iso=None):  # новый пост посреди feed_first_page
+        monkeypatch.setattr(Admin_bot, "next_scheduled_post_at", scheduled)
+        Admin_bot.add_post("Новость", "", "two", "t", None)
+        return scheduled(now_iso)
+    monkeypatch.setattr(Admin_bot, "next_scheduled_post_at", post_during_load)
+    Admin_bot.invalidate_feed()
+    assert [p["title"] for p in Admin_bot.feed_first_page()[0]] == ["one"]
+    assert [p["title"] for p in Admin_bot.client_feed_page()[0]] == ["two", "one"]
+
+# ============================ Заказы ============================
+
+def test_orders(shop):
+    cid, a, b = _catalog()
+    uid = 9_000_000_001                  # больше int4 — как реальные id Telegram
+    Admin_bot.upsert_username(uid, "u")
+    oid = Admin_bot.record_order(uid, {a: 2, b: 1}, Admin_bot.get_product, chat_id=uid, update_id=100)
+    assert Admin_bot.record_order(uid, {a: 5}, Admin_bot.get_product, chat_id=uid, update_id=100) == oid
+    o = Admin_bot.get_order(oid)
+    assert o["total"] == 24.0 and o["username"] == "u"
+    assert [(i["name"], i["qty"]) for i in o["items"]] == [("Zeta", 2), ("alpha", 1)]
+    assert [x["id"] for x in Admin_bot.list_orders_by_user(uid)] == [oid]
+    stats = Admin_bot.stats_get_products(datetime(2000, 1, 1), datetime(2999, 1, 1))
+    assert [(s["name"], s["total_qty"]) for s in stats] == [("Zeta", 2), ("alpha", 1)]
+
+def test_snapshot_backfill_in_background(shop):
+    cid, a, b = _catalog()
+    oid = Admin_bot.record_order(1, {a: 1, b: 2}, Admin_bot.get_product, chat_id=1)
+    with Admin_bot.db() as con, con:
+        con.execute("UPDATE orders SET items_snapshot=NULL WHERE id=?", (oid,))
+    if not shop.dsn:                     # в SQLite внешние ключи не проверяются — товар можно удалить
+        Admin_bot.delete_product(b)
+    names = [i["name"] for i in Admin_bot.get_order(oid)["items"]]
+    assert names == ["Zeta", "alpha" if shop.dsn else f"Товар #{b}"]
+    Admin_bot.init_db()                  # заполнение снимков — в фоновом потоке
+    for _ in range(100):
+        with Admin_bot.db() as con:
+            if con.execute("SELECT items_snapshot FROM orders WHERE id=?", (oid,)).fetchone()[0]:
+                break
+        time.sleep(0.05)
+    assert [i["name"] for i in Admin_bot.get_order(oid)["items"]] == names
+
+def test_bulk_status(shop):
+    cid, a, _ = _catalog()
+    ids = [Admin_bot.record_order(i, {a: 1}, Admin_bot.get_product, chat_id=i) for i in range(1, 6)]
+    assert Admin_bot.count_orders("Принят", ids=ids[:2]) == 2
+    moved = Admin_bot.bulk_update_order_status("Принят", "Сборка", ids=ids[:2])
+    assert moved == [{"id": ids[0], "chat_id": 1}, {"id": ids[1], "chat_id": 2}]
+    assert Admin_bot.bulk_update_order_status("Принят", "Сборка", ids=ids[:2]) == []
+    moved = Admin_bot.bulk_update_order_status("Принят", "Доставка", before="2999-01-01 00:00:00")
+    assert [m["id"] for m in moved] == ids[2:]
+    assert len(Admin_bot.list_orders_page("Сборка")) == 2
+
+# ============================ Уведомления ============================
+
+def test_notify_and_fetch_due(shop):
+    Admin_bot.notify_many([(1, "Заказ #1: Принят", "order:1"), (1, "Заказ #1: Сборка", "order:1"),
+                           (1, "Новость", None), (2, "Привет", None)], window_s=0)
+    due = Admin_bot.fetch_due_notifications(datetime.utcnow() + timedelta(seconds=1))
+    assert sorted(r["text"] for r in due) == ["Заказ #1: Сборка", "Новость", "Привет"]
+    msgs = {m["chat_id"]: m for m in Admin_bot.merge_notifications(due)}
+    assert msgs[1]["count"] == 2 and msgs[2]["text"] == "Привет"
+    assert Admin_bot.fetch_due_notifications(datetime.utcnow() + timedelta(seconds=1)) == []
+
+def test_fetch_due_claims_each_row_once(shop):
+    Admin_bot.notify_many([(i, f"n{i}", None) for i in range(200)], window_s=0)
+    now = datetime.utcnow() + timedelta(seconds=1)
+    got = []
+
+    def claim():
+        for _ in range(5):
+            got.extend(r["id"] for r in Admin_bot.fetch_due_notifications(now))
+    ths = [threading.Thread(target=Admin_bot.tenants.bound(claim)) for _ in range(4)]
+    for t in ths:
+        t.start()
+    for t in ths:
+        t.join()
+    assert len(got) == len(set(got)) == 200
+
+def test_one_pending_row_per_topic(shop):
+    Admin_bot.notify_many([(1, "a", "order:1")], window_s=60)
+    with Admin_bot.db() as con, pytest.raises(storage.IntegrityError):
+        with con:
+            con.execute("INSERT INTO notifications(chat_id, text, send_at, sent, topic) "
+                        "VALUES (1, 'b', '2000-01-01 00:00:00', 0, 'order:1')")
+    Admin_bot.notify_many([(1, "c", "order:1")], window_s=60)
+    with Admin_bot.db() as con:
+        rows = con.execute("SELECT text FROM notifications WHERE sent=0").fetchall()
+    assert [r["text"] for r in rows] == ["c"]
+
+# ============================ FSM и смещение ============================
+
+def test_fsm_store(shop):
+    fsm = FSMStore(Admin_bot.connect, sweep_sec=0)
+    fsm[7] = {"action": "adm_add_product", "name": "x"}
+    assert FSMStore(Admin_bot.connect, sweep_sec=0).get(7)["name"] == "x"   # пережило «перезапуск»
+    assert fsm.pop(7)["action"] == "adm_add_product"
+    assert FSMStore(Admin_bot.connect, sweep_sec=0).get(7) is None
+
+def test_offsets_monotonic(shop):
+    offsets = OffsetStore(Admin_bot.connect, name="t")
+    assert offsets.load() is None
+    offsets.commit(10)
+    offsets.commit(5)
+    assert offsets.load() == 10
+
+# ============================ Импорт / экспорт ============================
+
+def test_catalog_import_export(shop):
+    cid, a, _ = _catalog()
+    data = "id;name;category;price\n;Новый;Шампунь;5\n{};;;;\n{};Zeta2;;11\n".format(999, a).encode()
+    with Admin_bot.db() as con:
+        rep = catalog_io.import_catalog(con, "c.csv", data)
+    assert (rep["inserted"], rep["updated"], rep["categories_created"]) == (1, 1, 1)
+    assert len(rep["errors"]) == 1
+    # id, выданные импортом, не сталкиваются с автоинкрементом
+    new_pid = Admin_bot.add_product("После", 1, 1, "", "", cid)
+    assert new_pid > max(p["id"] for p in Admin_bot.catalog()["products"].values() if p["id"] != new_pid)
+    buf = io.BytesIO()
+    with Admin_bot.db() as con:
+        n = catalog_io.export_csv(con, buf)
+    text = buf.getvalue().decode("utf-8-sig")
+    assert n == 4 and "Zeta2" in text and "Шампунь" in text
+
+def test_import_rejects_non_finite_and_huge_numbers(shop):
+    _catalog()
+    data = ("name;category;price;min_qty\nA;Мыло;nan;1\nB;Мыло;inf;1\nC;Мыло;1e999;1\n"
+            "D;Мыло;1;1e300\nE;Мыло;2;1\n").encode()
+    with Admin_bot.db() as con:
+        rep = catalog_io.import_catalog(con, "c.csv", data)
+    assert rep["inserted"] == 1 and [n for n, _ in rep["errors"]] == [2, 3, 4, 5]
+    assert rep["aborted"] is None
+
+def test_import_abort_keeps_written_batches(shop, monkeypatch):
+    _catalog()
+    rows = "".join(f"N{i};Мыло;{i}\n" for i in range(5))
+    real = catalog_io.iter_csv
+
+    def broken(data):                    # файл «обрывается» после пяти строк
+        yield from real(data)
+        raise OSError("обрыв файла")
+    monkeypatch.setattr(catalog_io, "iter_csv", broken)
+    with Admin_bot.db() as con:
+        rep = catalog_io.import_catalog(con, "c.csv", ("name;category;price\n" + rows).encode(), batch=2)
+    assert rep["aborted"] == "OSError: обрыв файла"
+    assert rep["inserted"] == 4          # две записанные пачки, пятая строка откатилась
+    assert len(Admin_bot.list_products(Admin_bot.client_list_categories()[0]["id"])) == 2 + 4
+
+@pytest.mark.skipif(catalog_io.openpyxl is None, reason="нет openpyxl")
+def test_xlsx_export_import_roundtrip(shop):
+    _catalog()
+    buf = io.BytesIO()
+    with Admin_bot.db() as con:
+        assert catalog_io.export_xlsx(con, buf) == 2
+        rep = catalog_io.import_catalog(con, "c.xlsx", buf.getvalue())
+    assert (rep["updated"], rep["inserted"], rep["errors"]) == (2, 0, [])
+
+# ============================ Пул PostgreSQL ============================
+
+def test_pool_survives_errors_and_leaks(shop):
+    if not shop.dsn:
+        pytest.skip("только PostgreSQL")
+    pool = storage.get(shop.dsn).pool
+    for _ in range(pool.maxsize + 2):
+        with pytest.raises(Exception):
+            Admin_bot.list_orders_page("Принят", offset="zz")
+    for _ in range(pool.maxsize + 2):
+        con = Admin_bot.connect()
+        con.execute("SELECT 1")
+        del con
+    assert Admin_bot.list_orders_page("Принят") == []
+    errors = []
+
+    def work(i):
+        try:
+            for _ in range(10):
+                Admin_bot.upsert_username(i, f"u{i}")
+        except Exception as e:
+            errors.append(e)
+    ths = [threading.Thread(target=Admin_bot.tenants.bound(work), args=(i,)) for i in range(3 * pool.maxsize)]
+    for t in ths:
+        t.start()
+    for t in ths:
+        t.join()
+    assert not errors and pool.stats()["size"] <= pool.maxsize
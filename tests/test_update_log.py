@@ -0,0 +1,67 @@
+# Анонимизация лога апдейтов (update_log.py): PII не остаётся ни под одним ключом.
+
+import json
+
+import update_log
+
+def _message(**extra):
+    msg = {"message_id": 5, "date": 0,
+           "from": {"id": 42, "is_bot": False, "first_name": "Ivan", "username": "ivan"},
+           "chat": {"id": 42, "type": "private", "first_name": "Ivan", "username": "ivan"}}
+    msg.update(extra)
+    return {"update_id": 1, "message": msg}
+
+def test_scrub_nested_users_and_chats():
+    u = _message(
+        forward_from={"id": 77, "is_bot": False, "first_name": "Petr", "last_name": "Sidorov", "username": "petr"},
+        forward_from_chat={"id": -100500, "type": "channel", "title": "Secret channel", "username": "secretch"},
+        forward_sender_name="Anna Karenina",
+        forward_signature="Anna",
+        via_bot={"id": 9, "is_bot": True, "first_name": "Helper", "username": "helperbot"},
+        new_chat_members=[{"id": 5, "is_bot": False, "first_name": "Newbie", "username": "newbie"}],
+        left_chat_member={"id": 6, "is_bot": False, "first_name": "Leaver"},
+        venue={"location": {"latitude": 55.75123, "longitude": 37.61789},
+               "title": "Home", "address": "Tverskaya 1", "foursquare_id": "4b0"},
+        reply_to_message={"message_id": 4, "date": 0, "text": "secret 123",
+                          "from": {"id": 77, "is_bot": False, "first_name": "Petr"},
+                          "chat": {"id": 42, "type": "private", "first_name": "Ivan"}},
+    )
+    a = update_log.Anonymizer(salt=b"test")
+    out = a.scrub(u)
+    dump = json.dumps(out, ensure_ascii=False)
+    for pii in ("Ivan", "ivan", "Petr", "Sidorov", "petr", "Secret", "secretch", "Anna", "Karenina",
+                "Helper", "helperbot", "Newbie", "newbie", "Leaver", "Home", "Tverskaya", "secret",
+                "4b0", "55.75123", "37.61789", "100500"):
+        assert pii not in dump, pii
+
+    m = out["message"]
+    assert m["forward_from"]["id"] == m["reply_to_message"]["from"]["id"] == a.pseudo_id(77)
+    assert m["new_chat_members"][0]["id"] == a.pseudo_id(5)
+    assert m["via_bot"]["is_bot"] is True
+    assert m["forward_from_chat"]["type"] == "channel"
+    assert m["venue"]["location"] == {"latitude": 55.75, "longitude": 37.62}
+    assert m["reply_to_message"]["text"] == "xxxxxx 000"
+
+def test_scrub_keeps_commands_and_buttons():
+    a = update_log.Anonymizer(salt=b"test", keep_texts={"🛒 Корзина"})
+    assert a.scrub(_message(text="/start"))["message"]["text"] == "/start"
+    # аргументы команды — данные пользователя: маскируются, как любой текст
+    assert a.scrub(_message(text="/start ref_ivan79"))["message"]["text"] == "/start xxxxxxxx00"
+    assert a.scrub(_message(text="/order@shopbot 12 Ivan"))["message"]["text"] == "/order@shopbot 00 xxxx"
+    assert a.scrub(_message(text="🛒 Корзина"))["message"]["text"] == "🛒 Корзина"
+    cq = {"update_id": 2, "callback_query": {"id": "77", "data": "add:5", "chat_instance": "1",
+                                             "from": {"id": 42, "is_bot": False, "first_name": "Ivan"}}}
+    out = a.scrub(cq)["callback_query"]
+    assert out["data"] == "add:5" and out["id"] == "77"
+
+def test_writer_skips_redelivered_updates(tmp_path):
+    path = str(tmp_path / "updates.jsonl")
+    w = update_log.UpdateLogWriter(path, update_log.Anonymizer(salt=b"test"))
+    first = [_message(text="/start"), dict(_message(text="hi"), update_id=2)]
+    w.write(first)
+    w.write(first + [dict(_message(text="hi"), update_id=3)])   # getUpdates с тем же offset
+    w.write(first)
+    w.close()
+    ids = [u["update_id"] for _, u in update_log.read_log(path)]
+    assert ids == [1, 2, 3]
+    assert w.written == 3 and w.skipped == 4
@@ -0,0 +1,21 @@
+# Прогрев (warmup.py): у каждого магазина своё состояние готовности.
+
+import Admin_bot
+import tenants
+import warmup
+
+def test_status_is_per_shop(tmp_path):
+    a = tenants.Tenant("a", None, db_path=str(tmp_path / "a.db"))
+    b = tenants.Tenant("b", None, db_path=str(tmp_path / "b.db"))
+    with tenants.use(a):
+        warmup.warm_start(background=False)
+        Admin_bot.add_category("Чай")
+        Admin_bot.invalidate_catalog()
+        warmup.warm_start(background=False)
+    with tenants.use(b):
+        assert not warmup.is_ready()
+        warmup.warm_start(background=False)
+        assert warmup.status()["catalog"]["categories"] == 0
+    with tenants.use(a):
+        st = warmup.status()
+        assert st["ready"] and st["catalog"]["categories"] == 1
@@ -0,0 +1,285 @@
+# update_log.py
+# Запись реального потока апдейтов (анонимизированно) и его воспроизведение.
+#
+# Запись: main.py при UPDATE_LOG=/data/updates.jsonl.gz вызывает install_capture() —
+# каждый полученный через getUpdates апдейт дописывается строкой {"t": <unix time>, "u": {...}}.
+# Повторно полученные апдейты (ingest.poll перезапрашивает getUpdates, пока предыдущие
+# ещё в работе, и Telegram отдаёт их снова) пропускаются по update_id: в логе — по разу.
+# Идентификаторы пользователей/чатов заменяются на HMAC-псевдонимы, имена/телефоны/файлы
+# вычищаются, свободный текст маскируется с сохранением длины (кнопки и сами команды
+# остаются, аргументы команд — маскируются).
+#
+# Реплей против заглушки Bot API:
+#   python update_log.py replay /data/updates.jsonl.gz --db store.db --speed 10
+#   python update_log.py replay log.jsonl --speed max --lanes 16
+
+import argparse
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from telebot import apihelper
+
+# ============================ Анонимизация ============================
+
+# Строки, которые пишет пользователь или которые его называют
+_FREE_TEXT = ("text", "caption", "forward_sender_name", "forward_signature", "author_signature")
+_PERSON_KEYS = ("first_name", "last_name", "username", "title")
+
+def _is_person(d: dict) -> bool:
+    """Объект User/Chat Bot API: id плюс имя, username или название."""
+    return "id" in d and any(k in d for k in _PERSON_KEYS)
+
+class Anonymizer:
+    """
+    Детерминированная (в пределах соли) замена идентификаторов и очистка PII.
+    Соль берётся из UPDATE_LOG_SALT, иначе случайная на процесс — тогда псевдонимы
+    стабильны только в пределах одного запуска.
+    """
+
+    def __init__(self, salt: bytes | None = None, keep_texts: set | None = None):
+        env_salt = os.getenv("UPDATE_LOG_SALT")
+        self.salt = salt or (env_salt.encode() if env_salt else os.urandom(16))
+        self.keep_texts = set(keep_texts or ())
+
+    def pseudo_id(self, real_id: int) -> int:
+        d = hmac.new(self.salt, str(real_id).encode(), hashlib.sha256).digest()
+        # Положительный id в диапазоне, не пересекающемся с реальными маленькими id
+        return 1_000_000_000 + int.from_bytes(d[:6], "big") % 1_000_000_000
+
+    @staticmethod
+    def _mask(s: str) -> str:
+        return re.sub(r"\w", lambda m: "0" if m.group(0).isdigit() else "x", s)
+
+    def text(self, s: str) -> str:
+        if not isinstance(s, str):
+            return s
+        if s in self.keep_texts or s.strip().lower() == "demo admin":
+            return s
+        if s.startswith("/"):
+            # сама команда остаётся, аргументы (payload deep link'а и т. п.) — маскируются
+            cmd = re.match(r"/\S*", s).group(0)
+            return cmd + self._mask(s[len(cmd):])
+        return self._mask(s)
+
+    def _person(self, p: dict) -> dict:
+        out = {"id": self.pseudo_id(p["id"]) if "id" in p else 0}
+        for k in ("is_bot", "type", "language_code"):
+            if k in p:
+                out[k] = p[k]
+        out["first_name"] = "U"
+        if p.get("username"):
+            out["username"] = f"u{out['id']}"
+        return out
+
+    def _location(self, v: dict) -> dict:
+        # ~1 км точности достаточно для профиля нагрузки
+        return {"latitude": round(v.get("latitude", 0), 2), "longitude": round(v.get("longitude", 0), 2)}
+
+    def scrub(self, obj):
+        if isinstance(obj, list):
+            return [self.scrub(x) for x in obj]
+        if not isinstance(obj, dict):
+            return obj
+        if _is_person(obj):
+            # пользователь или чат под любым ключом: forward_from, via_bot, new_chat_members, ...
+            return self._person(obj)
+        res = {}
+        for k, v in obj.items():
+            if k in ("from", "chat", "user", "sender_chat") and isinstance(v, dict):
+                res[k] = self._person(v)
+            elif k in _FREE_TEXT:
+                res[k] = self.text(v)
+            elif k == "venue" and isinstance(v, dict):
+                res[k] = {"location": self._location(v.get("location") or {}),
+                          "title": self.text(v.get("title", "")), "address": self.text(v.get("address", ""))}
+            elif k == "contact" and isinstance(v, dict):
+                res[k] = {"phone_number": "+0000000000", "first_name": "U"}
+                if v.get("user_id"):
+                    res[k]["user_id"] = self.pseudo_id(v["user_id"])
+            elif k == "location" and isinstance(v, dict):
+                res[k] = self._location(v)
+            elif k in ("photo", "document", "voice", "video", "sticker", "animation", "audio"):
+                res[k] = {"file_id": "anon", "file_unique_id": "anon"} if isinstance(v, dict) else \
+                         [{"file_id": "anon", "file_unique_id": "anon", "width": 1, "height": 1}]
+            else:
+                res[k] = self.scrub(v)
+        return res
+
+# ============================ Запись ============================
+
+# Сколько последних update_id помнить для отсева повторов (с запасом к INGEST_BATCH)
+_SEEN_MAX = 10_000
+
+class UpdateLogWriter:
+    """Append-only лог: одна компактная JSON-строка на апдейт, .gz — сжатие на лету."""
+
+    def __init__(self, path: str, anonymizer: Anonymizer):
+        self.path = path
+        self.anon = anonymizer
+        self._lock = threading.Lock()
+        opener = gzip.open if path.endswith(".gz") else open
+        self._fh = opener(path, "at", encoding="utf-8")
+        self._seen = set()
+        self._seen_order = deque()
+        self.written = 0
+        self.skipped = 0
+
+    def _fresh(self, updates: list) -> list:
+        """Апдейты, которых ещё не было в логе; запоминает их update_id (под self._lock)."""
+        fresh = []
+        for u in updates:
+            uid = u.get("update_id")
+            if uid in self._seen:
+                continue
+            if uid is not None:
+                self._seen.add(uid)
+                self._seen_order.append(uid)
+                if len(self._seen_order) > _SEEN_MAX:
+                    self._seen.discard(self._seen_order.popleft())
+            fresh.append(u)
+        self.skipped += len(updates) - len(fresh)
+        return fresh
+
+    def write(self, updates: list):
+        if not updates:
+            return
+        now = round(time.time(), 3)
+        with self._lock:
+            fresh = self._fresh(updates)
+            if not fresh:
+                return
+            lines = "".join(
+                json.dumps({"t": now, "u": self.anon.scrub(u)}, ensure_ascii=False, separators=(",", ":")) + "\n"
+                for u in fresh
+            )
+            self._fh.write(lines)
+            self._fh.flush()
+            self.written += len(fresh)
+
+    def close(self):
+        with self._lock:
+            self._fh.close()
+
+def install_capture(path: str, keep_texts: set | None = None) -> UpdateLogWriter:
+    """
+    Перехватывает apihelper.get_updates: сырые апдейты пишутся в лог до того,
+    как telebot превратит их в объекты.
+    """
+    writer = UpdateLogWriter(path, Anonymizer(keep_texts=keep_texts))
+    orig = apihelper.get_updates
+
+    def get_updates(*args, **kwargs):
+        res = orig(*args, **kwargs)
+        try:
+            writer.write(res)
+        except Exception as e:
+            print(f"[update_log] write error: {e}")
+        return res
+
+    apihelper.get_updates = get_updates
+    print(f"[update_log] capturing updates to {path}")
+    return writer
+
+def read_log(path: str):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # оборванная последняя строка после падения
+            yield rec["t"], rec["u"]
+
+# ============================ Реплей ============================
+
+def replay(path: str, db: str, speed: float | None, lanes: int, api_delay_ms: float = 0.0) -> dict:
+    """
+    speed=None — максимально быстро; иначе интервалы между апдейтами делятся на speed.
+    Апдейты идут через диспетчер handlers_user (полосы по user_id, число — lanes).
+    Возвращает сводку: задержки обработки, дрейф расписания, ошибки, вызовы API.
+    """
+    from telebot import types
+    from bench_e2e import prepare_bot, summarize, drain
+    from fake_botapi import FakeBotAPI
+    import shutil
+
+    os.environ["WORKER_LANES"] = str(max(1, lanes))
+    fake = FakeBotAPI(delay_ms=api_delay_ms).start()
+    hu, tmpdir = prepare_bot(db, fake)
+    bot = hu.get_bot()
+    records = list(read_log(path))
+    if not records:
+        raise SystemExit("Лог пуст.")
+
+    latencies, lags, drifts = [], [], []
+    errors = [0]
+    lock = threading.Lock()
+
+    def on_done(fut, submitted: float, scheduled: float):
+        t1 = time.perf_counter()
+        with lock:
+            if fut.exception() is not None:
+                errors[0] += 1
+            latencies.append(t1 - submitted)
+            lags.append(t1 - scheduled)
+
+    base_t = records[0][0]
+    start = time.perf_counter()
+    for i, (t, u) in enumerate(records, start=1):
+        u = dict(u, update_id=i)
+        scheduled = start + ((t - base_t) / speed if speed else 0.0)
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        now = time.perf_counter()
+        drifts.append(max(0.0, now - scheduled))
+        for fut in bot.process_new_updates([types.Update.de_json(u)]) or ():
+            fut.add_done_callback(lambda f, s=now, sc=scheduled: on_done(f, s, sc))
+    drain(hu)
+    wall = time.perf_counter() - start
+
+    try:
+        res = summarize(latencies, wall)
+        lags.sort(); drifts.sort()
+        res.update({
+            "speed": speed or "max",
+            "log_span_s": round(records[-1][0] - base_t, 3),
+            "errors": errors[0] + sum(fake.snapshot()["errors"].values()),
+            "drift_mean_ms": round(sum(drifts) / len(drifts) * 1000, 2),
+            "drift_max_ms": round(drifts[-1] * 1000, 2),
+            "lag_p99_ms": round(lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000, 2),
+            "lanes": hu.dispatcher.stats(),
+            "api_calls": fake.snapshot()["calls"],
+        })
+        return res
+    finally:
+        fake.stop()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def main():
+    ap = argparse.ArgumentParser(description="Реплей записанного потока апдейтов")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rp = sub.add_parser("replay")
+    rp.add_argument("log")
+    rp.add_argument("--db", default="store.db", help="исходная БД (копируется)")
+    rp.add_argument("--speed", default="1", help="1, 10, … или max")
+    rp.add_argument("--lanes", type=int, default=8, help="число полос обработки (WORKER_LANES)")
+    rp.add_argument("--api-delay-ms", type=float, default=0.0)
+    args = ap.parse_args()
+
+    speed = None if args.speed == "max" else float(args.speed)
+    res = replay(args.log, args.db, speed, args.lanes, args.api_delay_ms)
+    print(json.dumps(res, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# warmup.py
+# Прогрев перед приёмом трафика (вызывается из main.py до polling).
+# Синхронно и быстро: проверка схемы, каталог и настройки в память, FSM-состояния, лента.
+# После этого бот «готов»; тяжёлое — в фоне:
+#   * выбор картинок для прогрева (агрегат по order_items — секунды на больших БД);
+#   * чтение файла БД целиком (поднимает страницы в page cache ОС — профили, заказы;
+#     для PostgreSQL не нужно — кэшем управляет сервер);
+#   * резолвинг картинок товаров и постов с ограниченным параллелизмом,
+#     популярные товары (по числу проданных штук) — первыми.
+#     Через media_fetch: сессии по хостам, лимиты размера, автоматы хостов.
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import Admin_bot
+import media_fetch
+import storage
+import tenants
+
+WARMUP_IMAGE_WORKERS = int(os.getenv("WARMUP_IMAGE_WORKERS", "4"))
+WARMUP_IMAGE_LIMIT = int(os.getenv("WARMUP_IMAGE_LIMIT", "300"))
+WARMUP_POSTS = int(os.getenv("WARMUP_POSTS", "10"))
+WARMUP_READAHEAD = os.getenv("WARMUP_READAHEAD", "1") == "1"
+
+EXPECTED_TABLES = ("categories", "products", "posts", "settings", "pickup_points", "users",
+                   "orders", "order_items", "notifications", "saved_carts", "fsm_states", "image_health",
+                   "update_offsets", "order_archives", "archived_user_months")
+
+# у каждого магазина свой прогрев (main.py вызывает warm_start() в контексте каждого)
+_status = tenants.local(lambda: {
+    "ready": False,
+    "time_to_ready_ms": None,
+    "catalog": {},
+    "images_total": 0,
+    "images_ok": 0,
+    "images_failed": 0,
+    "images_done_ms": None,
+    "readahead_mb": 0.0,
+})
+_lock = threading.Lock()
+
+def status() -> dict:
+    """Состояние прогрева текущего магазина."""
+    with _lock:
+        return dict(_status._value())
+
+def is_ready() -> bool:
+    return _status["ready"]
+
+# ============================ Синхронная часть ============================
+
+def verify_schema():
+    """Создать/мигрировать таблицы и убедиться, что все нужные на месте."""
+    Admin_bot.init_db()
+    with Admin_bot.db() as con:
+        have = storage.tables(con)
+    missing = [t for t in EXPECTED_TABLES if t not in have]
+    if missing:
+        raise SystemExit(f"[warmup] в БД нет таблиц: {', '.join(missing)}")
+
+def hot_image_urls(limit: int = WARMUP_IMAGE_LIMIT, posts: int = WARMUP_POSTS) -> list:
+    """URL картинок в порядке приоритета: свежие посты, затем товары по популярности."""
+    with Admin_bot.db() as con:
+        post_rows = con.execute("""
+            SELECT image FROM posts
+            WHERE image IS NOT NULL AND image <> '' AND feed_at <= ?
+            ORDER BY feed_at DESC, id DESC
+            LIMIT ?
+        """, (Admin_bot._now_iso(), posts)).fetchall()
+        prod_rows = con.execute("""
+            SELECT p.image
+            FROM products p
+            LEFT JOIN (SELECT product_id, SUM(qty) AS sold FROM order_items GROUP BY product_id) s
+                   ON s.product_id = p.id
+            WHERE p.image IS NOT NULL AND p.image <> ''
+            ORDER BY COALESCE(s.sold, 0) DESC, p.id
+            LIMIT ?
+        """, (limit,)).fetchall()
+    seen, urls = set(), []
+    for r in list(post_rows) + list(prod_rows):
+        u = r[0].strip()
+        if u and u not in seen:
+            seen.add(u)
+            urls.append(u)
+    return urls
+
+# ============================ Фоновая часть ============================
+
+def _readahead(path: str):
+    t0 = time.perf_counter()
+    n = 0
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            n += len(chunk)
+    with _lock:
+        _status["readahead_mb"] = round(n / (1 << 20), 1)
+    print(f"[warmup] readahead {n / (1 << 20):.1f} MiB in {time.perf_counter() - t0:.2f}s")
+
+def _resolve_one(url: str):
+    try:
+        media_fetch.resolve(url)
+        key = "images_ok"
+    except Exception:
+        key = "images_failed"
+    with _lock:
+        _status[key] += 1
+
+def _prefetch_images(urls: list):
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, WARMUP_IMAGE_WORKERS), thread_name_prefix="warm-img") as ex:
+        # map отдаёт задачи пулу в порядке списка — популярные резолвятся первыми
+        list(ex.map(tenants.bound(_resolve_one), urls))
+    ms = round((time.perf_counter() - t0) * 1000)
+    with _lock:
+        _status["images_done_ms"] = ms
+        ok, failed = _status["images_ok"], _status["images_failed"]
+    print(f"[warmup] {tenants.current().name}: images resolved: ok={ok} failed={failed} in {ms} ms")
+
+def _background(db_path: str | None):
+    if WARMUP_READAHEAD and db_path:
+        try:
+            _readahead(db_path)
+        except Exception as e:
+            print(f"[warmup] readahead error: {e}")
+    try:
+        urls = hot_image_urls()
+    except Exception as e:
+        print(f"[warmup] hot images error: {e}")
+        return
+    with _lock:
+        _status["images_total"] = len(urls)
+    print(f"[warmup] images queued={len(urls)}")
+    if urls:
+        _prefetch_images(urls)
+
+# ============================ Точка входа ============================
+
+def warm_start(background: bool = True) -> dict:
+    """
+    Подготовить процесс к приёму апдейтов. Возвращает status() на момент готовности;
+    фоновый прогрев продолжается после возврата.
+    """
+    t0 = time.perf_counter()
+    verify_schema()
+    cat = Admin_bot.load_catalog()
+    len(Admin_bot.admin_fsm)            # поднять сохранённые FSM-состояния
+    Admin_bot.feed_first_page()         # первая страница ленты новостей
+    ms = round((time.perf_counter() - t0) * 1000, 1)
+    with _lock:
+        _status.update({
+            "ready": True,
+            "time_to_ready_ms": ms,
+            "catalog": {"categories": len(cat["categories"]), "products": len(cat["products"]),
+                        "pickup_points": len(cat["pickup_points"])},
+        })
+    print(f"[warmup] {tenants.current().name}: ready in {ms} ms: {_status['catalog']}")
+    if background:
+        dsn = Admin_bot.db_dsn()
+        db_path = None if storage.is_postgres(dsn) else dsn
+        threading.Thread(target=tenants.bound(_background), args=(db_path,), name="warmup",
+                         daemon=True).start()
+    return status()